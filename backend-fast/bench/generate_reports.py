@@ -0,0 +1,95 @@
+"""Generate synthetic Kometa missing reports for benchmarking.
+
+    python bench/generate_reports.py /tmp/bench/reports --items 100000 --categories 300
+
+Media are spread over `--files` report files, one library per file, each
+media listed under one to three categories. Titles are drawn from a small
+vocabulary so searches match realistically many rows. The same arguments
+and `--seed` always produce the same reports.
+"""
+
+import argparse
+import json
+import random
+
+from pathlib import Path
+
+WORDS = (
+    "love night dark star war king man woman city blood dead house last time "
+    "world life secret lost girl boy story return rise fall day black white "
+    "red blue fire ice moon sun road home game heart ghost shadow dream iron "
+    "wild summer winter midnight golden silent hidden broken little big"
+).split()
+
+CATEGORY_PREFIXES = ("IMDb", "TMDb", "Trakt", "Letterboxd", "MDBList", "AniList")
+CATEGORY_KINDS = ("Popular", "Top Rated", "Trending", "Watchlist", "Collection")
+
+
+def title(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+def category_names(count):
+    names = []
+    for i in range(count):
+        prefix = CATEGORY_PREFIXES[i % len(CATEGORY_PREFIXES)]
+        kind = CATEGORY_KINDS[(i // len(CATEGORY_PREFIXES)) % len(CATEGORY_KINDS)]
+        names.append(f"{prefix} {kind} {i}")
+    return names
+
+
+def generate(output, items, categories, files, show_ratio=0.3, seed=0):
+    """Write the reports; returns the number of movies and shows in them."""
+    rng = random.Random(seed)
+    output.mkdir(parents=True, exist_ok=True)
+    names = category_names(categories)
+
+    # category -> {"movie": {id: title}, "show": {id: title}}
+    listed = {name: {"movie": {}, "show": {}} for name in names}
+    shows = int(items * show_ratio)
+    for i in range(items):
+        media_type = "show" if i < shows else "movie"
+        media_id = 70000 + i if media_type == "show" else 1 + i
+        media_title = title(rng)
+        for name in rng.sample(names, rng.randint(1, min(3, len(names)))):
+            listed[name][media_type][media_id] = media_title
+
+    for n in range(files):
+        with open(output / f"report_{n:03}.yml", "w", encoding="utf-8") as f:
+            for name in names[n::files]:
+                f.write(f"{json.dumps(name)}:\n")
+                for media_type, suffix in (
+                    ("movie", "Movies Missing (TMDb IDs)"),
+                    ("show", "Shows Missing (TVDb IDs)"),
+                ):
+                    if not listed[name][media_type]:
+                        continue
+                    f.write(f"  {json.dumps(suffix)}:\n")
+                    for media_id, media_title in listed[name][media_type].items():
+                        f.write(f"    {media_id}: {json.dumps(media_title)}\n")
+    return items - shows, shows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--show-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    movies, shows = generate(
+        args.output,
+        args.items,
+        args.categories,
+        args.files,
+        args.show_ratio,
+        args.seed,
+    )
+    print(f"Wrote {movies} movies and {shows} shows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Time ingestion, enrichment and the API against generated reports.
+
+    python bench/run.py --items 100000 --workdir /tmp/kompletionist-bench
+
+Generates reports (unless `--reports` points at existing ones), starts
+`stubs.py` in a subprocess and points the backend at it, then reports:
+
+- how long parsing the reports and `save_to_sqlite` take, fresh and again
+  with nothing changed;
+- how many details enrichment fetches and commits per second over
+  `--enrich-seconds`;
+- p50/p99 latency of every `/api` route over `--requests` requests each,
+  served in-process through the ASGI app with varied parameters.
+
+The database and image cache live in `--workdir`, which is wiped first
+unless `--keep-db` is given. `--json` also writes the results to a file so
+runs can be compared.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+from generate_reports import WORDS, generate
+from stubs import GENRES
+
+# The backend package this script belongs to; its directory name isn't a
+# valid identifier, so it is imported by path.
+PACKAGE = Path(__file__).resolve().parents[1]
+BENCH = Path(__file__).resolve().parent
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, round(time.perf_counter() - started, 3)
+
+
+def start_stubs(args):
+    stubs = subprocess.Popen(
+        [
+            sys.executable,
+            str(BENCH / "stubs.py"),
+            f"--port={args.stub_port}",
+            f"--latency={args.latency}",
+            f"--jitter={args.jitter}",
+            f"--rate-limit={args.rate_limit}",
+            f"--throttle-ratio={args.throttle_ratio}",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    stubs.stdout.readline()  # Wait for it to listen
+    return stubs
+
+
+def configure(args):
+    """Point the settings at the stubs and the work directory."""
+    base = f"http://127.0.0.1:{args.stub_port}"
+    tvdb = f"http://127.0.0.1:{args.stub_port + 1}"
+    images = f"http://127.0.0.1:{args.stub_port + 2}"
+    os.environ.update(
+        TMDB_API_URL=f"{base}/3",
+        TVDB_API_URL=f"{tvdb}/v4",
+        TMDB_IMAGE_URL=f"{images}/t/p",
+        TVDB_IMAGE_URL=images,
+        OVERSEERR_URL=f"http://127.0.0.1:{args.stub_port + 3}",
+    )
+    for name in ("TMDB_API_KEY", "TVDB_API_KEY", "OVERSEERR_API_KEY"):
+        os.environ.setdefault(name, "bench")
+    os.chdir(args.workdir)
+    sys.path.insert(0, str(PACKAGE.parent))
+
+
+def module(name):
+    return importlib.import_module(f"{PACKAGE.name}.{name}")
+
+
+def bench_ingestion(reports):
+    utils = module("collection.utils")
+    results = {}
+
+    (movies, shows), results["parse_seconds"] = timed(
+        utils.parse_yaml_files, str(reports)
+    )
+    utils.init_db()
+    _, results["save_seconds"] = timed(utils.save_to_sqlite, movies, shows)
+    _, results["resave_seconds"] = timed(utils.save_to_sqlite, movies, shows)
+    results["movies"] = len(movies)
+    results["shows"] = len(shows)
+    return results
+
+
+async def bench_enrichment(seconds):
+    utils = module("collection.utils")
+    database = module("config").get_database()
+
+    def enriched():
+        with database.read() as conn:
+            return sum(
+                conn.execute(
+                    f"SELECT COUNT(*) FROM {table} WHERE details IS NOT NULL"
+                ).fetchone()[0]
+                for table in ("movies", "shows")
+            )
+
+    before = enriched()
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(utils.fetch_media_details(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    progress = utils.enrichment_progress.snapshot()
+    committed = enriched() - before
+    return {
+        "seconds": round(elapsed, 2),
+        "fetched": progress["done"],
+        "failed": progress["failed"],
+        "committed": committed,
+        "fetched_per_second": round(progress["done"] / elapsed, 1),
+        "committed_per_second": round(committed / elapsed, 1),
+        "rate_limits": utils.get_rate_limiter().stats(),
+    }
+
+
+def route_samples():
+    """Ids, categories and pages to vary the requests with."""
+    database = module("config").get_database()
+    with database.read() as conn:
+        samples = {
+            table: [
+                row[0]
+                for row in conn.execute(
+                    f"SELECT id FROM {table} ORDER BY random() LIMIT 1000"
+                )
+            ]
+            for table in ("movies", "shows")
+        }
+        samples["categories"] = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM categories ORDER BY random() LIMIT 1000"
+            )
+        ]
+    return samples
+
+
+def routes(samples, rng):
+    """`/api` routes by name, each a function returning a request path."""
+    page = lambda: rng.randint(1, 50)
+    sorts = ("title", "rating", "popularity", "release_date")
+    routes = {
+        "search": lambda: f"/api/search?query={rng.choice(WORDS)}&page={page()}",
+        "suggest": lambda: f"/api/suggest?query={rng.choice(WORDS)[:rng.randint(1, 5)]}",
+        "movies": lambda: f"/api/movies?page={page()}",
+        "movies (search)": lambda: f"/api/movies?search_query={rng.choice(WORDS)}",
+        "movies (availability)": lambda: f"/api/movies?page={page()}&availability=missing",
+        "movies (sorted)": lambda: (
+            f"/api/movies?page={page()}&sort={rng.choice(sorts)}&year_min=1990"
+        ),
+        "movies (genre)": lambda: (
+            f"/api/movies?genre={rng.choice(GENRES)}&sort=rating&rating_min=5"
+        ),
+        "movies (facets)": lambda: (
+            f"/api/movies?genre={rng.choice(GENRES)}&year_min=1990&facets=true"
+        ),
+        "movie": lambda: f"/api/movies/{rng.choice(samples['movies'])}",
+        "shows": lambda: f"/api/shows?page={page()}",
+        "show": lambda: f"/api/shows/{rng.choice(samples['shows'])}",
+        "categories": lambda: f"/api/categories/?page={rng.randint(1, 10)}",
+        "category": lambda: f"/api/categories/{rng.choice(samples['categories'])}",
+        "category (sorted)": lambda: (
+            f"/api/categories/{rng.choice(samples['categories'])}?sort=popularity"
+        ),
+        "status": lambda: "/api/status",
+    }
+    if not samples["movies"]:
+        del routes["movie"]
+    if not samples["shows"]:
+        del routes["show"]
+    return routes
+
+
+async def bench_routes(requests, seed):
+    import httpx
+
+    app = module("main").app
+    rng = random.Random(seed)
+    samples = route_samples()
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for name, path in routes(samples, rng).items():
+            timings = []
+            errors = 0
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = await client.get(path())
+                timings.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code >= 500
+            timings.sort()
+            results[name] = {
+                "p50_ms": round(statistics.median(timings), 2),
+                "p99_ms": round(timings[int(len(timings) * 0.99) - 1], 2),
+                "mean_ms": round(statistics.fmean(timings), 2),
+                "errors": errors,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workdir", type=Path, default=Path("/tmp/kompletionist-bench")
+    )
+    parser.add_argument("--reports", type=Path)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--enrich-seconds", type=float, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds")
+    parser.add_argument("--jitter", type=float, default=20, help="milliseconds")
+    parser.add_argument("--rate-limit", type=int, default=0, help="per second")
+    parser.add_argument("--throttle-ratio", type=float, default=0.0)
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    args = parser.parse_args()
+
+    args.workdir = args.workdir.resolve()
+    if not args.keep_db and args.workdir.exists():
+        shutil.rmtree(args.workdir)
+    args.workdir.mkdir(parents=True, exist_ok=True)
+
+    reports = args.reports.resolve() if args.reports else args.workdir / "reports"
+    if not args.reports:
+        generate(reports, args.items, args.categories, args.files, seed=args.seed)
+    if args.json:
+        args.json = args.json.resolve()
+
+    stubs = start_stubs(args)
+    try:
+        configure(args)
+        results = {"ingestion": bench_ingestion(reports)}
+        print(json.dumps({"ingestion": results["ingestion"]}, indent=2), flush=True)
+        if args.enrich_seconds:
+            results["enrichment"] = asyncio.run(bench_enrichment(args.enrich_seconds))
+            print(
+                json.dumps({"enrichment": results["enrichment"]}, indent=2), flush=True
+            )
+        if args.requests:
+            results["routes"] = asyncio.run(bench_routes(args.requests, args.seed))
+            print(f"{'route':<24}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+            for name, timing in results["routes"].items():
+                print(
+                    f"{name:<24}{timing['p50_ms']:>10}{timing['p99_ms']:>10}"
+                    f"{timing['mean_ms']:>10}"
+                )
+    finally:
+        stubs.terminate()
+        stubs.wait()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Local stand-ins for the TMDb, TVDB, image and Overseerr APIs.
+
+    python bench/stubs.py --port 8900 --latency 50 --rate-limit 40
+
+Serves TMDb on `--port`, TVDB on the next port, posters on the one after
+and Overseerr on the last, so each counts against its own rate limit
+bucket. Details are generated from the requested id, every response is
+delayed by `--latency` milliseconds (plus up to `--jitter`), and requests
+beyond `--rate-limit` per second (or a random `--throttle-ratio` of them)
+get a 429 with a Retry-After. JSON responses carry an ETag and honour If-None-Match.
+`GET /_stats` on each port returns its request counters.
+"""
+
+import argparse
+import asyncio
+import io
+import random
+
+from aiohttp import web
+from PIL import Image
+
+from generate_reports import WORDS
+
+GENRES = (
+    "Action",
+    "Adventure",
+    "Animation",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Family",
+    "Fantasy",
+    "Horror",
+    "Mystery",
+    "Romance",
+    "Science Fiction",
+    "Thriller",
+)
+
+
+class Provider:
+    """Latency, throttling and counters shared by one stub's handlers."""
+
+    def __init__(self, latency, jitter, rate_limit, throttle_ratio):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.rate_limit = rate_limit
+        self.throttle_ratio = throttle_ratio
+        self.window = 0
+        self.window_requests = 0
+        self.stats = {"requests": 0, "throttled": 0, "not_modified": 0}
+
+    def throttled(self):
+        second = int(asyncio.get_running_loop().time())
+        if second != self.window:
+            self.window, self.window_requests = second, 0
+        self.window_requests += 1
+        return (self.rate_limit and self.window_requests > self.rate_limit) or (
+            random.random() < self.throttle_ratio
+        )
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.path == "/_stats":
+            return web.json_response(self.stats)
+
+        self.stats["requests"] += 1
+        await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if self.throttled():
+            self.stats["throttled"] += 1
+            return web.json_response(
+                {"status_message": "Too many requests"},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+        return await handler(request)
+
+    def json(self, request, data, etag):
+        etag = f'"{etag}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.stats["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response(data, headers={"ETag": etag})
+
+
+def words(seed, count):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def genres(rng):
+    return [
+        {"id": GENRES.index(name) + 1, "name": name}
+        for name in rng.sample(GENRES, rng.randint(1, 3))
+    ]
+
+
+def movie(movie_id):
+    rng = random.Random(movie_id)
+    return {
+        "id": movie_id,
+        "title": words(movie_id, 3).title(),
+        "original_title": words(-movie_id, 3).title(),
+        "overview": words(movie_id, 40).capitalize() + ".",
+        "poster_path": f"/{movie_id}.jpg",
+        "release_date": f"{rng.randint(1950, 2025)}-{rng.randint(1, 12):02}-01",
+        "vote_average": round(rng.uniform(1, 9.5), 1),
+        "vote_count": rng.randint(0, 20000),
+        "popularity": round(rng.uniform(0, 500), 2),
+        "runtime": rng.randint(70, 180),
+        "status": "Released",
+        "genres": genres(rng),
+        "external_ids": {"imdb_id": f"tt{movie_id:07}"},
+        "release_dates": {"results": []},
+        "alternative_titles": {"titles": [{"title": words(movie_id + 1, 2).title()}]},
+    }
+
+
+def series(show_id):
+    rng = random.Random(show_id)
+    return {
+        "status": "success",
+        "data": {
+            "id": show_id,
+            "name": words(show_id, 3).title(),
+            "overview": words(show_id, 40).capitalize() + ".",
+            "image": f"/banners/posters/{show_id}.jpg",
+            "year": str(year := rng.randint(1960, 2025)),
+            "firstAired": f"{year}-{rng.randint(1, 12):02}-01",
+            "score": rng.randint(0, 100000),
+            "averageRuntime": rng.randint(20, 60),
+            "status": {"name": rng.choice(("Continuing", "Ended"))},
+            "genres": genres(rng),
+            "aliases": [{"language": "eng", "name": words(show_id + 1, 2).title()}],
+            "remoteIds": [
+                {
+                    "id": str(show_id + 1000000),
+                    "type": 12,
+                    "sourceName": "TheMovieDB.com",
+                }
+            ],
+            "translations": {"nameTranslations": [], "overviewTranslations": []},
+        },
+    }
+
+
+def tmdb_app(provider):
+    async def get_movie(request):
+        movie_id = int(request.match_info["movie_id"])
+        return provider.json(request, movie(movie_id), movie_id)
+
+    app = web.Application(middlewares=[provider.middleware])
+    app.router.add_get("/3/movie/{movie_id}", get_movie)
+    return app
+
+
+def tvdb_app(provider):
+    async def login(request):
+        return web.json_response({"status": "success", "data": {"token": "stub"}})
+
+    async def get_series(request):
+        show_id = int(request.match_info["show_id"])
+        return provider.json(request, series(show_id), show_id)
+
+    app = web.Application(middlewares=[provider.middleware])
+    app.router.add_post("/v4/login", login)
+    app.router.add_get("/v4/series/{show_id}/extended", get_series)
+    return app
+
+
+def image_app(provider):
+    buffer = io.BytesIO()
+    Image.new("RGB", (780, 1170), (40, 90, 160)).save(buffer, "JPEG", quality=85)
+    poster = buffer.getvalue()
+
+    async def get_image(request):
+        return web.Response(body=poster, content_type="image/jpeg")
+
+    app = web.Application(middlewares=[provider.middleware])
+    app.router.add_get("/t/p/{size}/{name}", get_image)
+    app.router.add_get("/banners/{path:.+}", get_image)
+    return app
+
+
+# What the Overseerr stub knows, by (mediaType, tmdbId), and its requests
+MEDIA = web.AppKey("media", dict)
+REQUESTS = web.AppKey("requests", list)
+
+
+def overseerr_app(provider):
+    """Overseerr's media and request listings, and request creation.
+
+    It starts out knowing no media; each requested one is added as pending
+    with a pending request, and asking for it again gets a 409. A show's
+    TVDB id is its TMDb id less a million, as `series` has it.
+    """
+    app = web.Application(middlewares=[provider.middleware])
+    app[MEDIA] = {}
+    app[REQUESTS] = []
+
+    def page(request, results):
+        take = int(request.query.get("take", 20))
+        skip = int(request.query.get("skip", 0))
+        return web.json_response(
+            {"pageInfo": {"results": len(results)}, "results": results[skip:][:take]}
+        )
+
+    async def list_media(request):
+        return page(request, list(app[MEDIA].values()))
+
+    async def list_requests(request):
+        return page(request, app[REQUESTS][::-1])  # Newest first
+
+    async def create_request(request):
+        payload = await request.json()
+        key = (payload["mediaType"], payload["mediaId"])
+        if key in app[MEDIA]:
+            return web.json_response({"message": "Request exists"}, status=409)
+
+        media = {"mediaType": key[0], "tmdbId": key[1], "status": 2}  # Pending
+        if key[0] == "tv":
+            media["tvdbId"] = key[1] - 1000000
+        app[MEDIA][key] = media
+        created = {"id": len(app[REQUESTS]) + 1, "status": 1, "media": media}
+        app[REQUESTS].append(created)
+        return web.json_response(created, status=201)
+
+    app.router.add_get("/api/v1/media", list_media)
+    app.router.add_get("/api/v1/request", list_requests)
+    app.router.add_post("/api/v1/request", create_request)
+    return app
+
+
+async def serve(host, port, **options):
+    """Serve the four stubs until cancelled."""
+    runners = []
+    apps = (tmdb_app, tvdb_app, image_app, overseerr_app)
+    for offset, make_app in enumerate(apps):
+        runner = web.AppRunner(make_app(Provider(**options)), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port + offset).start()
+        runners.append(runner)
+    print(f"Stubs listening on {host}:{port}-{port + 3}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds")
+    parser.add_argument("--jitter", type=float, default=20, help="milliseconds")
+    parser.add_argument("--rate-limit", type=int, default=0, help="per second")
+    parser.add_argument("--throttle-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(
+            serve(
+                args.host,
+                args.port,
+                latency=args.latency,
+                jitter=args.jitter,
+                rate_limit=args.rate_limit,
+                throttle_ratio=args.throttle_ratio,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import json
+import time
+import zlib
+
+from yarl import URL
+
+
+class HTTPCache:
+    """On-disk cache of JSON responses for conditional requests.
+
+    Entries live in the `http_cache` table, keyed by URL with credentials
+    stripped, and keep the ETag/Last-Modified validators next to the
+    zlib-compressed body, so a 304 can be answered from disk. Methods block
+    on SQLite; call them from a worker thread.
+    """
+
+    def __init__(self, database, ignored_params=("api_key",)):
+        self.database = database
+        self.ignored_params = ignored_params
+        self.not_modified = 0
+        self.stored = 0
+
+    def key(self, url):
+        return str(URL(url).without_query_params(*self.ignored_params))
+
+    def lookup(self, url):
+        """Return `(etag, last_modified, body)` cached for `url`, or None."""
+        with self.database.read("http_cache_lookup") as conn:
+            row = conn.execute(
+                "SELECT etag, last_modified, body FROM http_cache WHERE url = ?",
+                (self.key(url),),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, body = row
+        return etag, last_modified, json.loads(zlib.decompress(body))
+
+    def store(self, url, etag, last_modified, body):
+        self.stored += 1
+        with self.database.write("http_cache_store") as conn:
+            conn.execute(
+                """
+                INSERT INTO http_cache (url, etag, last_modified, body, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    body = excluded.body,
+                    fetched_at = excluded.fetched_at
+                """,
+                (
+                    self.key(url),
+                    etag,
+                    last_modified,
+                    zlib.compress(json.dumps(body).encode()),
+                    time.time(),
+                ),
+            )
+
+    def revalidated(self, url):
+        """Record that the server confirmed the cached entry is current."""
+        self.not_modified += 1
+        with self.database.write("http_cache_revalidated") as conn:
+            conn.execute(
+                "UPDATE http_cache SET fetched_at = ? WHERE url = ?",
+                (time.time(), self.key(url)),
+            )
+
+    def stats(self):
+        return {"not_modified": self.not_modified, "stored": self.stored}
@@ -0,0 +1,59 @@
+"""Poster variants for the content-addressed image cache.
+
+Like `reports`, kept free of the web and database imports so process pool
+workers stay cheap to start.
+"""
+
+import os
+
+from pathlib import Path
+from PIL import Image, ImageOps, features
+
+# Widths of the variants generated for every poster
+VARIANTS = {"thumb": 185, "card": 342, "full": 780}
+DEFAULT_VARIANT = "card"
+
+# Encoders in order of preference; AVIF needs a Pillow built with libavif.
+FORMATS = tuple(fmt for fmt in ("avif", "webp") if fmt == "webp" or features.check(fmt))
+CONTENT_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+SAVE_OPTIONS = {"avif": {"quality": 60}, "webp": {"quality": 80, "method": 4}}
+
+
+def image_dir(root: Path, digest: str):
+    return root / digest[:2]
+
+
+def source_path(root: Path, digest: str):
+    """Where the image a digest was computed from is kept."""
+    return image_dir(root, digest) / f"{digest}.orig"
+
+
+def variant_path(root: Path, digest: str, variant: str, fmt: str):
+    return image_dir(root, digest) / f"{digest}-{variant}.{fmt}"
+
+
+def has_variants(root: Path, digest: str):
+    return all(
+        variant_path(root, digest, variant, fmt).exists()
+        for variant in VARIANTS
+        for fmt in FORMATS
+    )
+
+
+def make_variants(root: Path, digest: str):
+    """Write every variant of the source image stored under `digest`.
+
+    Images are only ever scaled down, and each file is written under a
+    temporary name and renamed so readers never see a partial one.
+    """
+    with Image.open(source_path(root, digest)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for variant, width in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((width, width * 3), Image.Resampling.LANCZOS)
+            for fmt in FORMATS:
+                path = variant_path(root, digest, variant, fmt)
+                tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                resized.save(tmp_path, format=fmt, **SAVE_OPTIONS[fmt])
+                os.replace(tmp_path, path)
@@ -0,0 +1,72 @@
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+
+class Lease:
+    """A named lease in SQLite that at most one process holds at a time.
+
+    The holder has to renew it within `ttl` seconds; once it stops (because
+    it died or hung), any other process may take it over. Methods block on
+    SQLite; call them from a worker thread.
+    """
+
+    def __init__(self, database, name, ttl=30):
+        self.database = database
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+        self.expires_at = 0.0
+
+    def acquire(self):
+        """Take or renew the lease; returns whether this process holds it."""
+        now = time.time()
+        with self.database.write("lease_acquire") as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """
+            )
+            conn.execute(
+                """
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    owner = excluded.owner,
+                    expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+                """,
+                (self.name, self.owner, now + self.ttl, now),
+            )
+            (owner,) = conn.execute(
+                "SELECT owner FROM leases WHERE name = ?", (self.name,)
+            ).fetchone()
+        self.held = owner == self.owner
+        if self.held:
+            self.expires_at = now + self.ttl
+        return self.held
+
+    def release(self):
+        self.held = False
+        with self.database.write("lease_release") as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                (self.name, self.owner),
+            )
+
+    def holder(self):
+        """The current owner and expiry of the lease, or None."""
+        with self.database.read("lease_holder") as conn:
+            try:
+                row = conn.execute(
+                    "SELECT owner, expires_at FROM leases WHERE name = ?", (self.name,)
+                ).fetchone()
+            except sqlite3.OperationalError:  # No process has tried to take it yet
+                return None
+        return {"owner": row[0], "expires_at": row[1]} if row else None
@@ -0,0 +1,138 @@
+"""Prometheus metrics, served at `/metrics`.
+
+Each worker process keeps its own metrics; to aggregate them when running
+several, point `PROMETHEUS_MULTIPROC_DIR` at an empty directory shared by
+the workers.
+"""
+
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets for work that usually takes well under a millisecond
+FAST_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+REQUEST_DURATION = Histogram(
+    "kompletionist_http_request_duration_seconds",
+    "Time to serve API requests, by route template",
+    ["method", "route", "status"],
+    buckets=FAST_BUCKETS,
+)
+SQL_DURATION = Histogram(
+    "kompletionist_sql_duration_seconds",
+    "Time spent in named database reads and writes, waiting for the"
+    " connection included",
+    ["query", "mode"],
+    buckets=FAST_BUCKETS,
+)
+INGEST_DURATION = Histogram(
+    "kompletionist_ingest_duration_seconds",
+    "Time taken by each ingestion stage",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+OUTBOUND_DURATION = Histogram(
+    "kompletionist_outbound_request_duration_seconds",
+    "Requests to TMDb, TVDB, image hosts and Overseerr, by response status"
+    " ('error' when none came back)",
+    ["provider", "status"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "kompletionist_rate_limit_wait_seconds",
+    "Time requests waited for their provider's rate limit",
+    ["provider"],
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+QUEUE_DEPTH = Gauge(
+    "kompletionist_queue_depth",
+    "Items waiting in each background queue",
+    ["queue"],
+    multiprocess_mode="livesum",
+)
+ENRICHED = Counter(
+    "kompletionist_enriched_total",
+    "Details fetched by enrichment and refreshes",
+    ["media_type", "result"],
+)
+IMAGE_CACHE = Counter(
+    "kompletionist_image_cache_total",
+    "Poster lookups answered from the image cache (hit) or needing a"
+    " download (miss)",
+    ["result"],
+)
+IMAGE_RESPONSES = Counter(
+    "kompletionist_image_responses_total",
+    "Images served from the cache, by outcome",
+    ["result"],
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request under its route template,
+    so `/api/movies/{movie_id}` is one series however many ids are asked
+    for."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The router stores the matched route in the scope.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_DURATION.labels(scope["method"], route, status).observe(
+                time.perf_counter() - started
+            )
+
+
+def observe_sql(query, mode, started):
+    SQL_DURATION.labels(query, mode).observe(time.perf_counter() - started)
+
+
+def render():
+    """The metrics of this worker, or of all of them in multiprocess mode."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
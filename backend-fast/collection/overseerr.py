@@ -0,0 +1,316 @@
+"""Availability and requests from Overseerr.
+
+Availability is pulled in bulk into the `availability` table, so listings
+can filter on it without calling Overseerr, and requests are queued and
+sent in debounced batches.
+"""
+
+import aiohttp
+import asyncio
+import time
+
+from aiohttp import ClientTimeout
+
+from ..config import get_settings, get_database
+from .metrics import OUTBOUND_DURATION
+from .schema import BUMP_GENERATION
+
+# Overseerr's MediaStatus values
+PENDING = 2
+PROCESSING = 3
+PARTIALLY_AVAILABLE = 4
+AVAILABLE = 5
+# and MediaRequestStatus values
+REQUEST_PENDING = 1
+REQUEST_APPROVED = 2
+
+# Results fetched per page of a listing
+PAGE_SIZE = 100
+
+timeout = ClientTimeout(total=30)
+
+# Attempts at sending a request before it is dropped, and seconds before
+# the first retry, doubling with each further one
+MAX_REQUEST_ATTEMPTS = 5
+RETRY_DELAY = 5
+# Seconds the requests still queued at shutdown get to go out
+FLUSH_TIMEOUT = 10
+
+# Requests waiting to be sent, in order, each with its failed attempts and
+# when (in `time.monotonic()` seconds) it may next be sent
+pending_requests = {}
+last_queued = 0.0
+request_stats = {
+    "queued": 0,
+    "submitted": 0,
+    "retried": 0,
+    "failed": 0,
+    "last_error": None,
+}
+sync_stats = {"synced_at": None, "media": 0, "changed": 0}
+
+
+async def _on_request_start(session, context, params):
+    context.started = time.perf_counter()
+
+
+async def _on_request_end(session, context, params):
+    OUTBOUND_DURATION.labels("overseerr", params.response.status).observe(
+        time.perf_counter() - context.started
+    )
+
+
+async def _on_request_exception(session, context, params):
+    OUTBOUND_DURATION.labels("overseerr", "error").observe(
+        time.perf_counter() - context.started
+    )
+
+
+trace_config = aiohttp.TraceConfig()
+trace_config.on_request_start.append(_on_request_start)
+trace_config.on_request_end.append(_on_request_end)
+trace_config.on_request_exception.append(_on_request_exception)
+
+
+def _session():
+    return aiohttp.ClientSession(
+        base_url=get_settings().overseerr_url,
+        headers={"X-Api-Key": get_settings().overseerr_api_key},
+        timeout=timeout,
+        trace_configs=[trace_config],
+    )
+
+
+async def _pages(session, path):
+    """Yield every result of one of Overseerr's paged listings."""
+    skip = 0
+    while True:
+        async with session.get(
+            path, params={"take": PAGE_SIZE, "skip": skip, "filter": "all"}
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+        for result in data["results"]:
+            yield result
+        skip += PAGE_SIZE
+        if not data["results"] or skip >= data["pageInfo"]["results"]:
+            return
+
+
+def _media_key(media):
+    """Our `(media_type, id)` for an Overseerr media object, if we have one."""
+    if media.get("mediaType") == "movie" and media.get("tmdbId"):
+        return "movie", str(media["tmdbId"])
+    if media.get("mediaType") == "tv" and media.get("tvdbId"):
+        return "show", str(media["tvdbId"])
+    return None
+
+
+def _save_availability(rows):
+    """Replace the availability table with `rows`, writing only the changes.
+
+    Returns the number of rows added, updated or removed.
+    """
+    with get_database().write("save_availability") as conn:
+        current = {
+            (media_type, media_id): (status, request_status)
+            for media_type, media_id, status, request_status in conn.execute(
+                "SELECT media_type, media_id, status, request_status FROM availability"
+            )
+        }
+        changed = [
+            (*key, *row, time.time())
+            for key, row in rows.items()
+            if current.get(key) != row
+        ]
+        removed = list(current.keys() - rows.keys())
+        conn.executemany(
+            """
+            INSERT INTO availability
+                (media_type, media_id, status, request_status, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (media_type, media_id) DO UPDATE SET
+                status = excluded.status,
+                request_status = excluded.request_status,
+                updated_at = excluded.updated_at
+            """,
+            changed,
+        )
+        conn.executemany(
+            "DELETE FROM availability WHERE media_type = ? AND media_id = ?", removed
+        )
+        if changed or removed:
+            conn.execute(BUMP_GENERATION)
+    return len(changed) + len(removed)
+
+
+async def sync_availability():
+    """Pull the status of every media and request Overseerr knows about.
+
+    Requests are listed newest first, so each media keeps the status of its
+    latest request.
+    """
+    rows = {}
+    async with _session() as session:
+        async for media in _pages(session, "/api/v1/media"):
+            if key := _media_key(media):
+                rows[key] = (media.get("status"), None)
+        async for request in _pages(session, "/api/v1/request"):
+            media = request.get("media") or {}
+            key = _media_key(media)
+            if key and (key not in rows or rows[key][1] is None):
+                status = rows.get(key, (media.get("status"), None))[0]
+                rows[key] = (status, request.get("status"))
+
+    changed = await asyncio.to_thread(_save_availability, rows)
+    sync_stats.update(synced_at=time.time(), media=len(rows), changed=changed)
+
+
+def queue_request(media_type, media_id):
+    """Queue a request for the next batch; returns the batch size."""
+    global last_queued
+    if (media_type, media_id) not in pending_requests:
+        pending_requests[(media_type, media_id)] = (0, 0.0)
+        request_stats["queued"] += 1
+    last_queued = time.monotonic()
+    return len(pending_requests)
+
+
+def _tmdb_id(media_type, media_id):
+    """The TMDb id Overseerr expects; shows only know it from TVDB's details."""
+    if media_type == "movie":
+        return int(media_id)
+    with get_database().read("show_tmdb_id") as conn:
+        row = conn.execute(
+            """
+            SELECT json_extract(value, '$.id')
+            FROM shows, json_each(shows.details, '$.data.remoteIds')
+            WHERE shows.id = ? AND json_extract(value, '$.sourceName') = 'TheMovieDB.com'
+            """,
+            (media_id,),
+        ).fetchone()
+    return int(row[0]) if row else None
+
+
+async def _submit(session, media_type, media_id):
+    """Send one request; returns Overseerr's request object."""
+    tmdb_id = await asyncio.to_thread(_tmdb_id, media_type, media_id)
+    if tmdb_id is None:
+        raise ValueError(f"No TMDb id known for {media_type} {media_id}")
+
+    payload = {"mediaType": "movie", "mediaId": tmdb_id}
+    if media_type == "show":
+        payload = {"mediaType": "tv", "mediaId": tmdb_id, "seasons": "all"}
+    async with session.post("/api/v1/request", json=payload) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+def _retryable(error):
+    """Whether a failed request may succeed if sent again later."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def _send(batch, retry=True):
+    """Send the queued requests in `batch`, four at a time, and record the
+    resulting statuses in the availability table.
+
+    Each request leaves the queue once Overseerr accepted it or it failed
+    for good. With `retry`, one that failed for a reason that may pass (a
+    connection error, a timeout, a 429 or a 5xx) stays queued and is sent
+    again after a backoff, up to `MAX_REQUEST_ATTEMPTS` times.
+    """
+    semaphore = asyncio.Semaphore(4)
+
+    async def submit(session, key):
+        async with semaphore:
+            try:
+                request = await _submit(session, *key)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                request_stats["last_error"] = repr(e)
+                attempts = pending_requests[key][0] + 1
+                if retry and _retryable(e) and attempts < MAX_REQUEST_ATTEMPTS:
+                    delay = RETRY_DELAY * 2 ** (attempts - 1)
+                    pending_requests[key] = (attempts, time.monotonic() + delay)
+                    request_stats["retried"] += 1
+                    print(
+                        f"Failed to request {key[0]} {key[1]}: {e!r},"
+                        f" retrying in {delay}s"
+                    )
+                else:
+                    del pending_requests[key]
+                    request_stats["failed"] += 1
+                    print(f"Failed to request {key[0]} {key[1]}: {e!r}")
+                return None
+            del pending_requests[key]
+            request_stats["submitted"] += 1
+            media = request.get("media") or {}
+            return (*key, media.get("status", PENDING), request.get("status"))
+
+    async with _session() as session:
+        results = await asyncio.gather(*(submit(session, key) for key in batch))
+    await asyncio.to_thread(_save_requested, [row for row in results if row])
+
+
+async def submit_requests():
+    """Send the queued requests, in batches, until none are left.
+
+    A batch goes out once no request was queued for `request_debounce`
+    seconds, so a burst of clicks is sent together, and takes every request
+    not waiting for a retry. Requests stay queued until they are sent, so
+    cancelling this leaves them for `flush_requests`.
+    """
+    debounce = get_settings().request_debounce
+    while pending_requests:
+        retry_at = min(retry_at for _, retry_at in pending_requests.values())
+        delay = max(last_queued + debounce, retry_at) - time.monotonic()
+        if delay > 0:
+            # More requests may arrive meanwhile, so check again after.
+            await asyncio.sleep(delay)
+            continue
+        now = time.monotonic()
+        await _send(
+            [key for key, (_, retry_at) in pending_requests.items() if retry_at <= now]
+        )
+
+
+async def flush_requests():
+    """Send whatever is still queued right away, once, before shutting down."""
+    if not pending_requests:
+        return
+    try:
+        await asyncio.wait_for(
+            _send(list(pending_requests), retry=False), FLUSH_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        pass
+    if pending_requests:
+        print(f"Dropping {len(pending_requests)} requests Overseerr didn't get")
+
+
+def _save_requested(rows):
+    if not rows:
+        return
+    with get_database().write("save_requested") as conn:
+        conn.executemany(
+            """
+            INSERT INTO availability
+                (media_type, media_id, status, request_status, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (media_type, media_id) DO UPDATE SET
+                status = excluded.status,
+                request_status = excluded.request_status,
+                updated_at = excluded.updated_at
+            """,
+            [(*row, time.time()) for row in rows],
+        )
+        conn.execute(BUMP_GENERATION)
+
+
+def stats():
+    return {
+        "sync": sync_stats,
+        "requests": {**request_stats, "pending": len(pending_requests)},
+    }
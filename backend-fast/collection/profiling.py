@@ -0,0 +1,229 @@
+"""Opt-in request profiling and the slow query log.
+
+Both are off unless configured: requests are only profiled when they carry
+`PROFILE_TOKEN` in an `X-Profile` header, and statements are only timed when
+`SLOW_QUERY_MS` is set.
+"""
+
+import os
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import Counter, deque
+from pathlib import Path
+
+# Leaf frames of threads that are idle rather than working: waiting on a
+# lock or queue, or the event loop polling for I/O.
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """A sampling profiler covering every thread of the process.
+
+    A background thread records the stack of each busy thread every
+    `interval` seconds, so work handed to the threadpool is caught as well
+    as the event loop's. `stop()` returns the samples as folded stacks, the
+    text format flamegraph.pl and speedscope render as a flamegraph.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me or Path(frame.f_code.co_filename).name in IDLE_MODULES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if ident not in names:
+                    names.update((t.ident, t.name) for t in threading.enumerate())
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that carry the profiling token.
+
+    The folded stacks are returned instead of the response, or, when a
+    `directory` is given, written there while the response is sent as
+    usual with the file name in an `X-Profile-File` header.
+    """
+
+    def __init__(self, app, token, directory=None):
+        self.app = app
+        self.token = token.encode()
+        self.directory = Path(directory) if directory else None
+
+    def _requested(self, scope):
+        if scope["type"] != "http":
+            return False
+        value = dict(scope["headers"]).get(b"x-profile")
+        return value is not None and secrets.compare_digest(value, self.token)
+
+    async def __call__(self, scope, receive, send):
+        if not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        messages = []
+
+        async def buffer(message):
+            messages.append(message)
+
+        sampler = StackSampler()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, buffer)
+        finally:
+            profile = sampler.stop()
+        elapsed = f"{time.perf_counter() - started:.4f}"
+
+        if self.directory is None:
+            headers = [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"x-profile-elapsed", elapsed.encode()),
+            ]
+            await send(
+                {"type": "http.response.start", "status": 200, "headers": headers}
+            )
+            await send({"type": "http.response.body", "body": profile.encode()})
+            return
+
+        name = re.sub(r"[^\w.-]+", "_", scope["path"]).strip("_") or "root"
+        path = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path.write_text(profile)
+        for message in messages:
+            if message["type"] == "http.response.start":
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-profile-file", path.name.encode()),
+                        (b"x-profile-elapsed", elapsed.encode()),
+                    ],
+                }
+            await send(message)
+
+
+def _shorten(value, limit=200):
+    """Parameters as logged: long strings, like JSON details, are cut."""
+    if isinstance(value, (str, bytes)) and len(value) > limit:
+        return value[:limit] + ("..." if isinstance(value, str) else b"...")
+    return value
+
+
+# The latest slow statements, newest last
+slow_queries = deque(maxlen=100)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor logging statements slower than its connection's threshold.
+
+    For queries the time covers preparing the statement and stepping to the
+    first row, which is where sorting and grouping happen.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.check(sql, parameters, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            first = seq_of_parameters[0] if seq_of_parameters else ()
+            self.connection.check(sql, first, started, len(seq_of_parameters))
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.connection.check(sql_script, (), started)
+
+
+class SlowQueryConnection(sqlite3.Connection):
+    """Connection whose statements taking over `slow_query_seconds` are
+    logged with their parameters and query plan.
+
+    The shortcut `execute` methods open a C-level cursor of their own, so
+    they are routed through a timed cursor as well.
+    """
+
+    slow_query_seconds = 0.1
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def check(self, sql, parameters, started, rows=None):
+        elapsed = time.perf_counter() - started
+        if elapsed < self.slow_query_seconds:
+            return
+
+        try:
+            # A plain cursor, so the plan itself isn't timed.
+            cursor = sqlite3.Cursor(self).execute(
+                f"EXPLAIN QUERY PLAN {sql}", parameters
+            )
+            plan = [row[-1] for row in cursor]
+        except sqlite3.Error:
+            plan = None
+        if isinstance(parameters, dict):
+            parameters = {name: _shorten(value) for name, value in parameters.items()}
+        else:
+            parameters = [_shorten(value) for value in parameters]
+        entry = {
+            "at": time.time(),
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "sql": " ".join(sql.split()),
+            "parameters": parameters,
+            "rows": rows,
+            "plan": plan,
+            "pid": os.getpid(),
+        }
+        slow_queries.append(entry)
+        print(
+            f"Slow query ({entry['elapsed_ms']} ms): {entry['sql']}"
+            f" with {entry['parameters']!r}"
+            + (f" x{rows}" if rows is not None else "")
+            + "".join(f"\n    {line}" for line in plan or ())
+        )
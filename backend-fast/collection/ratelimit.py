@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header, if it has one."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Adaptive token bucket.
+
+    Tokens refill at `rate` per second up to `burst`. Each throttling
+    response halves the rate (down to `min_rate`) and can pause the bucket
+    entirely; each success wins back a little of the configured rate.
+    """
+
+    def __init__(self, rate, burst, min_rate=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait for a token; returns the seconds spent waiting."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def throttled(self, retry_after=None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class RateLimiter:
+    """One token bucket per provider, plus counters of how each is doing.
+
+    `limits` maps a provider name to `(rate, burst)` and `hosts` maps request
+    `host:port`s to providers; hosts not listed share the "default" bucket.
+    """
+
+    def __init__(self, limits, hosts):
+        self.hosts = hosts
+        self.buckets = {
+            provider: TokenBucket(rate, burst)
+            for provider, (rate, burst) in limits.items()
+        }
+        self.counters = {
+            provider: {
+                "requests": 0,
+                "throttled": 0,
+                "retries": 0,
+                "errors": 0,
+                "wait_seconds": 0.0,
+            }
+            for provider in limits
+        }
+
+    def provider(self, host):
+        return self.hosts.get(host, "default")
+
+    async def acquire(self, provider):
+        """Wait for `provider`'s bucket; returns the seconds spent waiting."""
+        waited = await self.buckets[provider].acquire()
+        counters = self.counters[provider]
+        counters["requests"] += 1
+        counters["wait_seconds"] += waited
+        return waited
+
+    def record(self, provider, status, retry_after=None):
+        """Feed a response status (None for a connection error) back in."""
+        counters = self.counters[provider]
+        if status == 429:
+            counters["throttled"] += 1
+            self.buckets[provider].throttled(retry_after)
+        elif status is None or status >= 500:
+            counters["errors"] += 1
+            if retry_after:
+                self.buckets[provider].throttled(retry_after)
+        else:
+            self.buckets[provider].succeeded()
+
+    def retried(self, provider):
+        self.counters[provider]["retries"] += 1
+
+    def stats(self):
+        return {
+            provider: {
+                **counters,
+                "wait_seconds": round(counters["wait_seconds"], 2),
+                "rate": round(self.buckets[provider].rate, 2),
+            }
+            for provider, counters in self.counters.items()
+        }
@@ -0,0 +1,106 @@
+"""Parsing of Kometa missing reports.
+
+Kept free of the web and database imports so process pool workers stay cheap
+to start.
+"""
+
+import hashlib
+import sys
+import yaml
+
+from pathlib import Path
+
+# libyaml's C loader parses several times faster than the pure Python one.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+REPORT_MEDIA_TYPES = {
+    "Missing (TMDb IDs)": "movie",
+    "Missing (TVDb IDs)": "show",
+}
+
+
+def parse_report(content):
+    """Collect the missing movies and shows listed in one Kometa report.
+
+    Categories are gathered in dicts used as ordered sets, then returned as
+    lists.
+    """
+    parsed = {"movie": {}, "show": {}}
+    if isinstance(content, dict):
+        for category, subcategories in content.items():
+            if not isinstance(subcategories, dict):
+                continue
+            for subcategory, items in subcategories.items():
+                if not isinstance(items, dict) or not isinstance(subcategory, str):
+                    continue
+                media_type = next(
+                    (
+                        media_type
+                        for suffix, media_type in REPORT_MEDIA_TYPES.items()
+                        if subcategory.endswith(suffix)
+                    ),
+                    None,
+                )
+                if not media_type:
+                    continue
+                for id, title in items.items():
+                    if not isinstance(title, str):
+                        continue
+                    media = parsed[media_type].get(str(id))
+                    if media is None:
+                        media = parsed[media_type][str(id)] = {
+                            "title": title,
+                            "categories": {},
+                            "type": media_type,
+                        }
+                    media["categories"][category] = None
+
+    for media in (*parsed["movie"].values(), *parsed["show"].values()):
+        media["categories"] = list(media["categories"])
+    return parsed["movie"], parsed["show"]
+
+
+def read_report(yaml_file: Path, known_hash=None):
+    """Read one report, skipping the parse when its hash is `known_hash`.
+
+    Returns the content hash and the parsed `(movies, shows)`, or None for
+    the latter when the content is unchanged. A file that doesn't parse, or
+    is empty, is most likely being rewritten by Kometa: both are returned as
+    None, so the caller keeps what the file listed before.
+    """
+    content = yaml_file.read_bytes()
+    digest = hashlib.sha256(content).hexdigest()
+    if digest == known_hash:
+        return digest, None
+
+    try:
+        document = yaml.load(content, Loader=SafeLoader)
+    except yaml.YAMLError as e:
+        print(f"Failed to parse {yaml_file}, keeping its previous entries: {e}")
+        return None, None
+    if document is None:
+        print(f"{yaml_file} is empty, keeping its previous entries")
+        return None, None
+    return digest, parse_report(document)
+
+
+def merge_reports(reports):
+    """Merge per-file `(movies, shows)` results into one pair."""
+    merged_movies = {}
+    merged_shows = {}
+    for movies, shows in reports:
+        for merged, parsed in ((merged_movies, movies), (merged_shows, shows)):
+            for id, data in parsed.items():
+                media = merged.get(id)
+                if media is None:
+                    media = merged[id] = {
+                        "title": data["title"],
+                        "categories": {},
+                        "type": data["type"],
+                    }
+                for category in data["categories"]:
+                    media["categories"][sys.intern(category)] = None
+
+    for media in (*merged_movies.values(), *merged_shows.values()):
+        media["categories"] = list(media["categories"])
+    return merged_movies, merged_shows
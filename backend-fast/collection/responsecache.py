@@ -0,0 +1,156 @@
+import brotli
+import gzip
+import hashlib
+import orjson
+import threading
+
+from cachetools import LRUCache
+from typing import NamedTuple
+
+# Bodies smaller than this are only kept uncompressed: compressing them
+# saves less than it costs.
+MIN_COMPRESSED_SIZE = 1024
+
+# Content codings cached responses are precompressed with, preferred first
+ENCODINGS = {
+    "br": lambda body: brotli.compress(body, quality=6),
+    "gzip": lambda body: gzip.compress(body, compresslevel=6, mtime=0),
+}
+
+
+class CachedResponse(NamedTuple):
+    generation: int
+    body: bytes
+    etag: str
+    # Compressed bodies by content coding
+    encoded: dict
+
+
+def response_etag(generation, key):
+    """Strong ETag of the response cached under `key` for `generation`.
+
+    Responses are a function of the key and the data, so the same pair
+    always names the same body, in every worker process.
+    """
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    return f'"{generation}-{digest}"'
+
+
+def encoded_etag(etag, encoding):
+    """The ETag of a compressed body, which must differ from the plain one's."""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def matching_etag(if_none_match, etag):
+    """The tag of an `If-None-Match` header naming `etag`, plain or for one
+    of its compressed bodies, or None."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag == etag:
+            return etag
+        if any(tag == encoded_etag(etag, encoding) for encoding in ENCODINGS):
+            return tag
+    return None
+
+
+def accepted_encoding(accept_encoding, available):
+    """The preferred coding among `available` that `Accept-Encoding` allows."""
+    accepted = set()
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return next((e for e in ENCODINGS if e in accepted and e in available), None)
+
+
+class ResponseCache:
+    """Serialized API responses, kept for as long as the data is unchanged.
+
+    Entries are tagged with the database generation, which ingestion and
+    enrichment bump whenever they commit changes to media, so a cached page
+    is dropped exactly when it may have gone stale. The LRU is bounded by the
+    bytes it holds, compressed copies included. Checking the generation
+    usually costs a single `PRAGMA data_version`, which only changes after
+    another connection committed.
+    """
+
+    def __init__(self, connect, max_bytes):
+        self.connect = connect
+        self.entries = LRUCache(max_bytes, getsizeof=self._size)
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._data_version = None
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def generation(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self.connect()
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._generation = self._conn.execute(
+                    "SELECT value FROM generation"
+                ).fetchone()[0]
+                self._data_version = data_version
+            return self._generation
+
+    @staticmethod
+    def _size(entry):
+        return len(entry.body) + sum(map(len, entry.encoded.values()))
+
+    def lookup(self, key, compute, compress=False):
+        """The response cached under `key`, computed and stored on a miss.
+
+        With `compress`, large bodies are stored compressed as well, so the
+        compression is paid once per generation rather than per request.
+        """
+        generation = self.generation()
+        with self._lock:
+            entry = self.entries.get(key)
+            if (
+                entry
+                and entry.generation == generation
+                and (
+                    entry.encoded
+                    or not compress
+                    or len(entry.body) < MIN_COMPRESSED_SIZE
+                )
+            ):
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        body = orjson.dumps(compute())
+        encoded = {}
+        if compress and len(body) >= MIN_COMPRESSED_SIZE:
+            encoded = {encoding: encode(body) for encoding, encode in ENCODINGS.items()}
+        entry = CachedResponse(
+            generation, body, response_etag(generation, key), encoded
+        )
+        if self._size(entry) <= self.entries.maxsize:
+            with self._lock:
+                self.entries[key] = entry
+        return entry
+
+    def get(self, key, compute):
+        """The JSON body cached under `key`, computed and stored on a miss."""
+        return self.lookup(key, compute).body
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "entries": len(self.entries),
+            "bytes": self.entries.currsize,
+            "max_bytes": self.entries.maxsize,
+            "generation": self._generation,
+        }
@@ -1,216 +1,848 @@
 from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
 
 import json
+import orjson
+import re
+
+from collections import Counter
+from typing import NamedTuple, Optional
+
+from ..config import get_database, IMAGE_CACHE_DIR
+from .metrics import IMAGE_RESPONSES
+from .images import CONTENT_TYPES, DEFAULT_VARIANT, FORMATS, VARIANTS, variant_path
+from .overseerr import (
+    AVAILABLE,
+    PARTIALLY_AVAILABLE,
+    PENDING,
+    PROCESSING,
+    REQUEST_APPROVED,
+    REQUEST_PENDING,
+)
+from .schema import CARD_COLUMNS, MEDIA_TABLES, PROJECTION_COLUMNS, SORT_COLUMNS
+
+MEDIA_TYPES = tuple(MEDIA_TABLES)
+
+# Optional media fields, beyond the base ones every media has. Listings
+# return the card fields unless asked for others with `fields=`.
+BASE_FIELDS = {"id", "title", "categories", "type"}
+MEDIA_FIELDS = (*PROJECTION_COLUMNS, "details")
+CARD_FIELDS = CARD_COLUMNS
+
+# What each `availability=` filter requires of a media's row in the
+# availability table, and whether to list the media that lack such a row.
+_REQUESTED = (
+    f"status IN ({PENDING}, {PROCESSING})"
+    f" OR request_status IN ({REQUEST_PENDING}, {REQUEST_APPROVED})"
+)
+AVAILABILITY_FILTERS = {
+    "available": (f"status IN ({PARTIALLY_AVAILABLE}, {AVAILABLE})", False),
+    "requested": (_REQUESTED, False),
+    "missing": (
+        f"{_REQUESTED} OR status IN ({PARTIALLY_AVAILABLE}, {AVAILABLE})",
+        True,
+    ),
+}
+
+# Genres and categories beyond the most common ones are left out of facets
+FACET_LIMIT = 20
+
+
+class MediaFilters(NamedTuple):
+    """Filters narrowing a listing; `None` leaves a filter out."""
+
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    rating_min: Optional[float] = None
+    genre: Optional[str] = None
+    category: Optional[str] = None
+    availability: Optional[str] = None
+
+
+def _total_pages(total: int, page_size: int):
+    return (total // page_size) + (1 if total % page_size > 0 else 0)
+
+
+def parse_fields(fields: Optional[str]):
+    """The media fields a comma-separated `fields=` value asks for."""
+    if fields is None:
+        return CARD_FIELDS
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    requested -= BASE_FIELDS
+    if not requested <= set(MEDIA_FIELDS):
+        raise HTTPException(status_code=400, detail="Invalid fields")
+    return tuple(field for field in MEDIA_FIELDS if field in requested)
+
+
+def _media_columns(fields, column="{}"):
+    """The columns `_media_row` reads `fields` from, each formatted into
+    `column`.
+
+    Cards are pre-rendered by the schema triggers, so they are selected as
+    one JSON column.
+    """
+    if fields == CARD_FIELDS:
+        columns = ["card_json"]
+    else:
+        columns = ["title", "categories", *fields]
+    return ", ".join(column.format(name) for name in columns)
+
+
+def _media_row(row, fields):
+    """Media from a `(type, id, <_media_columns>)` row.
+
+    Cards are passed through as a fragment orjson embeds unchanged.
+    """
+    if fields == CARD_FIELDS:
+        return orjson.Fragment(row[2])
+
+    media_type, id, title, categories, *values = row
+    media = {
+        "id": id,
+        "title": title,
+        "categories": json.loads(categories),
+        "type": media_type,
+    }
+    for field, value in zip(fields, values):
+        media[field] = json.loads(value) if field == "details" and value else value
+    return media
 
-from ..config import get_db_connection
 
+def _decode_cursor(cursor: str):
+    """Split a `<type>:<id>` cursor into the media type and id it points at."""
+    media_type, sep, media_id = cursor.partition(":")
+    if not sep or media_type not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return media_type, media_id
 
-def paginated_movies(page: int, page_size: int, query: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute("SELECT * FROM movies WHERE title LIKE ?", (f"%{query}%",))
-    movies = cursor.fetchall()
+def _decode_sort_cursor(cursor: str, sort: str):
+    """Split a `<type>:<id>:<sort value>` cursor of a sorted listing."""
+    media_type, media_id = _decode_cursor(cursor)
+    media_id, sep, value = media_id.partition(":")
+    if not sep:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if SORT_COLUMNS[sort][1] == "REAL":
+        try:
+            value = float(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return media_type, media_id, value
 
-    conn.close()
 
-    total = len(movies)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paginated_movies = movies[start:end]
+class _Branch(NamedTuple):
+    """One media type's share of a listing.
+
+    `source` is the FROM clause and `key` the unique column rows are ordered
+    and seeked on; `where`/`params` filter the rows. The sort and filter
+    columns are read from the `columns` table of the source, the media
+    fields from the media table.
+    """
+
+    media_type: str
+    source: str
+    key: str
+    where: str = "1"
+    params: tuple = ()
+    columns: str = ""
 
-    return {
-        "data": [
-            {
-                "id": row[0],
-                "title": row[1],
-                "categories": json.loads(row[2]),
-                "details": json.loads(row[3]) if row[3] else None,
-                "type": "movie",
-            }
-            for row in paginated_movies
-        ],
-        "page": page,
-        "page_size": page_size,
-        "total": total,
-        "total_pages": (total // page_size) + (1 if total % page_size > 0 else 0),
-    }
 
+def _table_branch(media_type: str, where: str = "1", params: tuple = ()):
+    table = MEDIA_TABLES[media_type]
+    return _Branch(media_type, table, f"{table}.id", where, params, table)
 
-def paginated_shows(page: int, page_size: int, query: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute(
-        "SELECT id, title, categories, details FROM shows WHERE title LIKE ?",
-        (f"%{query}%",),
+def _membership_branch(
+    media_type: str, membership: str, where: str = "1", params: tuple = ()
+):
+    """Branch driven by the media's rows of the `membership` table, aliased
+    `m`, which carry their sort and filter columns: narrowed to one genre or
+    category, the branch seeks on its membership table's indexes."""
+    table = MEDIA_TABLES[media_type]
+    return _Branch(
+        media_type,
+        f"{membership} m JOIN {table} ON {table}.id = m.media_id",
+        "m.media_id",
+        f"m.media_type = '{media_type}' AND {where}",
+        params,
+        "m",
     )
-    shows = cursor.fetchall()
 
-    conn.close()
 
-    total = len(shows)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paginated_shows = shows[start:end]
+def _fields_sql(branch: _Branch, fields):
+    return _media_columns(fields, f"{MEDIA_TABLES[branch.media_type]}.{{}}")
+
+
+def _keyed_rows(cur, branches, counts, page, page_size, cursor, fields):
+    """Rows of a page listing the branches one after the other, each ordered
+    by its key."""
+    after_type, after_id = _decode_cursor(cursor) if cursor else (None, None)
+    offset = 0 if cursor else (page - 1) * page_size
+
+    rows = []
+    for branch, count in zip(branches, counts):
+        if len(rows) == page_size:
+            break
+
+        sql = (
+            f"SELECT '{branch.media_type}', {branch.key}, {_fields_sql(branch, fields)}"
+            f" FROM {branch.source} WHERE {branch.where}"
+        )
+        params = list(branch.params)
+        if after_type:
+            if MEDIA_TYPES.index(branch.media_type) < MEDIA_TYPES.index(after_type):
+                continue
+            if after_type == branch.media_type:
+                sql += f" AND {branch.key} > ?"
+                params.append(after_id)
+        elif offset >= count:
+            offset -= count
+            continue
+
+        sql += f" ORDER BY {branch.key} LIMIT ? OFFSET ?"
+        params.extend([page_size - len(rows), offset])
+        offset = 0
+
+        cur.execute(sql, params)
+        rows.extend(cur.fetchall())
+    return rows
+
+
+def _sorted_rows(cur, branches, page, page_size, cursor, fields, sort, order):
+    """Rows of a page merging the branches in `sort` order.
+
+    Ties are broken by media type and key, so the `(value, type, key)` of
+    the last row is a cursor to seek past. Each row ends with its sort value.
+    """
+    sort_column, _, _, default = SORT_COLUMNS[sort]
+    direction = (order or default).upper()
+    past = "<" if direction == "DESC" else ">"
+    # Media types in the order ties between them are listed
+    type_order = MEDIA_TYPES if direction == "ASC" else MEDIA_TYPES[::-1]
+    after = _decode_sort_cursor(cursor, sort) if cursor else None
+
+    selects, params = [], []
+    for branch in branches:
+        column = f"{branch.columns}.{sort_column}"
+        sql = (
+            f"SELECT '{branch.media_type}' AS media_type, {branch.key} AS media_id,"
+            f" {_fields_sql(branch, fields)}, {column} AS sort_value"
+            f" FROM {branch.source} WHERE {branch.where}"
+        )
+        params.extend(branch.params)
+        if after:
+            after_type, after_id, after_value = after
+            if branch.media_type == after_type:
+                sql += f" AND ({column}, {branch.key}) {past} (?, ?)"
+                params.extend([after_value, after_id])
+            elif type_order.index(branch.media_type) > type_order.index(after_type):
+                sql += f" AND {column} {past}= ?"
+                params.append(after_value)
+            else:
+                sql += f" AND {column} {past} ?"
+                params.append(after_value)
+        selects.append(sql)
+
+    ties = "media_type {0}, media_id {0}" if len(branches) > 1 else "media_id {0}"
+    sql = (
+        " UNION ALL ".join(selects)
+        + f" ORDER BY sort_value {direction}, {ties.format(direction)} LIMIT ?"
+    )
+    params.append(page_size)
+    if not after:
+        sql += " OFFSET ?"
+        params.append((page - 1) * page_size)
 
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def _paginate(
+    branches,
+    page: int,
+    page_size: int,
+    cursor: Optional[str],
+    fields=CARD_FIELDS,
+    counts=None,
+    sort: Optional[str] = None,
+    order: Optional[str] = None,
+):
+    """Fetch one page of media rows straight from SQLite.
+
+    Unsorted, branches are listed one after the other, each ordered by its
+    key; with a `sort` key they are merged in that order instead. A page can
+    either be addressed by `page` (LIMIT/OFFSET) or, when `cursor` is given,
+    by seeking past the last row of the previous page on the key's or sort
+    column's index, which keeps deep pages as cheap as the first one. Callers
+    that can count their rows more cheaply than the branch queries may pass
+    `counts`, one per branch.
+    """
+    with get_database().read("paginate") as conn:
+        cur = conn.cursor()
+
+        if counts is None:
+            counts = []
+            for branch in branches:
+                cur.execute(
+                    f"SELECT COUNT(*) FROM {branch.source} WHERE {branch.where}",
+                    branch.params,
+                )
+                counts.append(cur.fetchone()[0])
+
+        if sort is None:
+            rows = _keyed_rows(cur, branches, counts, page, page_size, cursor, fields)
+        else:
+            rows = _sorted_rows(
+                cur, branches, page, page_size, cursor, fields, sort, order
+            )
+
+    next_cursor = None
+    if len(rows) == page_size:
+        next_cursor = f"{rows[-1][0]}:{rows[-1][1]}"
+        if sort is not None:
+            next_cursor += f":{rows[-1][-1]}"
+    if sort is not None:
+        rows = [row[:-1] for row in rows]
+
+    total = sum(counts)
     return {
-        "data": [
-            {
-                "id": row[0],
-                "title": row[1],
-                "categories": json.loads(row[2]),
-                "details": json.loads(row[3]) if row[3] else None,
-                "type": "show",
-            }
-            for row in paginated_shows
-        ],
+        "data": [_media_row(row, fields) for row in rows],
         "page": page,
         "page_size": page_size,
         "total": total,
-        "total_pages": (total // page_size) + (1 if total % page_size > 0 else 0),
+        "total_pages": _total_pages(total, page_size),
+        "next_cursor": next_cursor,
     }
 
 
-def search_media(query: str, page: int, page_size: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM movies WHERE title LIKE ?", (f"%{query}%",))
-
-    movies = [
-        {
-            "id": row[0],
-            "title": row[1],
-            "categories": json.loads(row[2]),
-            "details": json.loads(row[3]) if row[3] else None,
-            "type": "movie",
-        }
-        for row in cursor.fetchall()
-    ]
-
-    cursor.execute("SELECT * FROM shows WHERE title LIKE ?", (f"%{query}%",))
-
-    shows = [
-        {
-            "id": row[0],
-            "title": row[1],
-            "categories": json.loads(row[2]),
-            "details": json.loads(row[3]) if row[3] else None,
-            "type": "show",
-        }
-        for row in cursor.fetchall()
-    ]
-    conn.close()
-
-    # Merge movies & shows and apply pagination
-    all_media = movies + shows
-    total = len(all_media)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paginated_media = all_media[start:end]
+def _availability_filter(availability: Optional[str], media_type: str, media_id: str):
+    """SQL keeping the media matching an `availability=` filter.
 
-    return {
-        "data": paginated_media,
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "total": total,
-        "total_pages": (total // page_size) + (1 if total % page_size > 0 else 0),
+    `media_type` and `media_id` are the SQL for the media being filtered;
+    each check is a primary key lookup in the availability table.
+    """
+    if availability is None:
+        return "1"
+    condition, missing = AVAILABILITY_FILTERS[availability]
+    return (
+        f"{'NOT ' if missing else ''}EXISTS (SELECT 1 FROM availability a"
+        f" WHERE a.media_type = {media_type} AND a.media_id = {media_id}"
+        f" AND ({condition}))"
+    )
+
+
+def _filter_sql(filters: MediaFilters, media_type: str, media_id: str, columns: str):
+    """SQL and parameters keeping the media matching `filters`.
+
+    Year and rating are read from the `columns` table, whose listing indexes
+    end with them; genre, category and availability are each an index
+    lookup per media.
+    """
+    conditions, params = [], []
+    if filters.year_min is not None:
+        conditions.append(f"{columns}.year >= ?")
+        params.append(filters.year_min)
+    if filters.year_max is not None:
+        conditions.append(f"{columns}.year <= ?")
+        params.append(filters.year_max)
+    if filters.rating_min is not None:
+        conditions.append(f"{columns}.rating >= ?")
+        params.append(filters.rating_min)
+    if filters.genre is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM media_genres g WHERE g.genre = ?"
+            f" AND g.media_type = '{media_type}' AND g.media_id = {media_id})"
+        )
+        params.append(filters.genre)
+    if filters.category is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM media_categories fc"
+            " WHERE fc.category_id = (SELECT id FROM categories WHERE name = ?)"
+            f" AND fc.media_type = '{media_type}' AND fc.media_id = {media_id})"
+        )
+        params.append(filters.category)
+    if filters.availability is not None:
+        conditions.append(
+            _availability_filter(filters.availability, f"'{media_type}'", media_id)
+        )
+    return " AND ".join(conditions) or "1", tuple(params)
+
+
+def _facets(branches, categories: bool = True):
+    """Counts of the media in `branches` by genre, decade, whole rating,
+    availability and, with `categories`, category.
+
+    Each count is taken within the listing's current filters.
+    """
+    genres, decades, ratings, category_counts = (
+        Counter(),
+        Counter(),
+        Counter(),
+        Counter(),
+    )
+    availability = Counter()
+    with get_database().read("facets") as conn:
+        for branch in branches:
+            media_type, key = f"'{branch.media_type}'", branch.key
+            available = _availability_filter("available", media_type, key)
+            requested = _availability_filter("requested", media_type, key)
+            # Decades, ratings and availability in one pass over the listing
+            rows = conn.execute(
+                f"SELECT {branch.columns}.year / 10 * 10,"
+                f" CAST({branch.columns}.rating AS INTEGER), {available}, {requested},"
+                f" COUNT(*) FROM {branch.source} WHERE {branch.where}"
+                " GROUP BY 1, 2, 3, 4",
+                branch.params,
+            )
+            for decade, rating, is_available, is_requested, count in rows:
+                if decade is not None:
+                    decades[decade] += count
+                if rating is not None:
+                    ratings[rating] += count
+                availability["available"] += is_available * count
+                availability["requested"] += is_requested * count
+                if not (is_available or is_requested):
+                    availability["missing"] += count
+
+            genres.update(
+                dict(
+                    conn.execute(
+                        f"SELECT g.genre, COUNT(*) FROM {branch.source}"
+                        f" JOIN media_genres g ON g.media_type = {media_type}"
+                        f" AND g.media_id = {key}"
+                        f" WHERE {branch.where} GROUP BY g.genre",
+                        branch.params,
+                    )
+                )
+            )
+            if categories:
+                category_counts.update(
+                    dict(
+                        conn.execute(
+                            f"SELECT fc.category_id, COUNT(*) FROM {branch.source}"
+                            f" JOIN media_categories fc ON fc.media_type = {media_type}"
+                            f" AND fc.media_id = {key}"
+                            f" WHERE {branch.where} GROUP BY fc.category_id",
+                            branch.params,
+                        )
+                    )
+                )
+
+        top = category_counts.most_common(FACET_LIMIT)
+        names = dict(
+            conn.execute(
+                "SELECT id, name FROM categories"
+                f" WHERE id IN ({', '.join('?' * len(top))})",
+                [category_id for category_id, _ in top],
+            )
+        )
+        category_counts = Counter({names[id]: count for id, count in top})
+
+    def ranked(counts):
+        return [
+            {"value": value, "count": count}
+            for value, count in counts.most_common(FACET_LIMIT)
+        ]
+
+    def ordered(counts):
+        return [{"value": value, "count": counts[value]} for value in sorted(counts)]
+
+    facets = {
+        "genres": ranked(genres),
+        "decades": ordered(decades),
+        "ratings": ordered(ratings),
+        "availability": {
+            name: availability[name] for name in ("available", "requested", "missing")
+        },
     }
+    if categories:
+        facets["categories"] = ranked(category_counts)
+    return facets
+
+
+def _match_expression(query: str):
+    """Turn free text into an FTS5 query matching every word as a prefix.
+
+    Only words are kept, each quoted, so FTS5 syntax in the text is never
+    interpreted. Returns None for a blank query, which searches nothing,
+    and an empty string for one without words, which matches nothing.
+    """
+    if not query.strip():
+        return None
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", query))
+
+
+def _search_filter(media_type: str, query: str, media_id: str):
+    match = _match_expression(query)
+    if match is None:
+        return "1", ()
+    if not match:
+        return "0", ()
+    return (
+        f"{media_id} IN (SELECT media_id FROM media_search"
+        " WHERE media_search MATCH ? AND media_type = ?)",
+        (match, media_type),
+    )
 
 
-def list_categories(page: int, page_size: int):
-    """Fetch paginated list of unique categories."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _filtered_branch(media_type: str, query: str, filters: MediaFilters):
+    """Branch of the movies or shows listing.
+
+    Narrowed to a genre or category, it is driven by that membership table;
+    otherwise by the media table itself.
+    """
+    if filters.genre is not None:
+        membership, where, value = "media_genres", "m.genre = ?", filters.genre
+        filters = filters._replace(genre=None)
+    elif filters.category is not None:
+        membership, value = "media_categories", filters.category
+        where = "m.category_id = (SELECT id FROM categories WHERE name = ?)"
+        filters = filters._replace(category=None)
+    else:
+        table = MEDIA_TABLES[media_type]
+        search, params = _search_filter(media_type, query, f"{table}.id")
+        filter_where, filter_params = _filter_sql(
+            filters, media_type, f"{table}.id", table
+        )
+        return _table_branch(
+            media_type, f"{search} AND {filter_where}", params + filter_params
+        )
+
+    search, params = _search_filter(media_type, query, "m.media_id")
+    filter_where, filter_params = _filter_sql(filters, media_type, "m.media_id", "m")
+    return _membership_branch(
+        media_type,
+        membership,
+        f"{where} AND {search} AND {filter_where}",
+        (value, *params, *filter_params),
+    )
+
 
-    cursor.execute(
-        "SELECT DISTINCT json_each.value FROM movies, json_each(movies.categories)"
+def paginated_movies(
+    page: int,
+    page_size: int,
+    query: str,
+    cursor: Optional[str] = None,
+    fields=CARD_FIELDS,
+    filters: MediaFilters = MediaFilters(),
+    sort: Optional[str] = None,
+    order: Optional[str] = None,
+):
+    return _paginate(
+        [_filtered_branch("movie", query, filters)],
+        page,
+        page_size,
+        cursor,
+        fields,
+        sort=sort,
+        order=order,
     )
-    movie_categories = {row[0] for row in cursor.fetchall()}
 
-    cursor.execute(
-        "SELECT DISTINCT json_each.value FROM shows, json_each(shows.categories)"
+
+def paginated_shows(
+    page: int,
+    page_size: int,
+    query: str,
+    cursor: Optional[str] = None,
+    fields=CARD_FIELDS,
+    filters: MediaFilters = MediaFilters(),
+    sort: Optional[str] = None,
+    order: Optional[str] = None,
+):
+    return _paginate(
+        [_filtered_branch("show", query, filters)],
+        page,
+        page_size,
+        cursor,
+        fields,
+        sort=sort,
+        order=order,
     )
-    show_categories = {row[0] for row in cursor.fetchall()}
 
-    conn.close()
 
-    all_categories = sorted(movie_categories | show_categories)
+def media_facets(media_type: str, query: str, filters: MediaFilters = MediaFilters()):
+    """Facet counts of the movies or shows listing."""
+    return _facets([_filtered_branch(media_type, query, filters)])
+
+
+def get_media(media_type: str, media_id: str):
+    """Fetch one movie or show with every field, including its details."""
+    with get_database().read("get_media") as conn:
+        row = conn.execute(
+            f"SELECT '{media_type}', id, {_media_columns(MEDIA_FIELDS)}"
+            f" FROM {MEDIA_TABLES[media_type]} WHERE id = ?",
+            (media_id,),
+        ).fetchone()
 
-    total = len(all_categories)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paginated_categories = all_categories[start:end]
+    if not row:
+        raise HTTPException(status_code=404, detail=f"{media_type.title()} not found")
+    return _media_row(row, MEDIA_FIELDS)
+
+
+def check_media(media_type: str, media_id: str):
+    """Raise a 404 unless the movie or show is in the library."""
+    with get_database().read("check_media") as conn:
+        row = conn.execute(
+            f"SELECT 1 FROM {MEDIA_TABLES[media_type]} WHERE id = ?", (media_id,)
+        ).fetchone()
+
+    if not row:
+        raise HTTPException(status_code=404, detail=f"{media_type.title()} not found")
+
+
+def _decode_search_cursor(cursor: str):
+    """Split a `<rank>:<rowid>` search cursor into its ordering key."""
+    rank, _, rowid = cursor.partition(":")
+    try:
+        return float(rank), int(rowid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def search_media(
+    query: str,
+    page: int,
+    page_size: int,
+    cursor: Optional[str] = None,
+    fields=CARD_FIELDS,
+    availability: Optional[str] = None,
+):
+    """Search movies and shows together, best bm25 matches first."""
+    match = _match_expression(query)
+    if not match:
+        return _paginate(
+            [
+                _table_branch(
+                    media_type,
+                    (
+                        _availability_filter(availability, f"'{media_type}'", "id")
+                        if match is None
+                        else "0"
+                    ),
+                )
+                for media_type in MEDIA_TYPES
+            ],
+            page,
+            page_size,
+            cursor,
+            fields,
+        )
+
+    with get_database().read("search_media") as conn:
+        cur = conn.cursor()
+
+        where = "media_search MATCH ? AND " + _availability_filter(
+            availability, "s.media_type", "s.media_id"
+        )
+        cur.execute(f"SELECT COUNT(*) FROM media_search s WHERE {where}", (match,))
+        total = cur.fetchone()[0]
+
+        sql = f"""
+            SELECT s.media_type,
+                   COALESCE(m.id, t.id),
+                   {_media_columns(fields, "COALESCE(m.{0}, t.{0})")},
+                   s.rank,
+                   s.rowid
+            FROM media_search s
+            LEFT JOIN movies m ON s.media_type = 'movie' AND m.id = s.media_id
+            LEFT JOIN shows t ON s.media_type = 'show' AND t.id = s.media_id
+            WHERE {where}
+        """
+        params = [match]
+        if cursor:
+            sql += " AND (s.rank, s.rowid) > (?, ?)"
+            params.extend(_decode_search_cursor(cursor))
+        sql += " ORDER BY s.rank, s.rowid LIMIT ?"
+        params.append(page_size)
+        if not cursor:
+            sql += " OFFSET ?"
+            params.append((page - 1) * page_size)
+
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) == page_size:
+        next_cursor = f"{rows[-1][-2]!r}:{rows[-1][-1]}"
 
     return {
-        "data": paginated_categories,
-        "total": total,
+        "data": [_media_row(row[:-2], fields) for row in rows],
         "page": page,
         "page_size": page_size,
         "total": total,
-        "total_pages": (total // page_size) + (1 if total % page_size > 0 else 0),
+        "total_pages": _total_pages(total, page_size),
+        "next_cursor": next_cursor,
     }
 
 
+def list_categories(page: int, page_size: int):
+    """Fetch paginated list of unique categories with their media counts."""
+    with get_database().read("list_categories") as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT COUNT(*) FROM categories")
+        total = cursor.fetchone()[0]
+
+        cursor.execute(
+            """
+            SELECT c.name,
+                   SUM(mc.media_type = 'movie'),
+                   SUM(mc.media_type = 'show')
+            FROM (
+                SELECT id, name FROM categories ORDER BY name LIMIT ? OFFSET ?
+            ) AS c
+            JOIN media_categories mc ON mc.category_id = c.id
+            GROUP BY c.id
+            ORDER BY c.name
+        """,
+            (page_size, (page - 1) * page_size),
+        )
+        rows = cursor.fetchall()
+
+    return {
+        "data": [name for name, _, _ in rows],
+        "counts": {
+            name: {"movie": movies, "show": shows} for name, movies, shows in rows
+        },
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": _total_pages(total, page_size),
+    }
+
+
+def _category_branches(category_id: int, filters: MediaFilters):
+    branches = []
+    for media_type in MEDIA_TABLES:
+        where, params = _filter_sql(filters, media_type, "m.media_id", "m")
+        branches.append(
+            _membership_branch(
+                media_type,
+                "media_categories",
+                f"m.category_id = ? AND {where}",
+                (category_id, *params),
+            )
+        )
+    return branches
+
+
+def _category_id(category_name: str):
+    with get_database().read("category_id") as conn:
+        row = conn.execute(
+            "SELECT id FROM categories WHERE name = ?", (category_name,)
+        ).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Category not found or empty")
+    return row[0]
+
+
 def list_media_by_category(
     category_name: str,
     page: int,
     page_size: int,
+    cursor: Optional[str] = None,
+    fields=CARD_FIELDS,
+    filters: MediaFilters = MediaFilters(),
+    sort: Optional[str] = None,
+    order: Optional[str] = None,
 ):
-    """Fetch paginated movies and shows under a specific category."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Fetch all movies in the category
-    cursor.execute(
-        "SELECT * FROM movies WHERE ? IN (SELECT value FROM json_each(categories))",
-        (category_name,),
+    """Fetch paginated movies and shows under a specific category.
+
+    The counts kept per category only hold when the listing isn't filtered.
+    A `category` filter narrows it to media also under that category.
+    """
+    with get_database().read("list_media_by_category") as conn:
+        cur = conn.cursor()
+
+        cur.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
+        category = cur.fetchone()
+
+        type_counts = {}
+        if category:
+            cur.execute(
+                "SELECT media_type, COUNT(*) FROM media_categories"
+                " WHERE category_id = ? GROUP BY media_type",
+                category,
+            )
+            type_counts = dict(cur.fetchall())
+
+    if not type_counts:
+        raise HTTPException(status_code=404, detail="Category not found or empty")
+
+    return _paginate(
+        _category_branches(category[0], filters),
+        page,
+        page_size,
+        cursor,
+        fields,
+        counts=(
+            None
+            if filters != MediaFilters()
+            else [type_counts.get(media_type, 0) for media_type in MEDIA_TABLES]
+        ),
+        sort=sort,
+        order=order,
     )
-    all_movies = [
-        {
-            "id": row[0],
-            "title": row[1],
-            "categories": json.loads(row[2]),
-            "details": json.loads(row[3]) if row[3] else None,
-            "type": "movie",
-        }
-        for row in cursor.fetchall()
-    ]
-
-    # Fetch all shows in the category
-    cursor.execute(
-        "SELECT * FROM shows WHERE ? IN (SELECT value FROM json_each(categories))",
-        (category_name,),
+
+
+def category_facets(category_name: str, filters: MediaFilters = MediaFilters()):
+    """Facet counts of a category's listing."""
+    return _facets(
+        _category_branches(_category_id(category_name), filters), categories=False
     )
-    all_shows = [
-        {
-            "id": row[0],
-            "title": row[1],
-            "categories": json.loads(row[2]),
-            "details": json.loads(row[3]) if row[3] else None,
-            "type": "show",
-        }
-        for row in cursor.fetchall()
-    ]
-
-    conn.close()
-
-    if not all_movies and not all_shows:
-        raise HTTPException(status_code=404, detail="Category not found or empty")
 
-    # Merge movies & shows and apply pagination
-    all_media = all_movies + all_shows
-    total = len(all_media)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paginated_media = all_media[start:end]
 
-    return {
-        "data": paginated_media,
-        "page": page,
-        "page_size": page_size,
-        "total": total,
-        "total_pages": (total // page_size) + (1 if total % page_size > 0 else 0),
-    }
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# Content-addressed files never change, so clients may keep them for good.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def image_response(
+    name: str,
+    variant: Optional[str],
+    format: Optional[str],
+    accept: str,
+    if_none_match: Optional[str],
+):
+    """Serve a poster variant from the image cache.
+
+    Without an explicit `format` the best one the client accepts is picked.
+    Names that aren't digests are files cached before variants existed and
+    are served as they are.
+    """
+    if not DIGEST.fullmatch(name):
+        path = IMAGE_CACHE_DIR / name
+        if name.startswith(".") or not path.is_file():
+            IMAGE_RESPONSES.labels("not_found").inc()
+            raise HTTPException(status_code=404, detail="Image not found")
+        # Starlette sets an ETag from the file's size and mtime, but
+        # doesn't answer conditional requests itself.
+        response = FileResponse(path, stat_result=path.stat())
+        if if_none_match and response.headers["etag"] in if_none_match:
+            IMAGE_RESPONSES.labels("not_modified").inc()
+            return Response(status_code=304, headers={"ETag": response.headers["etag"]})
+        IMAGE_RESPONSES.labels("served").inc()
+        return response
+
+    variant = variant or DEFAULT_VARIANT
+    if variant not in VARIANTS:
+        raise HTTPException(status_code=400, detail="Invalid image variant")
+    headers = {"Cache-Control": IMMUTABLE}
+    if format is None:
+        format = next((f for f in FORMATS if CONTENT_TYPES[f] in accept), "webp")
+        headers["Vary"] = "Accept"
+    elif format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+
+    path = variant_path(IMAGE_CACHE_DIR, name, variant, format)
+    if not path.is_file():
+        IMAGE_RESPONSES.labels("not_found").inc()
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    headers["ETag"] = f'"{name}-{variant}.{format}"'
+    if if_none_match and headers["ETag"] in if_none_match:
+        IMAGE_RESPONSES.labels("not_modified").inc()
+        return Response(status_code=304, headers=headers)
+    IMAGE_RESPONSES.labels("served").inc()
+    return FileResponse(path, media_type=CONTENT_TYPES[format], headers=headers)
@@ -0,0 +1,658 @@
+MEDIA_TABLES = {"movie": "movies", "show": "shows"}
+
+# Run in every transaction that changes what the API returns, so responses
+# cached for an older generation are dropped.
+BUMP_GENERATION = "UPDATE generation SET value = value + 1"
+
+# What typeahead suggestions show and rank by. Triggers bump the title
+# generation whenever these change or media come and go, so the suggest
+# index is only rebuilt when its answers would differ.
+TITLE_COLUMNS = ("title", "year", "poster", "popularity")
+BUMP_TITLE_GENERATION = "UPDATE title_generation SET value = value + 1"
+
+# Bump whenever a trigger definition changes: databases with an older
+# user_version get their triggers recreated and derived indexes rebuilt.
+SCHEMA_VERSION = 6
+
+# Full-text search rows live in a single FTS5 table shared by movies and shows.
+# Each media row maps to a fixed FTS rowid (movies even, shows odd) so the sync
+# triggers can replace or drop an entry with a rowid lookup.
+SEARCH_ROWID = {"movie": "{row}.rowid * 2", "show": "{row}.rowid * 2 + 1"}
+
+# Searchable text pulled out of the TMDb/TVDb payload kept in `details`.
+SEARCH_FIELDS = {
+    "movie": {
+        "original_title": "json_extract({row}.details, '$.original_title')",
+        "aliases": (
+            "(SELECT group_concat(json_extract(value, '$.title'), ' ')"
+            " FROM json_each({row}.details, '$.alternative_titles.titles'))"
+        ),
+        "overview": "json_extract({row}.details, '$.overview')",
+    },
+    "show": {
+        "original_title": "json_extract({row}.details, '$.data.name')",
+        "aliases": (
+            "(SELECT group_concat(name, ' ') FROM ("
+            " SELECT json_extract(value, '$.name') AS name"
+            " FROM json_each({row}.details, '$.data.aliases')"
+            " UNION ALL SELECT json_extract(value, '$.name')"
+            " FROM json_each({row}.details, '$.data.translations.nameTranslations')))"
+        ),
+        "overview": (
+            "COALESCE(json_extract({row}.details, '$.data.overview'),"
+            " (SELECT json_extract(value, '$.overview') FROM json_each("
+            "{row}.details, '$.data.translations.overviewTranslations')"
+            " WHERE json_extract(value, '$.language') = 'eng'))"
+        ),
+    },
+}
+
+# Typed columns extracted from `details` for listings and filters, with the
+# SQL type they are declared with. Kept up to date by triggers on `details`.
+PROJECTION_COLUMNS = {
+    "poster": "TEXT",
+    "year": "INTEGER",
+    "rating": "REAL",
+    "runtime": "INTEGER",
+    "overview": "TEXT",
+    "status": "TEXT",
+    "popularity": "REAL",
+    "release_date": "TEXT",
+}
+
+PROJECTION_FIELDS = {
+    "movie": {
+        "poster": "json_extract({row}.details, '$.cached_poster')",
+        "year": (
+            "CAST(NULLIF(substr(json_extract({row}.details, '$.release_date'), 1, 4),"
+            " '') AS INTEGER)"
+        ),
+        "rating": "json_extract({row}.details, '$.vote_average')",
+        "runtime": "json_extract({row}.details, '$.runtime')",
+        "overview": SEARCH_FIELDS["movie"]["overview"],
+        "status": "json_extract({row}.details, '$.status')",
+        "popularity": "json_extract({row}.details, '$.popularity')",
+        "release_date": "NULLIF(json_extract({row}.details, '$.release_date'), '')",
+    },
+    "show": {
+        "poster": "json_extract({row}.details, '$.cached_poster')",
+        "year": "CAST(NULLIF(json_extract({row}.details, '$.data.year'), '') AS INTEGER)",
+        # TVDB doesn't rate series.
+        "rating": "NULL",
+        "runtime": "json_extract({row}.details, '$.data.averageRuntime')",
+        "overview": SEARCH_FIELDS["show"]["overview"],
+        "status": "json_extract({row}.details, '$.data.status.name')",
+        "popularity": "json_extract({row}.details, '$.data.score')",
+        "release_date": "NULLIF(json_extract({row}.details, '$.data.firstAired'), '')",
+    },
+}
+
+# Where each media type's details list its genres, as `{"name": ...}` objects
+GENRE_PATHS = {"movie": "$.genres", "show": "$.data.genres"}
+
+# Sort keys of listings, as generated columns of the media tables: their
+# SQL type, the expression (which puts media without a value last in the
+# default descending order, and keeps keyset cursors free of NULLs) and the
+# default direction.
+SORT_COLUMNS = {
+    "title": ("sort_title", "TEXT", "lower(COALESCE(title, ''))", "ASC"),
+    "rating": ("sort_rating", "REAL", "COALESCE(rating, -1)", "DESC"),
+    "popularity": ("sort_popularity", "REAL", "COALESCE(popularity, -1)", "DESC"),
+    "release_date": (
+        "sort_release_date",
+        "TEXT",
+        "COALESCE(release_date, '')",
+        "DESC",
+    ),
+}
+
+# Columns listings filter on. Every listing index ends with them, so
+# filters are checked on the index without reading the rows, whose
+# details make them large.
+FILTER_COLUMNS = ("year", "rating")
+
+# Columns copied from each media onto its genre and category memberships,
+# so a listing narrowed to a genre or category can seek on its membership
+# table's own sort indexes and filter there. Kept up to date by triggers.
+LISTING_COLUMNS = {
+    **{column: declaration for column, declaration, _, _ in SORT_COLUMNS.values()},
+    **{column: PROJECTION_COLUMNS[column] for column in FILTER_COLUMNS},
+}
+
+# Membership tables of the media, and the column each is keyed on first
+MEMBERSHIP_TABLES = {"media_genres": "genre", "media_categories": "category_id"}
+
+# Projection columns in the pre-rendered JSON card of each media, after its
+# id, title, categories and type.
+CARD_COLUMNS = ("poster", "year", "rating", "runtime", "status")
+
+# Column weights for bm25(): media_type, media_id, title, original_title,
+# aliases, overview.
+SEARCH_RANK = "bm25(0.0, 0.0, 10.0, 5.0, 5.0, 1.0)"
+
+
+def _search_insert(media_type: str, row: str):
+    fields = SEARCH_FIELDS[media_type]
+    values = ", ".join(
+        [
+            SEARCH_ROWID[media_type],
+            f"'{media_type}'",
+            "{row}.id",
+            "{row}.title",
+            fields["original_title"],
+            fields["aliases"],
+            fields["overview"],
+        ]
+    ).format(row=row)
+    return (
+        "INSERT INTO media_search"
+        " (rowid, media_type, media_id, title, original_title, aliases, overview)"
+        f" SELECT {values}"
+    )
+
+
+def _search_delete(media_type: str, row: str):
+    rowid = SEARCH_ROWID[media_type].format(row=row)
+    return f"DELETE FROM media_search WHERE rowid = {rowid}"
+
+
+def _projection_update(media_type: str, row: str, table: str):
+    """UPDATE of `table` setting the projection columns from `row`."""
+    assignments = ", ".join(
+        f"{column} = {expression.format(row=row)}"
+        for column, expression in PROJECTION_FIELDS[media_type].items()
+    )
+    return f"UPDATE {table} SET {assignments}"
+
+
+def _card_update(media_type: str, table: str):
+    """UPDATE of `table` rendering `card_json` from the row's columns."""
+    fields = "".join(f", '{column}', {column}" for column in CARD_COLUMNS)
+    return (
+        f"UPDATE {table} SET card_json = json_object("
+        f"'id', id, 'title', title, 'categories', json(categories),"
+        f" 'type', '{media_type}'{fields})"
+    )
+
+
+def _categories_insert(media_type: str, row: str, source: str = ""):
+    """Statements registering `row`'s categories and its memberships.
+
+    `source` is prepended to the FROM clause, so the same statements can
+    backfill a whole table as well as run for a single trigger row. They avoid
+    OR IGNORE on purpose: inside a trigger it is overridden by the conflict
+    handling of the statement that fired it.
+    """
+    return [
+        "INSERT INTO categories (name)"
+        f" SELECT DISTINCT j.value FROM {source}json_each({row}.categories) AS j"
+        " WHERE j.value NOT IN (SELECT name FROM categories)",
+        "INSERT INTO media_categories (category_id, media_type, media_id)"
+        f" SELECT DISTINCT c.id, '{media_type}', {row}.id"
+        f" FROM {source}json_each({row}.categories) AS j"
+        " JOIN categories c ON c.name = j.value",
+    ]
+
+
+def _genres_insert(media_type: str, row: str, source: str = ""):
+    """Statement registering the genres in `row`'s details.
+
+    Like `_categories_insert`, `source` lets it backfill a whole table.
+    """
+    name = "json_extract(g.value, '$.name')"
+    return (
+        "INSERT INTO media_genres (genre, media_type, media_id)"
+        f" SELECT DISTINCT {name}, '{media_type}', {row}.id"
+        f" FROM {source}json_each({row}.details, '{GENRE_PATHS[media_type]}') AS g"
+        f" WHERE {name} IS NOT NULL"
+    )
+
+
+def _genres_delete(media_type: str, row: str):
+    return (
+        "DELETE FROM media_genres"
+        f" WHERE media_type = '{media_type}' AND media_id = {row}.id"
+    )
+
+
+def _listing_update(media_type: str, membership: str, where: str = "1"):
+    """UPDATE copying the listing columns of the media onto their rows of the
+    `membership` table matching `where`, leaving unchanged rows alone."""
+    table = MEDIA_TABLES[media_type]
+    columns = ", ".join(LISTING_COLUMNS)
+    media = f"SELECT {columns} FROM {table} WHERE {table}.id = {membership}.media_id"
+    return (
+        f"UPDATE {membership} SET ({columns}) = ({media})"
+        f" WHERE media_type = '{media_type}' AND {where}"
+        f" AND ({columns}) IS NOT ({media})"
+    )
+
+
+def _categories_delete(media_type: str, row: str):
+    return (
+        "DELETE FROM media_categories"
+        f" WHERE media_type = '{media_type}' AND media_id = {row}.id"
+    )
+
+
+def prune_categories(cursor):
+    """Drop categories no media belongs to anymore."""
+    cursor.execute(
+        """
+        DELETE FROM categories
+        WHERE NOT EXISTS (
+            SELECT 1 FROM media_categories WHERE category_id = categories.id
+        )
+    """
+    )
+
+
+def _add_column(cursor, table: str, column: str, declaration: str):
+    """Add `column` to `table` in databases created before it existed."""
+    # table_xinfo, unlike table_info, lists generated columns too
+    cursor.execute(f"PRAGMA table_xinfo({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def create_tables(cursor):
+    """Create the media tables and the indexes kept in sync with them.
+
+    Search entries and category memberships are maintained by triggers, so
+    any write to `movies`/`shows` keeps them consistent.
+    """
+    for table in MEDIA_TABLES.values():
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                categories TEXT,
+                details TEXT
+            )
+        """
+        )
+        _add_column(cursor, table, "details_updated_at", "REAL")
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table}_details_updated_at
+            ON {table} (details_updated_at)
+        """
+        )
+        for column, declaration in PROJECTION_COLUMNS.items():
+            _add_column(cursor, table, column, declaration)
+        _add_column(cursor, table, "poster_url", "TEXT")
+        _add_column(cursor, table, "card_json", "TEXT")
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table}_poster_url
+            ON {table} (poster_url)
+        """
+        )
+
+        filters = ", ".join(FILTER_COLUMNS)
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_browse ON {table} (id, {filters})"
+        )
+        for key, (column, declaration, expression, _) in SORT_COLUMNS.items():
+            _add_column(
+                cursor,
+                table,
+                column,
+                f"{declaration} GENERATED ALWAYS AS ({expression}) VIRTUAL",
+            )
+            cursor.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS {table}_sort_{key}
+                ON {table} ({column}, id, {filters})
+            """
+            )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS http_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body BLOB NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS posters (
+            url TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """
+    )
+
+    for counter in ("generation", "title_generation"):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {counter} (value INTEGER NOT NULL)")
+        cursor.execute(
+            f"INSERT INTO {counter} (value)"
+            f" SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {counter})"
+        )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS poster_failures (
+            url TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            retry_at REAL NOT NULL
+        )
+    """
+    )
+
+    # Overseerr's media and latest request status, keyed like our media
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS availability (
+            media_type TEXT NOT NULL,
+            media_id TEXT NOT NULL,
+            status INTEGER,
+            request_status INTEGER,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (media_type, media_id)
+        ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute(
+        "SELECT name FROM sqlite_master"
+        " WHERE type = 'table'"
+        " AND name IN ('media_search', 'categories', 'media_genres')"
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS media_search USING fts5(
+            media_type UNINDEXED,
+            media_id UNINDEXED,
+            title,
+            original_title,
+            aliases,
+            overview,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_categories (
+            category_id INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            media_id TEXT NOT NULL,
+            PRIMARY KEY (category_id, media_type, media_id)
+        ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS media_categories_media
+        ON media_categories (media_type, media_id)
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_genres (
+            genre TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            media_id TEXT NOT NULL,
+            PRIMARY KEY (genre, media_type, media_id)
+        ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS media_genres_media
+        ON media_genres (media_type, media_id)
+    """
+    )
+
+    filters = ", ".join(FILTER_COLUMNS)
+    for membership, group in MEMBERSHIP_TABLES.items():
+        for column, declaration in LISTING_COLUMNS.items():
+            _add_column(cursor, membership, column, declaration)
+        for key, (column, _, _, _) in SORT_COLUMNS.items():
+            cursor.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS {membership}_sort_{key}
+                ON {membership} ({group}, media_type, {column}, media_id, {filters})
+            """
+            )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS yaml_files (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT NOT NULL
+        )
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS yaml_entries (
+            path TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            media_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            title TEXT NOT NULL,
+            PRIMARY KEY (path, media_type, media_id, category)
+        ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS yaml_entries_media
+        ON yaml_entries (media_type, media_id)
+    """
+    )
+
+    cursor.execute("PRAGMA user_version")
+    outdated = cursor.fetchone()[0] < SCHEMA_VERSION
+    if outdated:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        for (trigger,) in cursor.fetchall():
+            cursor.execute(f"DROP TRIGGER {trigger}")
+
+    for media_type, table in MEDIA_TABLES.items():
+        # Each membership trigger copies the listing columns onto the rows it
+        # adds, and the projection triggers refresh them once the projections
+        # changed: whichever order the triggers fire in, the last one sees
+        # the final values.
+        listing_updates = "".join(
+            f"{_listing_update(media_type, membership, 'media_id = new.id')};"
+            for membership in MEMBERSHIP_TABLES
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_insert
+            AFTER INSERT ON {table} BEGIN
+                {_search_insert(media_type, "new")};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_delete
+            AFTER DELETE ON {table} BEGIN
+                {_search_delete(media_type, "old")};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_update
+            AFTER UPDATE OF title, details ON {table} BEGIN
+                {_search_delete(media_type, "old")};
+                {_search_insert(media_type, "new")};
+            END
+        """
+        )
+
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_categories_insert
+            AFTER INSERT ON {table} BEGIN
+                {";".join(_categories_insert(media_type, "new"))};
+                {_listing_update(media_type, "media_categories", "media_id = new.id")};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_categories_delete
+            AFTER DELETE ON {table} BEGIN
+                {_categories_delete(media_type, "old")};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_categories_update
+            AFTER UPDATE OF id, categories ON {table} BEGIN
+                {_categories_delete(media_type, "old")};
+                {";".join(_categories_insert(media_type, "new"))};
+                {_listing_update(media_type, "media_categories", "media_id = new.id")};
+            END
+        """
+        )
+
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_genres_insert
+            AFTER INSERT ON {table} BEGIN
+                {_genres_insert(media_type, "new")};
+                {_listing_update(media_type, "media_genres", "media_id = new.id")};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_genres_delete
+            AFTER DELETE ON {table} BEGIN
+                {_genres_delete(media_type, "old")};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_genres_update
+            AFTER UPDATE OF id, details ON {table} BEGIN
+                {_genres_delete(media_type, "old")};
+                {_genres_insert(media_type, "new")};
+                {_listing_update(media_type, "media_genres", "media_id = new.id")};
+            END
+        """
+        )
+
+        titles = ", ".join(TITLE_COLUMNS)
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_titles_insert
+            AFTER INSERT ON {table} BEGIN
+                {BUMP_TITLE_GENERATION};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_titles_delete
+            AFTER DELETE ON {table} BEGIN
+                {BUMP_TITLE_GENERATION};
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_titles_update
+            AFTER UPDATE OF {titles} ON {table}
+            WHEN ({", ".join(f"old.{c}" for c in TITLE_COLUMNS)})
+            IS NOT ({", ".join(f"new.{c}" for c in TITLE_COLUMNS)})
+            BEGIN
+                {BUMP_TITLE_GENERATION};
+            END
+        """
+        )
+
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_projection_insert
+            AFTER INSERT ON {table} BEGIN
+                {_projection_update(media_type, "new", table)}
+                WHERE rowid = new.rowid AND new.details IS NOT NULL;
+                {_card_update(media_type, table)} WHERE rowid = new.rowid;
+                {listing_updates}
+            END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_projection_update
+            AFTER UPDATE OF title, categories, details ON {table} BEGIN
+                {_projection_update(media_type, "new", table)}
+                WHERE rowid = new.rowid;
+                {_card_update(media_type, table)} WHERE rowid = new.rowid;
+                {listing_updates}
+            END
+        """
+        )
+
+    if outdated or "media_search" not in existing:
+        cursor.execute("DELETE FROM media_search")
+        cursor.execute(
+            "INSERT INTO media_search (media_search, rank) VALUES ('rank', ?)",
+            (SEARCH_RANK,),
+        )
+        for media_type, table in MEDIA_TABLES.items():
+            cursor.execute(f"{_search_insert(media_type, table)} FROM {table}")
+
+    if outdated or "categories" not in existing:
+        cursor.execute("DELETE FROM media_categories")
+        for media_type, table in MEDIA_TABLES.items():
+            for statement in _categories_insert(media_type, table, f"{table}, "):
+                cursor.execute(statement)
+
+    if outdated or "media_genres" not in existing:
+        cursor.execute("DELETE FROM media_genres")
+        for media_type, table in MEDIA_TABLES.items():
+            cursor.execute(_genres_insert(media_type, table, f"{table}, "))
+
+    if outdated:
+        for media_type, table in MEDIA_TABLES.items():
+            cursor.execute(
+                f"{_projection_update(media_type, table, table)}"
+                " WHERE details IS NOT NULL"
+            )
+            cursor.execute(_card_update(media_type, table))
+
+    if outdated or not {"categories", "media_genres"} <= existing:
+        for media_type in MEDIA_TABLES:
+            for membership in MEMBERSHIP_TABLES:
+                cursor.execute(_listing_update(media_type, membership))
+
+    if outdated:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
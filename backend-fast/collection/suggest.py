@@ -0,0 +1,259 @@
+import orjson
+import re
+import threading
+import time
+import unicodedata
+
+from array import array
+from typing import NamedTuple
+
+from ..config import get_database
+from .schema import MEDIA_TABLES
+
+# Suggestions a single request may ask for
+MAX_SUGGESTIONS = 20
+
+# Prefixes matching more title suffixes than this get their suggestions
+# ranked when the index is built; narrower ones are ranked when asked for.
+RANKED_RANGE = 256
+
+# Only this many characters of a query are matched
+MAX_PREFIX = 64
+
+# Seconds between checks of the title generation, and the least time
+# between the starts of two rebuilds
+CHECK_INTERVAL = 1.0
+REBUILD_INTERVAL = 30.0
+
+# Separates titles in the corpus. It sorts below every character of a
+# normalized title, so a title ending early sorts before the longer ones.
+SEPARATOR = "\n"
+
+
+def normalize(text: str):
+    """Casefold `text`, strip its accents and keep its words, separated by
+    single spaces."""
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def _bound(corpus, offsets, prefix, lo, hi, right=False):
+    """Binary search of `offsets` for where the text starting at each offset,
+    cut to the length of `prefix`, stops being below (or, with `right`, up to)
+    `prefix`."""
+    length = len(prefix)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        key = corpus[offsets[mid] : offsets[mid] + length]
+        if key < prefix or (right and key == prefix):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class _Snapshot(NamedTuple):
+    corpus: str
+    offsets: array
+    owners: array
+    ranked: dict
+    cards: list
+
+
+def _build(media):
+    """Index `media`, `(type, id, title, year, poster)` rows ordered most
+    popular first."""
+    texts = [normalize(title or "") for _, _, title, _, _ in media]
+    corpus = SEPARATOR.join(texts)
+
+    starts, owners, ends = array("L"), array("L"), array("L")
+    position = 0
+    for number, text in enumerate(texts):
+        end = position + len(text)
+        if text:
+            for start in (0, *(m.end() for m in re.finditer(" ", text))):
+                starts.append(position + start)
+                owners.append(number)
+                ends.append(end)
+        position = end + len(SEPARATOR)
+
+    order = sorted(
+        range(len(starts)),
+        key=lambda i: corpus[starts[i] : min(ends[i], starts[i] + MAX_PREFIX)],
+    )
+    offsets = array("L", (starts[i] for i in order))
+    owners = array("L", (owners[i] for i in order))
+
+    # Walk the prefixes whose ranges are too wide to rank on request, each
+    # range split by the character following the prefix.
+    # A prefix matching the same range as the one it extends shares its list.
+    ranked = {}
+    pending = [(0, len(offsets), "", None)]
+    while pending:
+        lo, hi, prefix, best = pending.pop()
+        if prefix:
+            if best is None:
+                best = sorted(set(owners[lo:hi]))[:MAX_SUGGESTIONS]
+            ranked[prefix] = best
+        if len(prefix) == MAX_PREFIX:
+            continue
+        # Titles ending with the prefix come first and can't be extended.
+        i = _bound(corpus, offsets, prefix + SEPARATOR, lo, hi, right=True)
+        while i < hi:
+            child = corpus[offsets[i] : offsets[i] + len(prefix) + 1]
+            j = _bound(corpus, offsets, child, i, hi, right=True)
+            if j - i > RANKED_RANGE:
+                same = prefix and i == lo and j == hi
+                pending.append((i, j, child, best if same else None))
+            i = j
+
+    cards = [
+        orjson.dumps(
+            {
+                "id": id,
+                "title": title,
+                "type": media_type,
+                "year": year,
+                "poster": poster,
+            }
+        )
+        for media_type, id, title, year, poster in media
+    ]
+    return _Snapshot(corpus, offsets, owners, ranked, cards)
+
+
+def _title_generation():
+    with get_database().read("title_generation") as conn:
+        return conn.execute("SELECT value FROM title_generation").fetchone()[0]
+
+
+def _read_media():
+    """Every movie and show, most popular first.
+
+    Popularity isn't comparable between TMDb and TVDB, so the two lists are
+    interleaved by how far down its own list each media is.
+    """
+    lists = []
+    with get_database().read("suggest_index") as conn:
+        for media_type, table in MEDIA_TABLES.items():
+            lists.append(
+                conn.execute(
+                    f"SELECT '{media_type}', id, title, year, poster FROM {table}"
+                    " ORDER BY sort_popularity DESC, id"
+                ).fetchall()
+            )
+    ranked = [(n / len(rows), row) for rows in lists for n, row in enumerate(rows)]
+    ranked.sort(key=lambda pair: pair[0])
+    return [row for _, row in ranked]
+
+
+class SuggestIndex:
+    """Typeahead over movie and show titles, answered from memory.
+
+    Normalized titles are joined into one corpus string, and `offsets` lists
+    the start of every word in it, sorted by the text from there to the end
+    of its title: a suffix array cut at word boundaries. The titles starting
+    with a prefix, or with a word starting with it, are then one range of
+    `offsets` found by binary search. Media are numbered most popular first
+    and `owners` maps each offset to its media, so the best suggestions for a
+    range are its smallest numbers; wide ranges have them ranked up front.
+
+    The index is built for a title generation, which only moves when a
+    title, year, poster or popularity does. `refresh` rebuilds it in the
+    background once the generation moved on, and suggestions come from the
+    previous index until the new one is ready.
+    """
+
+    def __init__(self):
+        self.generation = None
+        self.build_seconds = None
+        self._snapshot = None
+        self._building = False
+        self._checked_at = None
+        self._started_at = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Rebuild the index if the titles changed since it was built.
+
+        The title generation is read at most every `CHECK_INTERVAL` seconds
+        and not at all for `REBUILD_INTERVAL` seconds after a rebuild
+        started, so keystrokes mostly don't touch SQLite and a stream of
+        changes costs one rebuild per interval. The first build runs in the
+        calling thread, so there is an index to answer from once this
+        returns.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = not self._building and (
+                self._snapshot is None
+                or (
+                    now - self._checked_at >= CHECK_INTERVAL
+                    and now - self._started_at >= REBUILD_INTERVAL
+                )
+            )
+            if due:
+                self._checked_at = now
+
+        if due:
+            generation = _title_generation()
+            with self._lock:
+                start = generation != self.generation and not self._building
+                if start:
+                    self._building = True
+                    self._started_at = now
+                    first = self._snapshot is None
+            if start and first:
+                self._rebuild(generation)
+            elif start:
+                threading.Thread(
+                    target=self._rebuild,
+                    args=(generation,),
+                    name="suggest-index",
+                    daemon=True,
+                ).start()
+        self._ready.wait()
+
+    def _rebuild(self, generation):
+        started = time.perf_counter()
+        try:
+            snapshot = _build(_read_media())
+            with self._lock:
+                self._snapshot = snapshot
+                self.generation = generation
+                self.build_seconds = round(time.perf_counter() - started, 3)
+        finally:
+            with self._lock:
+                self._building = False
+            self._ready.set()
+
+    def suggest(self, query: str, limit: int = 10):
+        """Cards of the `limit` most popular media matching `query`, as JSON
+        fragments."""
+        snapshot = self._snapshot
+        prefix = normalize(query)[:MAX_PREFIX]
+        if snapshot is None or not prefix:
+            return []
+
+        numbers = snapshot.ranked.get(prefix)
+        if numbers is None:
+            corpus, offsets = snapshot.corpus, snapshot.offsets
+            lo = _bound(corpus, offsets, prefix, 0, len(offsets))
+            hi = _bound(corpus, offsets, prefix, lo, len(offsets), right=True)
+            numbers = sorted(set(snapshot.owners[lo:hi]))
+        return [orjson.Fragment(snapshot.cards[n]) for n in numbers[:limit]]
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "generation": self.generation,
+            "build_seconds": self.build_seconds,
+            "building": self._building,
+            "media": len(snapshot.cards) if snapshot else 0,
+            "entries": len(snapshot.offsets) if snapshot else 0,
+            "ranked_prefixes": len(snapshot.ranked) if snapshot else 0,
+        }
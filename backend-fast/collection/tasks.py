@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+from collections import deque
+
+
+class Progress:
+    """Counts of a batch job's items, with its recent rate and ETA."""
+
+    def __init__(self, window=60):
+        self.window = window  # Seconds the current rate is measured over
+        self.reset()
+
+    def reset(self):
+        self.queued = 0
+        self.done = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+        self._completions = deque()
+
+    def start(self, queued=0):
+        self.reset()
+        self.queued = queued
+        self.started_at = time.time()
+
+    def add(self, queued):
+        self.queued += queued
+
+    def record(self, success):
+        if success:
+            self.done += 1
+        else:
+            self.failed += 1
+        self._completions.append(time.monotonic())
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def rate(self):
+        """Items completed per second over the last `window` seconds."""
+        horizon = time.monotonic() - self.window
+        while self._completions and self._completions[0] < horizon:
+            self._completions.popleft()
+        if not self._completions:
+            return 0.0
+        elapsed = min(self.window, time.time() - self.started_at)
+        return len(self._completions) / max(elapsed, 1e-9)
+
+    def snapshot(self):
+        rate = self.rate()
+        remaining = max(self.queued - self.done - self.failed, 0)
+        return {
+            "running": self.started_at is not None and self.finished_at is None,
+            "queued": self.queued,
+            "done": self.done,
+            "failed": self.failed,
+            "remaining": remaining,
+            "rate": round(rate, 2),
+            "eta": round(remaining / rate) if rate else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class BackgroundJob:
+    """Runs a coroutine function in a supervised task.
+
+    The function runs once on `start()` and again whenever `trigger()` is
+    called, or every `interval` seconds if one is given; triggers arriving
+    while it runs are coalesced into one more run. If it crashes it is
+    retried after `retry_delay` seconds. `stop()` cancels it and waits for it
+    to unwind.
+    """
+
+    def __init__(self, name, func, retry_delay=30, interval=None):
+        self.name = name
+        self.func = func
+        self.retry_delay = retry_delay
+        self.interval = interval
+        self.runs = 0
+        self.busy = False
+        self.last_error = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._supervise(), name=self.name)
+        self.trigger()
+
+    def trigger(self):
+        self._wakeup.set()
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _supervise(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.runs += 1
+            self.busy = True
+            try:
+                await self.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = repr(e)
+                print(f"Background job {self.name} failed: {e!r}")
+                await asyncio.sleep(self.retry_delay)
+                self.trigger()
+            finally:
+                self.busy = False
+
+    def status(self):
+        return {
+            "running": self.running,
+            "busy": self.busy,
+            "runs": self.runs,
+            "last_error": self.last_error,
+        }
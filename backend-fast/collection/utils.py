@@ -1,26 +1,46 @@
 import aiofiles
 import aiohttp
 import asyncio
+import hashlib
 import json
-import yaml
+import multiprocessing
+import os
+import sqlite3
 import time
+import uuid
 
+from concurrent.futures import ProcessPoolExecutor
 from fastapi import HTTPException
+from functools import lru_cache
 from pathlib import Path
 from tenacity import retry, stop_after_attempt, wait_exponential
 from aiohttp import AsyncResolver, TCPConnector, ClientTimeout
-
-from ..config import (
-    get_settings,
-    get_db_connection,
-    get_async_db_connection,
-    IMAGE_CACHE_DIR,
+from watchfiles import awatch
+from yarl import URL
+
+from ..config import get_settings, get_database, IMAGE_CACHE_DIR
+from .httpcache import HTTPCache
+from .images import has_variants, make_variants, source_path
+from .metrics import (
+    ENRICHED,
+    IMAGE_CACHE,
+    INGEST_DURATION,
+    OUTBOUND_DURATION,
+    RATE_LIMIT_WAIT,
 )
+from .ratelimit import RateLimiter, parse_retry_after
+from .reports import merge_reports, read_report
+from .schema import BUMP_GENERATION, MEDIA_TABLES, create_tables, prune_categories
+from .tasks import Progress
 
 yaml_settings = dict()
 
 
-SEM = asyncio.Semaphore(5)  # Limit concurrent requests to prevent rate-limiting
+# Extra TMDb movie data fetched along with the details in a single request
+TMDB_APPEND_TO_RESPONSE = "external_ids,release_dates,alternative_titles"
+
+# Statuses worth retrying after a pause
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
 # Create a custom resolver
@@ -52,6 +72,13 @@ class TVDBTokenCache:
 # Global token cache
 token_cache = TVDBTokenCache()
 
+# Progress of the current (or last) fetch_media_details run
+enrichment_progress = Progress()
+# Progress of the current (or last) refresh_media_details run
+refresh_progress = Progress()
+# Progress of the current (or last) download_posters run
+poster_progress = Progress()
+
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 async def ensure_valid_token(session):
@@ -61,7 +88,7 @@ async def ensure_valid_token(session):
 
     settings = get_settings()
 
-    url = "https://api4.thetvdb.com/v4/login"
+    url = f"{settings.tvdb_api_url}/login"
     payload = {"apikey": settings.tvdb_api_key}
 
     # If using user-supported model, include PIN
@@ -86,244 +113,922 @@ async def ensure_valid_token(session):
         raise HTTPException(status_code=401, detail="No token in TVDB response")
 
 
+def init_db():
+    """Create the database schema, or migrate an existing one."""
+    with get_database().write("init_db") as conn:
+        create_tables(conn.cursor())
+
+
+def _yaml_files(path: Path):
+    return list(path.rglob("*.yaml")) + list(path.rglob("*.yml"))
+
+
+def process_pool(workers):
+    """A pool of `workers` processes, spawned rather than forked: the server
+    process runs threads and an event loop, which a fork would copy mid-use."""
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _read_reports(jobs):
+    """Read `(yaml_file, known_hash)` jobs, fanning out to a process pool.
+
+    Returns `read_report`'s results in job order and prints the throughput so
+    the pool can be sized with `YAML_PARSE_WORKERS`.
+    """
+    if not jobs:
+        return []
+
+    started = time.perf_counter()
+    workers = get_settings().yaml_parse_workers or os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+
+    if workers > 1:
+        with process_pool(workers) as executor:
+            results = list(
+                executor.map(
+                    read_report,
+                    *zip(*jobs),
+                    chunksize=max(1, len(jobs) // (workers * 4)),
+                )
+            )
+    else:
+        results = [read_report(*job) for job in jobs]
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    INGEST_DURATION.labels("parse").observe(elapsed)
+    items = sum(len(parsed[0]) + len(parsed[1]) for _, parsed in results if parsed)
+    print(
+        f"Parsed {len(jobs)} report files in {elapsed:.2f}s with {workers} workers"
+        f" ({len(jobs) / elapsed:.1f} files/s, {items / elapsed:.0f} items/s)"
+    )
+    return results
+
+
 def parse_yaml_files(directory: str):
     path = Path(directory)
     if not path.is_dir():
         return {}, {}
 
-    yaml_files = list(path.rglob("*.yaml")) + list(path.rglob("*.yml"))
-    parsed_movies = {}
-    parsed_shows = {}
+    results = _read_reports([(yaml_file, None) for yaml_file in _yaml_files(path)])
+    return merge_reports(parsed for _, parsed in results if parsed)
 
-    for yaml_file in yaml_files:
-        with open(yaml_file, "r", encoding="utf-8") as file:
-            try:
-                content = yaml.safe_load(file)
-                if isinstance(content, dict):
-                    for category, subcategories in content.items():
-                        if isinstance(subcategories, dict):
-                            for subcategory, items in subcategories.items():
-                                if isinstance(items, dict):
-                                    for id, title in items.items():
-                                        if isinstance(title, str):
-                                            if subcategory.endswith(
-                                                "Missing (TMDb IDs)"
-                                            ):
-                                                if id not in parsed_movies:
-                                                    parsed_movies[id] = {
-                                                        "title": title,
-                                                        "categories": [],
-                                                        "type": "movie",
-                                                    }
-                                                if (
-                                                    category
-                                                    not in parsed_movies[id][
-                                                        "categories"
-                                                    ]
-                                                ):
-                                                    parsed_movies[id][
-                                                        "categories"
-                                                    ].append(category)
-                                            elif subcategory.endswith(
-                                                "Missing (TVDb IDs)"
-                                            ):
-                                                if id not in parsed_shows:
-                                                    parsed_shows[id] = {
-                                                        "title": title,
-                                                        "categories": [],
-                                                        "type": "show",
-                                                    }
-                                                if (
-                                                    category
-                                                    not in parsed_shows[id][
-                                                        "categories"
-                                                    ]
-                                                ):
-                                                    parsed_shows[id][
-                                                        "categories"
-                                                    ].append(category)
-            except yaml.YAMLError:
-                continue
 
-    return parsed_movies, parsed_shows
+def _sync_media_table(cursor, table, parsed, ids=None):
+    """Bring `table` in line with `parsed`, writing only what changed.
+
+    When `ids` is given only those rows are compared, and the ones missing
+    from `parsed` are deleted; otherwise the whole table is.
+    """
+    if ids is None:
+        cursor.execute(f"SELECT id, title, categories FROM {table}")
+    else:
+        cursor.execute(
+            f"SELECT id, title, categories FROM {table}"
+            " WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(ids)),),
+        )
+    current = {id: (title, categories) for id, title, categories in cursor}
+
+    wanted = {
+        str(id): (data["title"], json.dumps(data["categories"]))
+        for id, data in parsed.items()
+    }
+    changed = [(id, *row) for id, row in wanted.items() if current.get(id) != row]
+    removed = [(id,) for id in current.keys() - wanted.keys()]
+
+    # Update in place so enrichment already stored in `details` is kept.
+    cursor.executemany(
+        f"""
+        INSERT INTO {table} (id, title, categories) VALUES (?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            title = excluded.title,
+            categories = excluded.categories
+        """,
+        changed,
+    )
+    cursor.executemany(f"DELETE FROM {table} WHERE id = ?", removed)
+
+    return {
+        "added": sum(1 for id, *_ in changed if id not in current),
+        "updated": sum(1 for id, *_ in changed if id in current),
+        "removed": len(removed),
+    }
+
 
+def _changed(stats):
+    return any(sum(counts.values()) for counts in stats.values())
 
+
+@INGEST_DURATION.labels("save").time()
 def save_to_sqlite(movies, shows):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Sync parsed reports into SQLite as a diff, in a single transaction.
 
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS movies (
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            categories TEXT,
-            details TEXT
-        )
+    Media no longer listed in any report are deleted.
     """
-    )
+    with get_database().write("save_to_sqlite") as conn:
+        cursor = conn.cursor()
+        create_tables(cursor)
 
+        stats = {
+            "movies": _sync_media_table(cursor, "movies", movies),
+            "shows": _sync_media_table(cursor, "shows", shows),
+        }
+        prune_categories(cursor)
+        if _changed(stats):
+            cursor.execute(BUMP_GENERATION)
+
+    return stats
+
+
+def _entries_for(cursor, media_type, ids):
+    """Rebuild parsed media from the report entries still listing them."""
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS shows (
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            categories TEXT,
-            details TEXT
+        SELECT media_id, title, category FROM yaml_entries
+        WHERE media_type = ? AND media_id IN (SELECT value FROM json_each(?))
+        ORDER BY media_id, path, category
+    """,
+        (media_type, json.dumps(list(ids))),
+    )
+    parsed = {}
+    for id, title, category in cursor:
+        media = parsed.setdefault(
+            id, {"title": title, "categories": [], "type": media_type}
         )
+        if category not in media["categories"]:
+            media["categories"].append(category)
+    return parsed
+
+
+@INGEST_DURATION.labels("sync").time()
+def sync_yaml_directory(directory: str):
+    """Apply the report files that changed since the last sync to SQLite.
+
+    `yaml_files` records each file's mtime, size and hash and `yaml_entries`
+    what it lists, so only new, modified or deleted files are read and only
+    the media they touch are rewritten. Media whose last listing disappeared
+    are deleted. Files that fail to parse keep their manifest row and
+    entries, so they are read again once they change. Returns None when
+    `directory` is missing, leaving the database untouched.
+
+    The first sync against an empty manifest also compares the media no
+    entry lists, which a database from before the manifest is full of, so
+    whatever its reports no longer mention is deleted then.
     """
+    path = Path(directory)
+    if not path.is_dir():
+        return None
+
+    init_db()
+    with get_database().read("sync_manifest") as conn:
+        cursor = conn.execute("SELECT path, mtime, size, hash FROM yaml_files")
+        manifest = {path: (mtime, size, hash) for path, mtime, size, hash in cursor}
+
+    on_disk = {str(yaml_file): yaml_file.stat() for yaml_file in _yaml_files(path)}
+    candidates = [
+        (file_path, stat)
+        for file_path, stat in on_disk.items()
+        if manifest.get(file_path, (None, None))[:2] != (stat.st_mtime, stat.st_size)
+    ]
+    removed = manifest.keys() - on_disk.keys()
+
+    results = _read_reports(
+        [
+            (Path(file_path), manifest.get(file_path, (None, None, None))[2])
+            for file_path, _ in candidates
+        ]
     )
+    reports = {
+        file_path: (stat, digest, parsed)
+        for (file_path, stat), (digest, parsed) in zip(candidates, results)
+        if digest is not None
+    }
+
+    # Files are read and parsed before taking the writer.
+    with get_database().write("apply_reports") as conn:
+        stats = _apply_reports(conn.cursor(), reports, removed, not manifest)
+
+    stats["files"] = {
+        "read": len(reports),
+        "failed": len(candidates) - len(reports),
+        "changed": sum(1 for _, _, parsed in reports.values() if parsed),
+        "removed": len(removed),
+    }
+    return stats
+
 
-    for id, data in movies.items():
+def _apply_reports(cursor, reports, removed, unlisted=False):
+    """Write re-read and removed report files to the manifest and media.
+
+    With `unlisted`, media no report entry lists are compared too.
+    """
+    affected = {"movie": set(), "show": set()}
+    if unlisted:
+        for media_type, table in MEDIA_TABLES.items():
+            cursor.execute(
+                f"""
+                SELECT id FROM {table} WHERE id NOT IN
+                (SELECT media_id FROM yaml_entries WHERE media_type = ?)
+                """,
+                (media_type,),
+            )
+            affected[media_type].update(row[0] for row in cursor.fetchall())
+    for file_path in removed | {p for p, (_, _, parsed) in reports.items() if parsed}:
         cursor.execute(
-            "INSERT OR REPLACE INTO movies (id, title, categories) VALUES (?, ?, ?)",
-            (id, data["title"], json.dumps(data["categories"])),
+            "SELECT media_type, media_id FROM yaml_entries WHERE path = ?",
+            (file_path,),
         )
+        for media_type, media_id in cursor.fetchall():
+            affected[media_type].add(media_id)
+        cursor.execute("DELETE FROM yaml_entries WHERE path = ?", (file_path,))
+
+    cursor.executemany(
+        "DELETE FROM yaml_files WHERE path = ?", [(file_path,) for file_path in removed]
+    )
 
-    for id, data in shows.items():
+    for file_path, (stat, digest, parsed) in reports.items():
         cursor.execute(
-            "INSERT OR REPLACE INTO shows (id, title, categories) VALUES (?, ?, ?)",
-            (id, data["title"], json.dumps(data["categories"])),
+            """
+            INSERT INTO yaml_files (path, mtime, size, hash) VALUES (?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                mtime = excluded.mtime,
+                size = excluded.size,
+                hash = excluded.hash
+            """,
+            (file_path, stat.st_mtime, stat.st_size, digest),
         )
+        if not parsed:
+            continue
+        for media in parsed:
+            cursor.executemany(
+                """
+                INSERT INTO yaml_entries (path, media_type, media_id, category, title)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    (file_path, data["type"], id, category, data["title"])
+                    for id, data in media.items()
+                    for category in data["categories"]
+                ),
+            )
+            for id, data in media.items():
+                affected[data["type"]].add(id)
+
+    stats = {}
+    for media_type, table in MEDIA_TABLES.items():
+        ids = affected[media_type]
+        parsed = _entries_for(cursor, media_type, ids)
+        stats[table] = _sync_media_table(cursor, table, parsed, ids)
+    prune_categories(cursor)
+    if _changed(stats):
+        cursor.execute(BUMP_GENERATION)
+    return stats
+
+
+async def watch_yaml_directory(directory: str, on_added=None):
+    """Keep SQLite in sync with the report directory while the server runs.
+
+    Kometa rewrites its missing reports after every run; each batch of file
+    events is applied as a delta, and `on_added` is called when it brought in
+    new media that need enriching.
+    """
+    if not Path(directory).is_dir():
+        return
+
+    settings = get_settings()
+    async for _ in awatch(
+        directory,
+        watch_filter=lambda _, path: path.endswith((".yaml", ".yml")),
+        force_polling=settings.watch_force_polling,
+    ):
+        try:
+            stats = await asyncio.to_thread(sync_yaml_directory, directory)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Failed to sync {directory}: {e}")
+            continue
+        if not stats:
+            continue
+
+        if on_added and any(stats[t]["added"] for t in MEDIA_TABLES.values()):
+            on_added()
+
+
+def provider_hosts():
+    """Hosts we call, as `host:port`, by the provider whose rate limit they
+    count against."""
+    settings = get_settings()
+    return {
+        URL(settings.tmdb_api_url).authority: "tmdb",
+        URL(settings.tvdb_api_url).authority: "tvdb",
+        URL(settings.tmdb_image_url).authority: "images",
+        URL(settings.tvdb_image_url).authority: "images",
+    }
+
+
+@lru_cache
+def get_rate_limiter():
+    settings = get_settings()
+    return RateLimiter(
+        {
+            "tmdb": (settings.tmdb_rate_limit, settings.tmdb_burst),
+            "tvdb": (settings.tvdb_rate_limit, settings.tvdb_burst),
+            "images": (settings.image_rate_limit, settings.image_burst),
+            "default": (settings.image_rate_limit, settings.image_burst),
+        },
+        provider_hosts(),
+    )
+
+
+@lru_cache
+def get_http_cache():
+    return HTTPCache(get_database())
 
-    conn.commit()
-    conn.close()
+
+async def acquire_rate_limit(url):
+    """Wait for `url`'s provider to allow a request; returns the provider."""
+    limiter = get_rate_limiter()
+    provider = limiter.provider(URL(url).authority)
+    RATE_LIMIT_WAIT.labels(provider).observe(await limiter.acquire(provider))
+    return provider
+
+
+async def _update_http_cache(func, *args):
+    try:
+        await asyncio.to_thread(func, *args)
+    except sqlite3.Error as e:
+        print(f"HTTP cache update failed: {e}")
 
 
 async def fetch_json(session, url, headers=None):
-    """Fetch JSON from URL."""
-    async with SEM:
+    """Fetch JSON from URL, retrying throttled and failed requests.
+
+    429s and 5xx responses slow the provider's token bucket down and are
+    retried after their Retry-After, or with exponential backoff without one.
+    Responses carrying an ETag or Last-Modified are cached, and later fetches
+    of the same URL are sent as conditional requests so an unchanged resource
+    costs a bodyless 304.
+    """
+    limiter = get_rate_limiter()
+    provider = limiter.provider(URL(url).authority)
+    attempts = get_settings().http_max_attempts
+
+    cache = get_http_cache()
+    try:
+        cached = await asyncio.to_thread(cache.lookup, url)
+    except sqlite3.Error as e:
+        print(f"HTTP cache lookup failed: {e}")
+        cached = None
+    headers = dict(headers or {})
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    for attempt in range(attempts):
+        if attempt:
+            limiter.retried(provider)
+        RATE_LIMIT_WAIT.labels(provider).observe(await limiter.acquire(provider))
+        retry_after = None
+        started = time.perf_counter()
+        status = "error"
         try:
             async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    return await response.json()
+                status = response.status
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                limiter.record(provider, response.status, retry_after)
+                if response.status == 304 and cached:
+                    await _update_http_cache(cache.revalidated, url)
+                    return cached[2]
+                elif response.status == 200:
+                    data = await response.json()
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    if etag or last_modified:
+                        await _update_http_cache(
+                            cache.store, url, etag, last_modified, data
+                        )
+                    return data
                 elif response.status == 401:
                     token_cache.set_token(None)
                     print("TVDB token expired, fetching new token")
-                    pass
-                else:
+                    return None
+                elif response.status not in RETRY_STATUSES:
                     print(f"API error: {response.status} for {url.split('?')[0]}")
-                    pass
-        except aiohttp.ClientError:
-            print(f"Error fetching data from {url}")
-            pass
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            limiter.record(provider, None)
+        finally:
+            OUTBOUND_DURATION.labels(provider, status).observe(
+                time.perf_counter() - started
+            )
+
+        # With a Retry-After the provider's bucket is paused until then.
+        if not retry_after and attempt + 1 < attempts:
+            await asyncio.sleep(min(2**attempt, 30))
+
+    print(f"Giving up on {url.split('?')[0]} after {attempts} attempts")
     return None
 
 
 async def fetch_tmdb_details(session, movie_id):
-    """Fetch movie details from TMDb API."""
+    """Fetch movie details from TMDb API.
+
+    Everything else we use about the movie is appended to the same request.
+    The poster is left to `download_posters`, unless it is already cached.
+    """
     settings = get_settings()
 
-    url = f"https://api.themoviedb.org/3/movie/{movie_id}?api_key={settings.tmdb_api_key}&language=en-US"
+    url = (
+        f"{settings.tmdb_api_url}/movie/{movie_id}"
+        f"?api_key={settings.tmdb_api_key}&language=en-US"
+        f"&append_to_response={TMDB_APPEND_TO_RESPONSE}"
+    )
     data = await fetch_json(session, url)
 
-    if data and "poster_path" in data:
-        data["cached_poster"] = await cache_tmdb_poster(
-            session, data["poster_path"], movie_id, "movie"
-        )
+    if data:
+        data["cached_poster"] = await cached_poster(poster_source("movie", data))
     return data
 
 
 async def fetch_tvdb_details(session, show_id):
-    """Fetch TV show details from TVDb API."""
+    """Fetch TV show details, with translations, from TVDb API in one call."""
     token = await ensure_valid_token(session)
 
-    url = f"https://api4.thetvdb.com/v4/series/{show_id}"
+    url = (
+        f"{get_settings().tvdb_api_url}/series/{show_id}/extended"
+        "?meta=translations&short=true"
+    )
     headers = {"Authorization": f"Bearer {token}"}
 
     data = await fetch_json(session, url, headers=headers)
 
-    if data and "data" in data and "image" in data["data"]:
-        data["cached_poster"] = await cache_tvdb_poster(
-            session, data["data"]["image"], show_id, "show"
-        )
+    if data and "data" in data:
+        data["cached_poster"] = await cached_poster(poster_source("show", data))
     return data
 
 
-async def fetch_media_details():
-    """Fetch and update media details, including poster caching."""
-    async with get_async_db_connection() as db:
-        async with db.execute("SELECT id FROM movies WHERE details IS NULL") as cursor:
-            movie_ids = [row[0] for row in await cursor.fetchall()]
-        async with db.execute("SELECT id FROM shows WHERE details IS NULL") as cursor:
-            show_ids = [row[0] for row in await cursor.fetchall()]
+async def _enrichment_worker(session, queue, results, progress):
+    """Fetch details for queued `(media_type, id)` pairs until cancelled.
+
+    Every pair yields a result, with None as the details of a failed fetch.
+    """
+    while True:
+        media_type, media_id = await queue.get()
+        try:
+            fetch = fetch_tmdb_details if media_type == "movie" else fetch_tvdb_details
+            try:
+                details = await fetch(session, media_id)
+            except Exception as e:
+                print(f"Failed to fetch details for {media_type} {media_id}: {e!r}")
+                details = None
+
+            progress.record(bool(details))
+            ENRICHED.labels(media_type, "success" if details else "failed").inc()
+            await results.put((media_type, media_id, details or None))
+        finally:
+            queue.task_done()
+
+
+def _save_details(batch, touch_failed):
+    """Write `(media_type, id, details)` results in one transaction.
+
+    Returns whether any details changed.
+    """
+    now = time.time()
+    changed = False
+    with get_database().write("save_details") as conn:
+        for media_type, table in MEDIA_TABLES.items():
+            fetched = [
+                (json.dumps(d), poster_source(media_type, d), id)
+                for t, id, d in batch
+                if t == media_type and d is not None
+            ]
+            changes = conn.total_changes
+            # Stored through json(), which renders like the json_set in
+            # `_record_poster`, so unchanged details compare equal as text.
+            conn.executemany(
+                f"""
+                UPDATE {table} SET details = json(?), poster_url = ?
+                WHERE id = ? AND (details IS NOT json(?) OR poster_url IS NOT ?)
+                """,
+                [
+                    (details, poster_url, id, details, poster_url)
+                    for details, poster_url, id in fetched
+                ],
+            )
+            changed = changed or conn.total_changes != changes
+            conn.executemany(
+                f"UPDATE {table} SET details_updated_at = ? WHERE id = ?",
+                [
+                    (now, id)
+                    for t, id, d in batch
+                    if t == media_type and (d is not None or touch_failed)
+                ],
+            )
+        if changed:
+            conn.execute(BUMP_GENERATION)
+    return changed
+
+
+async def _enrichment_writer(
+    results, batch_size, flush_interval, touch_failed=False, on_saved=None
+):
+    """Commit fetched details in batches until a None arrives.
+
+    A batch is written once it is full or `flush_interval` seconds after its
+    first result, whichever comes first: enrichment is rate limited, so
+    results trickle in and committing each on its own would bump the
+    generation (and drop every cached response) once per title. Whatever is
+    still pending is flushed when the writer is cancelled.
+    `details` is only rewritten when it changed, so the search and category
+    triggers don't fire for a refresh that found nothing new, while
+    `details_updated_at` is stamped for every success, and for failures too
+    when `touch_failed` is set. Commits that changed details bump the database
+    generation and call `on_saved`.
+    """
+    batch = []
+
+    async def flush():
+        try:
+            changed = await asyncio.to_thread(_save_details, list(batch), touch_failed)
+        except sqlite3.Error as e:
+            print(f"Failed to save {len(batch)} media details: {e}")
+        else:
+            if on_saved and changed:
+                on_saved()
+        batch.clear()
+
+    loop = asyncio.get_running_loop()
+    deadline = None
+    # Kept across timeouts: cancelling a get() could drop the item it got.
+    getter = None
+    try:
+        while True:
+            if getter is None:
+                getter = asyncio.ensure_future(results.get())
+            timeout = max(0, deadline - loop.time()) if batch else None
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if not done:
+                await flush()
+                continue
+
+            item, getter = getter.result(), None
+            if item is None:
+                break
+            if not batch:
+                deadline = loop.time() + flush_interval
+            batch.append(item)
+            if len(batch) >= batch_size:
+                await flush()
+    finally:
+        if getter is not None:
+            if getter.done() and not getter.cancelled() and getter.result():
+                batch.append(getter.result())
+            getter.cancel()
+        while not results.empty():
+            if item := results.get_nowait():
+                batch.append(item)
+        if batch:
+            await flush()
+
+
+def _select_ids(sql, params=()):
+    """Run `sql`, formatted with each media table, and return the movie ids
+    and the show ids it selected."""
+    with get_database().read("select_ids") as conn:
+        return [
+            [row[0] for row in conn.execute(sql.format(table=table), params)]
+            for table in MEDIA_TABLES.values()
+        ]
+
+
+async def _enrich(pending, progress, touch_failed=False, on_saved=None):
+    """Fetch details for `pending`, lists of ids by media type, and store them.
+
+    Every media type comes from its own provider, so each gets its own
+    bounded queue served by its own pool of workers: a worker only ever
+    waits on its provider's rate limit, and a slower provider can't take
+    the workers of a faster one. They all feed one writer, which commits
+    results as they arrive.
+    """
+    settings = get_settings()
+    progress.start(sum(len(ids) for ids in pending.values()))
+
+    queues = {
+        media_type: asyncio.Queue(settings.enrichment_workers * 2)
+        for media_type in pending
+    }
+    results = asyncio.Queue(settings.enrichment_batch_size * 2)
+
+    async def feed(media_type, ids):
+        for id in ids:
+            await queues[media_type].put((media_type, id))
+        await queues[media_type].join()
 
     # Create a connector with the resolver
     connector = TCPConnector(resolver=resolver)
     async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-        movie_tasks = [fetch_tmdb_details(session, movie_id) for movie_id in movie_ids]
-        show_tasks = [fetch_tvdb_details(session, show_id) for show_id in show_ids]
-
-        movie_results = await asyncio.gather(*movie_tasks)
-        show_results = await asyncio.gather(*show_tasks)
-
-    async with get_async_db_connection() as db:
-        for movie_id, details in zip(movie_ids, movie_results):
-            if details:
-                await db.execute(
-                    "UPDATE movies SET details = ? WHERE id = ?",
-                    (json.dumps(details), movie_id),
-                )
+        writer = asyncio.create_task(
+            _enrichment_writer(
+                results,
+                settings.enrichment_batch_size,
+                settings.enrichment_flush_interval,
+                touch_failed,
+                on_saved,
+            )
+        )
+        workers = [
+            asyncio.create_task(_enrichment_worker(session, queue, results, progress))
+            for queue in queues.values()
+            for _ in range(settings.enrichment_workers)
+        ]
+        try:
+            await asyncio.gather(
+                *(feed(media_type, ids) for media_type, ids in pending.items())
+            )
+            await results.put(None)
+            await writer
+        finally:
+            for task in (*workers, writer):
+                task.cancel()
+            await asyncio.gather(*workers, writer, return_exceptions=True)
+            progress.finish()
 
-        for show_id, details in zip(show_ids, show_results):
-            if details:
-                await db.execute(
-                    "UPDATE shows SET details = ? WHERE id = ?",
-                    (json.dumps(details), show_id),
-                )
 
-        await db.commit()
+async def fetch_media_details(on_saved=None):
+    """Fetch and store details for media that lack them.
 
+    Movies and shows are fetched side by side and committed as they arrive,
+    so an interrupted run picks up whatever is still missing next time. `on_saved`
+    is called whenever new details were committed.
+    """
+    ids = await asyncio.to_thread(
+        _select_ids, "SELECT id FROM {table} WHERE details IS NULL"
+    )
+    await _enrich(dict(zip(MEDIA_TABLES, ids)), enrichment_progress, on_saved=on_saved)
 
-async def cache_tmdb_poster(session, poster_url, media_id, media_type):
-    """Download and cache movie/show posters locally."""
-    if not poster_url:
-        return None
 
-    ext = Path(poster_url).suffix or ".jpg"
-    filename = f"{media_type}_{media_id}{ext}"
-    file_path = IMAGE_CACHE_DIR / filename
+async def refresh_media_details(on_saved=None):
+    """Refetch the stalest details older than `DETAILS_TTL` seconds.
 
-    if file_path.exists():
-        return f"/images/{filename}"  # Return cached URL
+    Up to `REFRESH_BATCH_SIZE` movies and as many shows are revalidated per
+    run, least recently updated first. The requests are conditional, so
+    media whose data hasn't changed mostly cost a 304.
+    """
+    settings = get_settings()
+    if not settings.details_ttl:
+        return
 
-    async with session.get(f"https://image.tmdb.org/t/p/w500{poster_url}") as response:
-        if response.status == 200:
-            async with aiofiles.open(file_path, "wb") as f:
-                await f.write(await response.read())
-            return f"/images/{filename}"
+    ids = await asyncio.to_thread(
+        _select_ids,
+        """
+        SELECT id FROM {table}
+        WHERE details IS NOT NULL
+        AND (details_updated_at IS NULL OR details_updated_at < ?)
+        ORDER BY details_updated_at
+        LIMIT ?
+        """,
+        (time.time() - settings.details_ttl, settings.refresh_batch_size),
+    )
+    pending = dict(zip(MEDIA_TABLES, ids))
+    if any(pending.values()):
+        await _enrich(pending, refresh_progress, touch_failed=True, on_saved=on_saved)
 
-    return None
 
+async def refresh_stale_details(on_saved=None):
+    """Run `refresh_media_details` every `REFRESH_INTERVAL` seconds."""
+    settings = get_settings()
+    while settings.details_ttl:
+        await refresh_media_details(on_saved)
+        await asyncio.sleep(settings.refresh_interval)
 
-async def cache_tvdb_poster(session, image_url, media_id, media_type):
-    """Download and cache TV show posters from TVDB locally."""
-    if not image_url:
-        return None
 
-    # Ensure token is valid before making the request
-    token = await ensure_valid_token(session)
+class PosterError(Exception):
+    """A poster download that came back unusable."""
 
-    ext = Path(image_url).suffix or ".jpg"
-    filename = f"{media_type}_{media_id}{ext}"
-    file_path = IMAGE_CACHE_DIR / filename
 
-    if file_path.exists():
-        return f"/images/{filename}"  # Return cached URL
+def poster_source(media_type, details):
+    """URL of the poster named in a TMDb/TVDb payload, if it has one."""
+    if media_type == "movie":
+        poster_path = details.get("poster_path")
+        if not poster_path:
+            return None
+        return f"{get_settings().tmdb_image_url}/w780{poster_path}"
 
     # TVDB images are usually direct URLs, not paths like TMDB
     # If it's a full URL, use it directly, otherwise construct it
-    image_full_url = (
-        image_url
-        if image_url.startswith("http")
-        else f"https://artworks.thetvdb.com{image_url}"
-    )
+    image = (details.get("data") or {}).get("image")
+    if not image:
+        return None
+    if image.startswith("http"):
+        return image
+    return f"{get_settings().tvdb_image_url}{image}"
 
-    headers = {"Authorization": f"Bearer {token}"}
-    async with session.get(image_full_url, headers=headers) as response:
-        if response.status == 200:
-            async with aiofiles.open(file_path, "wb") as f:
-                await f.write(await response.read())
-            return f"/images/{filename}"
 
-    return None
+def _poster_digest(url):
+    with get_database().read("poster_digest") as conn:
+        row = conn.execute("SELECT hash FROM posters WHERE url = ?", (url,)).fetchone()
+    return row[0] if row else None
+
+
+async def cached_poster(url):
+    """The `/images` URL of an already downloaded poster, or None."""
+    if not url:
+        return None
+    digest = await asyncio.to_thread(_poster_digest, url)
+    IMAGE_CACHE.labels("hit" if digest else "miss").inc()
+    return f"/images/{digest}" if digest else None
+
+
+def _record_poster(url, digest):
+    """Store a downloaded poster and point the media using it at the file.
+
+    The generation is only bumped when some media's details changed: a
+    poster nothing uses anymore must not invalidate every cached response.
+    """
+    with get_database().write("record_poster") as conn:
+        conn.execute(
+            """
+            INSERT INTO posters (url, hash, fetched_at) VALUES (?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                hash = excluded.hash,
+                fetched_at = excluded.fetched_at
+            """,
+            (url, digest, time.time()),
+        )
+        conn.execute("DELETE FROM poster_failures WHERE url = ?", (url,))
+        changes = conn.total_changes
+        for table in MEDIA_TABLES.values():
+            conn.execute(
+                f"""
+                UPDATE {table} SET details = json_set(details, '$.cached_poster', ?)
+                WHERE poster_url = ?
+                AND json_extract(details, '$.cached_poster') IS NOT ?
+                """,
+                (f"/images/{digest}", url, f"/images/{digest}"),
+            )
+        if conn.total_changes != changes:
+            conn.execute(BUMP_GENERATION)
+
+
+def _record_poster_failure(url, error):
+    """Count a failed download and schedule its retry, backing off each time."""
+    interval = get_settings().poster_retry_interval
+    with get_database().write("record_poster_failure") as conn:
+        conn.execute(
+            """
+            INSERT INTO poster_failures (url, attempts, error, retry_at)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                attempts = attempts + 1,
+                error = excluded.error,
+                retry_at = ? + min(? * (1 << attempts), 86400)
+            """,
+            (url, error, time.time() + interval, time.time(), interval),
+        )
+
+
+def _pending_posters():
+    """Poster URLs named by some media but neither cached nor waiting to retry."""
+    with get_database().read("pending_posters") as conn:
+        cursor = conn.execute(
+            " UNION ".join(
+                f"SELECT poster_url FROM {table} WHERE poster_url IS NOT NULL"
+                for table in MEDIA_TABLES.values()
+            )
+            + " EXCEPT SELECT url FROM posters"
+            " EXCEPT SELECT url FROM poster_failures WHERE retry_at > ?",
+            (time.time(),),
+        )
+        urls = [row[0] for row in cursor]
+    return urls
+
+
+_image_executor = None
+
+
+def get_image_executor():
+    """Process pool the poster variants are encoded in, started on first use."""
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = process_pool(
+            get_settings().image_workers or os.cpu_count() or 1
+        )
+    return _image_executor
+
+
+def shutdown_image_executor():
+    """Cancel pending encodes and wait for the pool's processes to exit."""
+    global _image_executor
+    if _image_executor is not None:
+        _image_executor.shutdown(cancel_futures=True)
+        _image_executor = None
+
+
+async def _download_image(session, url, tmp_path):
+    """Stream an image to `tmp_path`; returns the SHA-256 of its content.
+
+    Raises PosterError when the response isn't a complete image.
+    """
+    provider = await acquire_rate_limit(url)
+    started = time.perf_counter()
+    async with session.get(url) as response:
+        OUTBOUND_DURATION.labels(provider, response.status).observe(
+            time.perf_counter() - started
+        )
+        get_rate_limiter().record(provider, response.status)
+        if response.status != 200:
+            raise PosterError(f"HTTP {response.status}")
+        if response.content_type.split("/")[0] != "image":
+            raise PosterError(f"unexpected content type {response.content_type}")
+
+        digest = hashlib.sha256()
+        size = 0
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                digest.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+
+        # The length is only comparable when aiohttp didn't decompress it.
+        expected = response.content_length
+        if expected is not None and "Content-Encoding" not in response.headers:
+            if size != expected:
+                raise PosterError(f"got {size} of {expected} bytes")
+        if not size:
+            raise PosterError("empty response")
+
+    return digest.hexdigest()
+
+
+async def cache_poster(session, url):
+    """Download a poster into the image cache and return its digest.
+
+    Images are stored by the SHA-256 of their content, so artwork shared by
+    several titles is kept and resized once. Downloads go to a temporary
+    file that is only renamed into place once complete.
+    """
+    tmp_dir = IMAGE_CACHE_DIR / "tmp"
+    tmp_dir.mkdir(exist_ok=True)
+    tmp_path = tmp_dir / f"{uuid.uuid4().hex}.part"
+    try:
+        digest = await _download_image(session, url, tmp_path)
+        if not await asyncio.to_thread(has_variants, IMAGE_CACHE_DIR, digest):
+            path = source_path(IMAGE_CACHE_DIR, digest)
+            path.parent.mkdir(exist_ok=True)
+            os.replace(tmp_path, path)
+            await asyncio.get_running_loop().run_in_executor(
+                get_image_executor(), make_variants, IMAGE_CACHE_DIR, digest
+            )
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    await asyncio.to_thread(_record_poster, url, digest)
+    return digest
+
+
+async def _poster_worker(session, queue):
+    while True:
+        url = await queue.get()
+        try:
+            try:
+                await cache_poster(session, url)
+            except Exception as e:
+                print(f"Failed to cache poster {url}: {e!r}")
+                await asyncio.to_thread(_record_poster_failure, url, repr(e))
+                poster_progress.record(False)
+            else:
+                poster_progress.record(True)
+        finally:
+            queue.task_done()
+
+
+async def download_posters():
+    """Download the posters enriched media point at but aren't cached yet.
+
+    Runs as its own stage, with `POSTER_WORKERS` concurrent downloads, so
+    slow artwork never holds up metadata. Failed posters are skipped until
+    their retry time, which doubles with every failure.
+    """
+    settings = get_settings()
+    pending = await asyncio.to_thread(_pending_posters)
+    poster_progress.start(len(pending))
+
+    queue = asyncio.Queue(settings.poster_workers * 2)
+    connector = TCPConnector(resolver=resolver)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        workers = [
+            asyncio.create_task(_poster_worker(session, queue))
+            for _ in range(settings.poster_workers)
+        ]
+        try:
+            for url in pending:
+                await queue.put(url)
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            poster_progress.finish()
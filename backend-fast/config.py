@@ -1,21 +1,120 @@
 from pathlib import Path
 
+import queue
 import sqlite3
-import aiosqlite
+import threading
+import time
 
+from contextlib import contextmanager
 from functools import lru_cache
 from typing import Optional
 from pydantic_settings import BaseSettings
 
+from .collection.metrics import observe_sql
+from .collection.profiling import SlowQueryConnection
+
 IMAGE_CACHE_DIR = Path("cached_images")
+DB_PATH = "parsed_data.db"
 
 
 def get_db_connection():
-    return sqlite3.connect("parsed_data.db", check_same_thread=False)
+    """Open a tuned connection in autocommit mode.
+
+    WAL lets readers carry on while a write is in progress, and NORMAL
+    synchronous is durable enough in WAL mode while syncing far less.
+    """
+    settings = get_settings()
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=256,
+        factory=(
+            sqlite3.Connection
+            if settings.slow_query_ms is None
+            else SlowQueryConnection
+        ),
+    )
+    if settings.slow_query_ms is not None:
+        conn.slow_query_seconds = settings.slow_query_ms / 1000
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA mmap_size = {int(settings.db_mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = -{int(settings.db_cache_size) // 1024}")
+    return conn
+
+
+class Database:
+    """Long-lived SQLite connections: a pool of readers and a single writer.
+
+    `read()` lends a read-only connection, waiting for one when all
+    `readers` are busy. `write()` hands out the one writer connection inside
+    a transaction, committed when the block exits and rolled back if it
+    raises, so writes from different threads never contend for the lock.
+    Both take the name the block is timed under: `observe(name, mode,
+    started)` is called once it finishes.
+    """
 
+    def __init__(self, connect, readers=4, observe=None):
+        self.connect = connect
+        self.readers = readers
+        self.observe = observe
+        self._created = 0
+        self._idle = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
 
-def get_async_db_connection():
-    return aiosqlite.connect("parsed_data.db")
+    def _reader(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            create = self._created < self.readers
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        conn = self.connect()
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    @contextmanager
+    def read(self, name="other"):
+        started = time.perf_counter()
+        conn = self._reader()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+            if self.observe:
+                self.observe(name, "read", started)
+
+    @contextmanager
+    def write(self, name="other"):
+        started = time.perf_counter()
+        try:
+            with self._write_lock:
+                if self._writer is None:
+                    self._writer = self.connect()
+                self._writer.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self._writer
+                except BaseException:
+                    self._writer.rollback()
+                    raise
+                self._writer.commit()
+        finally:
+            if self.observe:
+                self.observe(name, "write", started)
+
+
+@lru_cache
+def get_database():
+    return Database(get_db_connection, get_settings().db_read_connections, observe_sql)
 
 
 @lru_cache
@@ -31,6 +130,71 @@ class Settings(BaseSettings):
     tvdb_api_key: str
     overseerr_api_key: str
     overseerr_url: str = "http://overseerr:5055"
+    # Where TMDb, TVDB and their posters are fetched from; overridden to
+    # point at local stubs when benchmarking (see bench/).
+    tmdb_api_url: str = "https://api.themoviedb.org/3"
+    tvdb_api_url: str = "https://api4.thetvdb.com/v4"
+    tmdb_image_url: str = "https://image.tmdb.org/t/p"
+    tvdb_image_url: str = "https://artworks.thetvdb.com"
+    # Seconds between syncs of Overseerr's availability (0 disables them),
+    # and how long to wait for further requests before sending a batch.
+    overseerr_sync_interval: int = 600
+    request_debounce: float = 2.0
+
+    # Poll the data directory instead of relying on inotify, which doesn't
+    # see changes on some network and bind mounts.
+    watch_force_polling: Optional[bool] = None
+    # Processes used to parse report files; defaults to one per CPU.
+    yaml_parse_workers: Optional[int] = None
+    # Processes used to resize posters; defaults to one per CPU.
+    image_workers: Optional[int] = None
+    # Concurrent poster downloads, and seconds before a failed one is retried
+    # (doubling with each further failure, up to a day).
+    poster_workers: int = 4
+    poster_retry_interval: int = 300
+    # Concurrent lookups against each of TMDb and TVDb, how many results to
+    # commit at once, and the longest a result waits for its batch to fill
+    # before it is committed.
+    enrichment_workers: int = 5
+    enrichment_batch_size: int = 50
+    enrichment_flush_interval: float = 5.0
+
+    # Requests per second and burst size allowed against each provider; the
+    # image limits also apply to any other host.
+    tmdb_rate_limit: float = 40
+    tmdb_burst: int = 40
+    tvdb_rate_limit: float = 10
+    tvdb_burst: int = 10
+    image_rate_limit: float = 20
+    image_burst: int = 20
+    # Attempts per API request when throttled or failing
+    http_max_attempts: int = 5
+
+    # Pooled read connections, and the memory map and page cache given to
+    # each SQLite connection, in bytes.
+    db_read_connections: int = 4
+    db_mmap_size: int = 256 * 1024 * 1024
+    db_cache_size: int = 32 * 1024 * 1024
+
+    # Seconds the worker doing ingestion may go without renewing its lease
+    # before another worker takes over.
+    lease_ttl: int = 30
+
+    # Bytes of serialized responses kept in memory
+    response_cache_size: int = 64 * 1024 * 1024
+
+    # Requests with this value in an `X-Profile` header are profiled, and the
+    # profile returned, or stored in `profile_dir` if set.
+    profile_token: Optional[str] = None
+    profile_dir: Optional[str] = None
+    # Log statements taking longer than this many milliseconds; 0 logs all.
+    slow_query_ms: Optional[float] = None
+
+    # Seconds before fetched details are revalidated (0 disables refreshing),
+    # how many movies and shows each refresh takes on, and how often it runs.
+    details_ttl: int = 7 * 24 * 3600
+    refresh_batch_size: int = 100
+    refresh_interval: int = 3600
 
     class Config:
         env_file = ".env"
@@ -42,5 +206,37 @@ class Settings(BaseSettings):
             "port": {"env": "PORT"},
             "overseerr_url": {"env": "OVERSEERR_URL"},
             "overseerr_api_key": {"env": "OVERSEERR_API_KEY"},
+            "tmdb_api_url": {"env": "TMDB_API_URL"},
+            "tvdb_api_url": {"env": "TVDB_API_URL"},
+            "tmdb_image_url": {"env": "TMDB_IMAGE_URL"},
+            "tvdb_image_url": {"env": "TVDB_IMAGE_URL"},
+            "overseerr_sync_interval": {"env": "OVERSEERR_SYNC_INTERVAL"},
+            "request_debounce": {"env": "REQUEST_DEBOUNCE"},
             "data_directory": {"env": "DATA_DIRECTORY"},
+            "watch_force_polling": {"env": "WATCH_FORCE_POLLING"},
+            "yaml_parse_workers": {"env": "YAML_PARSE_WORKERS"},
+            "image_workers": {"env": "IMAGE_WORKERS"},
+            "poster_workers": {"env": "POSTER_WORKERS"},
+            "poster_retry_interval": {"env": "POSTER_RETRY_INTERVAL"},
+            "enrichment_workers": {"env": "ENRICHMENT_WORKERS"},
+            "enrichment_batch_size": {"env": "ENRICHMENT_BATCH_SIZE"},
+            "enrichment_flush_interval": {"env": "ENRICHMENT_FLUSH_INTERVAL"},
+            "tmdb_rate_limit": {"env": "TMDB_RATE_LIMIT"},
+            "tmdb_burst": {"env": "TMDB_BURST"},
+            "tvdb_rate_limit": {"env": "TVDB_RATE_LIMIT"},
+            "tvdb_burst": {"env": "TVDB_BURST"},
+            "image_rate_limit": {"env": "IMAGE_RATE_LIMIT"},
+            "image_burst": {"env": "IMAGE_BURST"},
+            "http_max_attempts": {"env": "HTTP_MAX_ATTEMPTS"},
+            "db_read_connections": {"env": "DB_READ_CONNECTIONS"},
+            "db_mmap_size": {"env": "DB_MMAP_SIZE"},
+            "db_cache_size": {"env": "DB_CACHE_SIZE"},
+            "lease_ttl": {"env": "LEASE_TTL"},
+            "response_cache_size": {"env": "RESPONSE_CACHE_SIZE"},
+            "profile_token": {"env": "PROFILE_TOKEN"},
+            "profile_dir": {"env": "PROFILE_DIR"},
+            "slow_query_ms": {"env": "SLOW_QUERY_MS"},
+            "details_ttl": {"env": "DETAILS_TTL"},
+            "refresh_batch_size": {"env": "REFRESH_BATCH_SIZE"},
+            "refresh_interval": {"env": "REFRESH_INTERVAL"},
         }
@@ -1,22 +1,71 @@
-from fastapi import FastAPI, APIRouter, Query
-from fastapi.staticfiles import StaticFiles
-from cachetools import TTLCache
+import asyncio
+import orjson
+import secrets
+import sqlite3
+import time
+
+from fastapi import (
+    FastAPI,
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
-from .config import get_settings, IMAGE_CACHE_DIR
-from .collection.utils import parse_yaml_files, save_to_sqlite, fetch_media_details
+from .config import get_settings, get_database, get_db_connection, IMAGE_CACHE_DIR
+from .collection import overseerr
+from .collection.lease import Lease
+from .collection.metrics import MetricsMiddleware, QUEUE_DEPTH, render
+from .collection.profiling import ProfilingMiddleware, slow_queries
+from .collection.responsecache import (
+    ResponseCache,
+    accepted_encoding,
+    encoded_etag,
+    matching_etag,
+    response_etag,
+)
+from .collection.suggest import MAX_SUGGESTIONS, SuggestIndex
+from .collection.tasks import BackgroundJob
+from .collection.utils import (
+    init_db,
+    sync_yaml_directory,
+    watch_yaml_directory,
+    fetch_media_details,
+    refresh_stale_details,
+    download_posters,
+    enrichment_progress,
+    refresh_progress,
+    poster_progress,
+    get_rate_limiter,
+    get_http_cache,
+    shutdown_image_executor,
+)
 
 from .collection.routes import (
+    MediaFilters,
+    category_facets,
+    media_facets,
     search_media,
     paginated_movies,
     paginated_shows,
     list_media_by_category,
     list_categories,
+    get_media,
+    check_media,
+    parse_fields,
+    image_response,
 )
+from .collection.schema import SORT_COLUMNS
 
 origins = ["*"]
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Add the middleware to your application
 app.add_middleware(
@@ -26,72 +75,447 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+app.add_middleware(MetricsMiddleware)
+if get_settings().profile_token:
+    app.add_middleware(
+        ProfilingMiddleware,
+        token=get_settings().profile_token,
+        directory=get_settings().profile_dir,
+    )
 
 # Cache configuration
-media_cache = TTLCache(maxsize=1000, ttl=3600)  # Cache for 1 hour
+media_cache = ResponseCache(get_db_connection, get_settings().response_cache_size)
 IMAGE_CACHE_DIR.mkdir(exist_ok=True)
+suggest_index = SuggestIndex()
+
 
 # Serve cached images
-app.mount("/images", StaticFiles(directory=IMAGE_CACHE_DIR), name="images")
+@app.get("/images/{name}")
+def get_image(
+    name: str,
+    variant: Optional[str] = None,
+    format: Optional[str] = None,
+    accept: str = Header(""),
+    if_none_match: Optional[str] = Header(None),
+):
+    return image_response(name, variant, format, accept, if_none_match)
 
 
-async def start_background_tasks():
-    settings = get_settings()
-    parsed_movies, parsed_shows = parse_yaml_files(settings.data_directory)
-    save_to_sqlite(parsed_movies, parsed_shows)
-    await fetch_media_details()
+# Enrichment runs in the background so the API serves as soon as the reports
+# are in SQLite; the watcher re-triggers it when reports list new media.
+# Posters are downloaded by their own job, woken whenever details are saved
+# and periodically to retry failed downloads.
+poster_job = BackgroundJob(
+    "posters", download_posters, interval=get_settings().poster_retry_interval
+)
+enrichment_job = BackgroundJob(
+    "enrichment", lambda: fetch_media_details(poster_job.trigger)
+)
+refresh_job = BackgroundJob(
+    "refresh", lambda: refresh_stale_details(poster_job.trigger)
+)
+watcher_job = BackgroundJob(
+    "yaml-watcher",
+    lambda: watch_yaml_directory(get_settings().data_directory, enrichment_job.trigger),
+)
+availability_job = BackgroundJob(
+    "availability",
+    overseerr.sync_availability,
+    interval=get_settings().overseerr_sync_interval,
+)
+
+
+async def ingest():
+    """Bring SQLite up to date with the reports, then keep it there."""
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(sync_yaml_directory, get_settings().data_directory)
+    for job in (enrichment_job, refresh_job, poster_job, watcher_job):
+        job.start()
+    if get_settings().overseerr_sync_interval:
+        availability_job.start()
+
+
+ingest_job = BackgroundJob("ingest", ingest)
+ingestion_jobs = (
+    watcher_job,
+    refresh_job,
+    enrichment_job,
+    poster_job,
+    availability_job,
+    ingest_job,
+)
+
+# Requests are sent by whichever worker received them, in debounced batches.
+request_job = BackgroundJob("requests", overseerr.submit_requests)
+
+# With several workers only the one holding the ingestion lease parses
+# reports, enriches and caches images; the others only serve requests, and
+# take over once the holder stops renewing the lease.
+lease = Lease(get_database(), "ingestion", get_settings().lease_ttl)
+
+
+async def stop_ingestion():
+    for job in ingestion_jobs:
+        await job.stop()
+    # Waits for the pool's processes to exit, off the event loop.
+    await asyncio.to_thread(shutdown_image_executor)
+
+
+async def lead():
+    """Renew the ingestion lease, running ingestion while it is held."""
+    leading = False
+    try:
+        while True:
+            try:
+                held = await asyncio.to_thread(lease.acquire)
+            except sqlite3.Error as e:
+                print(f"Failed to renew the ingestion lease: {e}")
+                held = leading and time.time() < lease.expires_at
+
+            if held and not leading:
+                print(f"Worker {lease.owner} took over ingestion")
+                ingest_job.start()
+            elif leading and not held:
+                print(f"Worker {lease.owner} lost the ingestion lease")
+                await stop_ingestion()
+            leading = held
+            await asyncio.sleep(lease.ttl / 3)
+    finally:
+        if leading:
+            await stop_ingestion()
+            await asyncio.to_thread(lease.release)
+
+
+leader_job = BackgroundJob("leader", lead)
 
 
 @app.on_event("startup")
-async def load_yaml_data():
-    await start_background_tasks()
+async def start_background_tasks():
+    leader_job.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await request_job.stop()
+    await overseerr.flush_requests()
+    await leader_job.stop()
 
 
 prefix_router = APIRouter(prefix="/api")
 
 
+# API responses may be stored, but must be revalidated with their ETag.
+REVALIDATE = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+
+def cached_json(request: Request, key, compute):
+    """Serve `compute()` as JSON from the response cache.
+
+    The ETag is derived from the database generation, so a client holding
+    the current response gets a 304 before anything is looked up or
+    computed. Large bodies are sent precompressed when the client accepts it.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = response_etag(media_cache.generation(), key)
+        tag = matching_etag(if_none_match, etag)
+        if tag:
+            return Response(status_code=304, headers={**REVALIDATE, "ETag": tag})
+
+    entry = media_cache.lookup(key, compute, compress=True)
+    headers = {**REVALIDATE, "ETag": entry.etag}
+    body = entry.body
+    encoding = accepted_encoding(
+        request.headers.get("accept-encoding", ""), entry.encoded
+    )
+    if encoding:
+        body = entry.encoded[encoding]
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = encoded_etag(entry.etag, encoding)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# Listings can be narrowed to media Overseerr reports as available, already
+# requested, or neither.
+AvailabilityQuery = Query(None, pattern="^(available|requested|missing)$")
+
+# Listings are ordered by id unless sorted by one of these, each in its own
+# default direction unless `order` is given.
+SortQuery = Query(None, pattern=f"^({'|'.join(SORT_COLUMNS)})$")
+OrderQuery = Query(None, pattern="^(asc|desc)$")
+
+
+def media_filters(
+    year_min: Optional[int] = Query(None, ge=0),
+    year_max: Optional[int] = Query(None, ge=0),
+    rating_min: Optional[float] = Query(None, ge=0, le=10),
+    genre: Optional[str] = None,
+    category: Optional[str] = None,
+    availability: Optional[str] = AvailabilityQuery,
+):
+    return MediaFilters(year_min, year_max, rating_min, genre, category, availability)
+
+
+def with_facets(listing, key, compute):
+    """Add the facet counts to a listing page, for clients asking for them
+    with `facets=true`: each is a pass over the whole filtered listing.
+
+    Facets are cached apart from the pages, so paging through a listing
+    counts them once.
+    """
+    return {**listing, "facets": orjson.Fragment(media_cache.get(key, compute))}
+
+
+async def request_media(media_type, media_id):
+    """Queue a request to Overseerr; it is sent with the next batch."""
+    await asyncio.to_thread(check_media, media_type, media_id)
+    queued = overseerr.queue_request(media_type, media_id)
+    if request_job.running:
+        request_job.trigger()
+    else:
+        request_job.start()
+    return ORJSONResponse({"queued": queued}, status_code=202)
+
+
 @prefix_router.get("/search")
 def search(
+    request: Request,
     query: str,
     page: int = Query(1, alias="page", ge=1),
     page_size: int = Query(10, alias="page_size", ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    availability: Optional[str] = AvailabilityQuery,
+):
+    fields = parse_fields(fields)
+    return cached_json(
+        request,
+        ("search", query, page, page_size, cursor, fields, availability),
+        lambda: search_media(query, page, page_size, cursor, fields, availability),
+    )
+
+
+@prefix_router.get("/suggest")
+def suggest(
+    request: Request,
+    query: str = Query(..., max_length=200),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
 ):
-    return search_media(query, page, page_size)
+    """Typeahead suggestions, answered from memory without querying SQLite."""
+    suggest_index.refresh()
+    etag = response_etag(suggest_index.generation, ("suggest", query, limit))
+    headers = {**REVALIDATE, "ETag": etag}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and matching_etag(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        orjson.dumps(suggest_index.suggest(query, limit)),
+        media_type="application/json",
+        headers=headers,
+    )
 
 
 @prefix_router.get("/movies")
 def get_movies(
+    request: Request,
     page: int = Query(1, alias="page", ge=1),
     page_size: int = Query(10, alias="page_size", ge=1, le=100),
     query: str = Query("", alias="search_query"),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    filters: MediaFilters = Depends(media_filters),
+    sort: Optional[str] = SortQuery,
+    order: Optional[str] = OrderQuery,
+    facets: bool = False,
 ):
-    return paginated_movies(page, page_size, query)
+    fields = parse_fields(fields)
+
+    def compute():
+        listing = paginated_movies(
+            page, page_size, query, cursor, fields, filters, sort, order
+        )
+        if not facets:
+            return listing
+        return with_facets(
+            listing,
+            ("movie facets", query, filters),
+            lambda: media_facets("movie", query, filters),
+        )
+
+    return cached_json(
+        request,
+        (
+            "movies",
+            page,
+            page_size,
+            query,
+            cursor,
+            fields,
+            filters,
+            sort,
+            order,
+            facets,
+        ),
+        compute,
+    )
+
+
+@prefix_router.get("/movies/{movie_id}")
+def get_movie(request: Request, movie_id: str):
+    return cached_json(
+        request, ("movie", movie_id), lambda: get_media("movie", movie_id)
+    )
+
+
+@prefix_router.post("/movies/{movie_id}/request")
+async def post_movie_request(movie_id: str):
+    return await request_media("movie", movie_id)
 
 
 @prefix_router.get("/shows")
 def get_shows(
+    request: Request,
     page: int = Query(1, alias="page", ge=1),
     page_size: int = Query(10, alias="page_size", ge=1, le=100),
     query: str = Query("", alias="search_query"),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    filters: MediaFilters = Depends(media_filters),
+    sort: Optional[str] = SortQuery,
+    order: Optional[str] = OrderQuery,
+    facets: bool = False,
 ):
-    return paginated_shows(page, page_size, query)
+    fields = parse_fields(fields)
+
+    def compute():
+        listing = paginated_shows(
+            page, page_size, query, cursor, fields, filters, sort, order
+        )
+        if not facets:
+            return listing
+        return with_facets(
+            listing,
+            ("show facets", query, filters),
+            lambda: media_facets("show", query, filters),
+        )
+
+    return cached_json(
+        request,
+        ("shows", page, page_size, query, cursor, fields, filters, sort, order, facets),
+        compute,
+    )
+
+
+@prefix_router.get("/shows/{show_id}")
+def get_show(request: Request, show_id: str):
+    return cached_json(request, ("show", show_id), lambda: get_media("show", show_id))
+
+
+@prefix_router.post("/shows/{show_id}/request")
+async def post_show_request(show_id: str):
+    return await request_media("show", show_id)
 
 
 @prefix_router.get("/categories/")
 def get_categories(
+    request: Request,
     page: int = Query(1, alias="page", ge=1),
     page_size: int = Query(10, alias="page_size", ge=1, le=100),
 ):
-    return list_categories(page, page_size)
+    return cached_json(
+        request,
+        ("categories", page, page_size),
+        lambda: list_categories(page, page_size),
+    )
 
 
 @prefix_router.get("/categories/{category_name}")
 def get_category_details(
+    request: Request,
     category_name: str,
     page: int = Query(1, alias="page", ge=1),
     page_size: int = Query(10, alias="page_size", ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    filters: MediaFilters = Depends(media_filters),
+    sort: Optional[str] = SortQuery,
+    order: Optional[str] = OrderQuery,
+    facets: bool = False,
 ):
-    return list_media_by_category(category_name, page, page_size)
+    fields = parse_fields(fields)
+
+    def compute():
+        listing = list_media_by_category(
+            category_name, page, page_size, cursor, fields, filters, sort, order
+        )
+        if not facets:
+            return listing
+        return with_facets(
+            listing,
+            ("category facets", category_name, filters),
+            lambda: category_facets(category_name, filters),
+        )
+
+    return cached_json(
+        request,
+        (
+            "category",
+            category_name,
+            page,
+            page_size,
+            cursor,
+            fields,
+            filters,
+            sort,
+            order,
+            facets,
+        ),
+        compute,
+    )
+
+
+@prefix_router.get("/status")
+def get_status():
+    return {
+        "enrichment": enrichment_progress.snapshot(),
+        "refresh": refresh_progress.snapshot(),
+        "posters": poster_progress.snapshot(),
+        "jobs": {
+            job.name: job.status() for job in (leader_job, request_job, *ingestion_jobs)
+        },
+        "leader": {"is_leader": lease.held, "lease": lease.holder()},
+        "rate_limits": get_rate_limiter().stats(),
+        "http_cache": get_http_cache().stats(),
+        "response_cache": media_cache.stats(),
+        "suggest_index": suggest_index.stats(),
+        "overseerr": overseerr.stats(),
+    }
+
+
+@prefix_router.get("/debug/slow-queries", include_in_schema=False)
+def get_slow_queries(authorization: Optional[str] = Header(None)):
+    """This worker's latest slow statements, for the profiling token as a
+    bearer token."""
+    token = get_settings().profile_token
+    expected = f"Bearer {token}"
+    if not (
+        token and authorization and secrets.compare_digest(authorization, expected)
+    ):
+        raise HTTPException(status_code=404)
+    return list(slow_queries)
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    for name, progress in (
+        ("enrichment", enrichment_progress),
+        ("refresh", refresh_progress),
+        ("posters", poster_progress),
+    ):
+        QUEUE_DEPTH.labels(name).set(progress.snapshot()["remaining"])
+    QUEUE_DEPTH.labels("requests").set(len(overseerr.pending_requests))
+    body, content_type = render()
+    return Response(body, media_type=content_type)
 
 
 app.include_router(prefix_router)
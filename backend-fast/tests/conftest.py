@@ -0,0 +1,36 @@
+"""Fixtures giving each test its own working directory and database.
+
+The backend's directory name isn't a valid identifier, so its modules are
+imported by path through `load`.
+"""
+
+import importlib
+import os
+import sys
+
+from pathlib import Path
+
+import pytest
+
+PACKAGE = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PACKAGE.parent))
+
+for name in ("TMDB_API_KEY", "TVDB_API_KEY", "OVERSEERR_API_KEY"):
+    os.environ.setdefault(name, "test")
+
+
+def load(name):
+    return importlib.import_module(f"{PACKAGE.name}.{name}")
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh database in a temporary working directory."""
+    config = load("config")
+    monkeypatch.chdir(tmp_path)
+    config.get_settings.cache_clear()
+    config.get_database.cache_clear()
+    load("collection.utils").init_db()
+    yield config.get_database()
+    config.get_settings.cache_clear()
+    config.get_database.cache_clear()
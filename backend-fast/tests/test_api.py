@@ -0,0 +1,116 @@
+import gzip
+
+import brotli
+import pytest
+
+from fastapi.testclient import TestClient
+
+from conftest import load
+
+config = load("config")
+images = load("collection.images")
+responsecache = load("collection.responsecache")
+schema = load("collection.schema")
+utils = load("collection.utils")
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    """A client for the app over a library large enough to be compressed.
+
+    Used outside a `with` block, so the startup events, and ingestion with
+    them, never run.
+    """
+    # Imported here: the module opens the database in the working directory.
+    main = load("main")
+    monkeypatch.setattr(
+        main,
+        "media_cache",
+        responsecache.ResponseCache(config.get_db_connection, 1 << 20),
+    )
+    utils.save_to_sqlite(
+        {
+            str(n): {"title": f"Movie {n}", "categories": ["Cat A"]}
+            for n in range(1, 41)
+        },
+        {},
+    )
+    return TestClient(main.app)
+
+
+def test_matching_etag_gets_a_bodyless_304(client):
+    response = client.get("/api/movies", params={"page_size": 20})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    revalidated = client.get(
+        "/api/movies", params={"page_size": 20}, headers={"If-None-Match": etag}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+
+def test_etag_changes_after_a_write(client, database):
+    etag = client.get("/api/movies").headers["etag"]
+    with database.write() as conn:
+        conn.execute("UPDATE movies SET title = 'Renamed' WHERE id = '1'")
+        conn.execute(schema.BUMP_GENERATION)
+
+    response = client.get("/api/movies", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["data"][0]["title"] == "Renamed"
+
+
+@pytest.mark.parametrize(
+    "encoding, decompress", [("br", brotli.decompress), ("gzip", gzip.decompress)]
+)
+def test_large_responses_are_sent_compressed(client, encoding, decompress):
+    params = {"page_size": 40}
+    plain = client.get("/api/movies", params=params, headers={"Accept-Encoding": ""})
+    assert len(plain.content) >= responsecache.MIN_COMPRESSED_SIZE
+    assert "content-encoding" not in plain.headers
+
+    # Read raw, so the test client doesn't decode the body itself
+    with client.stream(
+        "GET", "/api/movies", params=params, headers={"Accept-Encoding": encoding}
+    ) as response:
+        body = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] != plain.headers["etag"]
+    assert decompress(body) == plain.content
+
+    revalidated = client.get(
+        "/api/movies",
+        params=params,
+        headers={
+            "Accept-Encoding": encoding,
+            "If-None-Match": response.headers["etag"],
+        },
+    )
+    assert revalidated.status_code == 304
+
+
+def test_image_variants_are_revalidated(client):
+    digest = "a" * 64
+    path = images.variant_path(config.IMAGE_CACHE_DIR, digest, "card", "webp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"RIFF")
+
+    response = client.get(
+        f"/images/{digest}",
+        params={"variant": "card"},
+        headers={"Accept": "image/webp"},
+    )
+    assert response.status_code == 200
+    assert response.content == b"RIFF"
+
+    revalidated = client.get(
+        f"/images/{digest}",
+        params={"variant": "card"},
+        headers={"Accept": "image/webp", "If-None-Match": response.headers["etag"]},
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
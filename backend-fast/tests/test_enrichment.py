@@ -0,0 +1,124 @@
+import asyncio
+
+from conftest import load
+
+config = load("config")
+utils = load("collection.utils")
+
+
+def run_writer(monkeypatch, feed, batch_size=3, flush_interval=0.2):
+    """Run the writer against results put by `feed(results)`; returns the
+    batches it saved and how often it called `on_saved`."""
+    batches, saved = [], []
+
+    def save_details(batch, touch_failed):
+        batches.append(batch)
+        return True
+
+    monkeypatch.setattr(utils, "_save_details", save_details)
+
+    async def main():
+        results = asyncio.Queue()
+        writer = asyncio.create_task(
+            utils._enrichment_writer(
+                results, batch_size, flush_interval, on_saved=lambda: saved.append(1)
+            )
+        )
+        await feed(results)
+        await results.put(None)
+        await writer
+
+    asyncio.run(main())
+    return batches, len(saved)
+
+
+def test_trickling_results_share_a_commit(monkeypatch):
+    async def feed(results):
+        for n in range(2):
+            await results.put(("movie", str(n)))
+            await asyncio.sleep(0.02)  # Slower than the queue drains
+
+    batches, saved = run_writer(monkeypatch, feed)
+    assert batches == [[("movie", "0"), ("movie", "1")]]
+    assert saved == 1
+
+
+def test_full_batches_and_flush_interval(monkeypatch):
+    async def feed(results):
+        for n in range(4):
+            await results.put(("movie", str(n)))
+        await asyncio.sleep(0.3)  # Past the flush interval
+        await results.put(("show", "9"))
+
+    batches, _ = run_writer(monkeypatch, feed)
+    assert [len(batch) for batch in batches] == [3, 1, 1]
+
+
+def test_slow_provider_does_not_hold_up_the_other(monkeypatch):
+    monkeypatch.setenv("ENRICHMENT_WORKERS", "2")
+    monkeypatch.setenv("ENRICHMENT_BATCH_SIZE", "5")
+    config.get_settings.cache_clear()
+    saved = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        movies_saved = asyncio.Event()
+
+        async def fetch_movie(session, id):
+            return {"id": id}
+
+        async def fetch_show(session, id):
+            await movies_saved.wait()  # TVDb is stuck until then
+            return {"data": {"id": id}}
+
+        def save_details(batch, touch_failed):
+            saved.extend(batch)
+            if sum(t == "movie" for t, _, _ in saved) == 20:
+                loop.call_soon_threadsafe(movies_saved.set)
+            return True
+
+        monkeypatch.setattr(utils, "fetch_tmdb_details", fetch_movie)
+        monkeypatch.setattr(utils, "fetch_tvdb_details", fetch_show)
+        monkeypatch.setattr(utils, "_save_details", save_details)
+        pending = {"movie": [str(n) for n in range(20)], "show": ["1", "2"]}
+        await asyncio.wait_for(utils._enrich(pending, utils.Progress()), 5)
+
+    try:
+        asyncio.run(main())
+    finally:
+        config.get_settings.cache_clear()
+    assert [t for t, _, _ in saved[:20]] == ["movie"] * 20
+    assert len(saved) == 22
+
+
+def test_refresh_after_poster_download_changes_nothing(database):
+    with database.write() as conn:
+        conn.execute("INSERT INTO movies (id, title) VALUES ('1', 'Amélie')")
+    details = {"title": "Amélie", "poster_path": "/p.jpg", "cached_poster": None}
+    assert utils._save_details([("movie", "1", details)], False)
+
+    url = utils.poster_source("movie", details)
+    utils._record_poster(url, "abc")
+    details["cached_poster"] = "/images/abc"
+    assert not utils._save_details([("movie", "1", details)], False)
+
+
+def test_poster_only_bumps_the_generation_for_media_using_it(database):
+    def generation():
+        with database.read() as conn:
+            return conn.execute("SELECT value FROM generation").fetchone()[0]
+
+    with database.write() as conn:
+        conn.execute("INSERT INTO movies (id, title) VALUES ('1', 'Alien')")
+    details = {"title": "Alien", "poster_path": "/p.jpg", "cached_poster": None}
+    utils._save_details([("movie", "1", details)], False)
+    url = utils.poster_source("movie", details)
+
+    before = generation()
+    utils._record_poster("https://example.com/unused.jpg", "abc")
+    assert generation() == before
+
+    utils._record_poster(url, "abc")
+    assert generation() == before + 1
+    utils._record_poster(url, "abc")  # Downloaded again, same file
+    assert generation() == before + 1
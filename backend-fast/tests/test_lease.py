@@ -0,0 +1,30 @@
+import time
+
+from conftest import load
+
+Lease = load("collection.lease").Lease
+
+
+def test_one_holder_until_the_lease_expires(database):
+    first = Lease(database, "ingestion", ttl=0.2)
+    second = Lease(database, "ingestion", ttl=0.2)
+
+    assert first.acquire()
+    assert not second.acquire()
+    assert first.acquire()  # Renewing keeps it
+    assert second.holder()["owner"] == first.owner
+
+    time.sleep(0.3)  # The first holder stopped renewing
+    assert second.acquire()
+    assert not first.acquire()
+    assert not first.held
+
+
+def test_released_lease_is_free(database):
+    first = Lease(database, "ingestion", ttl=60)
+    second = Lease(database, "ingestion", ttl=60)
+    assert second.holder() is None
+
+    assert first.acquire()
+    first.release()
+    assert second.acquire()
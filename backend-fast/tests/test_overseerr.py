@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import sys
+
+from aiohttp import web
+
+from conftest import PACKAGE, load
+
+config = load("config")
+overseerr = load("collection.overseerr")
+
+sys.path.insert(0, str(PACKAGE / "bench"))
+import stubs  # noqa: E402
+
+
+@contextlib.asynccontextmanager
+async def serving(monkeypatch, debounce=0.1):
+    """Run the Overseerr stub and point the settings at it; yields the
+    stub's app and provider."""
+    provider = stubs.Provider(latency=0, jitter=0, rate_limit=0, throttle_ratio=0)
+    app = stubs.overseerr_app(provider)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    monkeypatch.setenv("OVERSEERR_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("REQUEST_DEBOUNCE", str(debounce))
+    config.get_settings.cache_clear()
+    try:
+        yield app, provider
+    finally:
+        await runner.cleanup()
+        config.get_settings.cache_clear()
+
+
+def availability(database):
+    with database.read() as conn:
+        return {
+            (media_type, media_id): (status, request_status)
+            for media_type, media_id, status, request_status in conn.execute(
+                "SELECT media_type, media_id, status, request_status"
+                " FROM availability"
+            )
+        }
+
+
+def requested(app):
+    return [request["media"]["tmdbId"] for request in app[stubs.REQUESTS]]
+
+
+def test_requests_wait_for_submissions_to_settle(database, monkeypatch):
+    async def main():
+        async with serving(monkeypatch) as (app, _):
+            overseerr.queue_request("movie", "1")
+            job = asyncio.create_task(overseerr.submit_requests())
+            for movie_id in ("2", "3"):
+                await asyncio.sleep(0.07)  # Within the debounce
+                overseerr.queue_request("movie", movie_id)
+            await asyncio.sleep(0.07)
+            assert app[stubs.REQUESTS] == []
+            await job
+            return requested(app)
+
+    assert asyncio.run(main()) == [1, 2, 3]
+    assert overseerr.pending_requests == {}
+    assert availability(database) == {
+        ("movie", id): (overseerr.PENDING, overseerr.REQUEST_PENDING)
+        for id in ("1", "2", "3")
+    }
+
+
+def test_failed_requests_are_retried(database, monkeypatch):
+    monkeypatch.setattr(overseerr, "RETRY_DELAY", 0.1)
+
+    async def main():
+        async with serving(monkeypatch, debounce=0) as (app, provider):
+            provider.throttle_ratio = 1  # Every request gets a 429
+            overseerr.queue_request("movie", "1")
+            job = asyncio.create_task(overseerr.submit_requests())
+            await asyncio.sleep(0.05)
+            assert overseerr.pending_requests[("movie", "1")][0] == 1
+            provider.throttle_ratio = 0
+            await job
+            return requested(app)
+
+    retried = overseerr.request_stats["retried"]
+    assert asyncio.run(main()) == [1]
+    assert overseerr.request_stats["retried"] == retried + 1
+    assert overseerr.pending_requests == {}
+
+
+def test_queued_requests_are_flushed_on_shutdown(database, monkeypatch):
+    async def main():
+        async with serving(monkeypatch, debounce=60) as (app, _):
+            overseerr.queue_request("movie", "1")
+            overseerr.queue_request("movie", "2")
+            job = asyncio.create_task(overseerr.submit_requests())
+            await asyncio.sleep(0.05)
+            job.cancel()
+            await asyncio.gather(job, return_exceptions=True)
+            await overseerr.flush_requests()
+            return requested(app)
+
+    assert asyncio.run(main()) == [1, 2]
+    assert overseerr.pending_requests == {}
+
+
+def test_sync_keeps_the_latest_request_status(database, monkeypatch):
+    async def main():
+        async with serving(monkeypatch) as (app, _):
+            app[stubs.MEDIA][("movie", 1)] = {
+                "mediaType": "movie",
+                "tmdbId": 1,
+                "status": overseerr.AVAILABLE,
+            }
+            app[stubs.MEDIA][("tv", 1000002)] = show = {
+                "mediaType": "tv",
+                "tmdbId": 1000002,
+                "tvdbId": 2,
+                "status": overseerr.PROCESSING,
+            }
+            app[stubs.REQUESTS].extend(
+                [
+                    {"id": 1, "status": 3, "media": show},  # Declined
+                    {"id": 2, "status": overseerr.REQUEST_APPROVED, "media": show},
+                ]
+            )
+            await overseerr.sync_availability()
+            synced = availability(database)
+
+            del app[stubs.MEDIA][("movie", 1)]
+            await overseerr.sync_availability()
+            return synced
+
+    assert asyncio.run(main()) == {
+        ("movie", "1"): (overseerr.AVAILABLE, None),
+        ("show", "2"): (overseerr.PROCESSING, overseerr.REQUEST_APPROVED),
+    }
+    assert availability(database) == {
+        ("show", "2"): (overseerr.PROCESSING, overseerr.REQUEST_APPROVED)
+    }
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import io
+import time
+
+import pytest
+
+from PIL import Image
+
+from conftest import load
+
+config = load("config")
+images = load("collection.images")
+utils = load("collection.utils")
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 60), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+POSTERS = {
+    "http://images.test/a.png": png("red"),
+    # The same artwork under another URL
+    "http://images.test/b.png": png("red"),
+    "http://images.test/c.png": png("blue"),
+}
+
+
+@pytest.fixture
+def posters(database, monkeypatch):
+    """Media pointing at `POSTERS`, whose downloads are stubbed; returns the
+    digests of the files the stub wrote, in download order."""
+    utils.save_to_sqlite(
+        {str(n): {"title": f"Movie {n}", "categories": ["Cat A"]} for n in range(1, 5)},
+        {},
+    )
+    with database.write() as conn:
+        conn.executemany(
+            "UPDATE movies SET details = '{}', poster_url = ? WHERE id = ?",
+            [
+                ("http://images.test/a.png", "1"),
+                ("http://images.test/b.png", "2"),
+                ("http://images.test/c.png", "3"),
+                ("http://images.test/missing.png", "4"),
+            ],
+        )
+
+    config.IMAGE_CACHE_DIR.mkdir()
+    downloads = []
+
+    async def download(session, url, tmp_path):
+        if url not in POSTERS:
+            tmp_path.write_bytes(b"<html>")
+            raise utils.PosterError("unexpected content type text/html")
+        content = POSTERS[url]
+        digest = hashlib.sha256(content).hexdigest()
+        with open(tmp_path, "wb") as f:
+            f.write(content[:10])
+            # Nothing is in the cache until the download completed
+            assert not images.source_path(config.IMAGE_CACHE_DIR, digest).exists()
+            f.write(content[10:])
+        downloads.append(digest)
+        return digest
+
+    monkeypatch.setattr(utils, "_download_image", download)
+    # Encode in a thread rather than starting a process pool
+    monkeypatch.setattr(utils, "get_image_executor", lambda: None)
+    return downloads
+
+
+def cached_posters(database):
+    with database.read() as conn:
+        return dict(
+            conn.execute(
+                "SELECT id, json_extract(details, '$.cached_poster') FROM movies"
+            )
+        )
+
+
+def failure(database, url):
+    with database.read() as conn:
+        return conn.execute(
+            "SELECT attempts, retry_at FROM poster_failures WHERE url = ?", (url,)
+        ).fetchone()
+
+
+def test_posters_are_stored_once_by_content(posters, database):
+    asyncio.run(utils.download_posters())
+
+    red = hashlib.sha256(POSTERS["http://images.test/a.png"]).hexdigest()
+    blue = hashlib.sha256(POSTERS["http://images.test/c.png"]).hexdigest()
+    assert sorted(posters) == sorted([red, red, blue])
+    assert cached_posters(database) == {
+        "1": f"/images/{red}",
+        "2": f"/images/{red}",
+        "3": f"/images/{blue}",
+        "4": None,
+    }
+
+    root = config.IMAGE_CACHE_DIR
+    assert sorted(path.name for path in root.glob("*/*.orig")) == sorted(
+        [f"{red}.orig", f"{blue}.orig"]
+    )
+    assert images.has_variants(root, red) and images.has_variants(root, blue)
+    # Complete and failed downloads alike leave no temporary file behind
+    assert list((root / "tmp").iterdir()) == []
+    assert not list(root.glob("**/*.tmp"))
+
+
+def test_failed_posters_back_off_doubling(posters, database, monkeypatch):
+    url = "http://images.test/missing.png"
+    interval = config.get_settings().poster_retry_interval
+    asyncio.run(utils.download_posters())
+    attempts, retry_at = failure(database, url)
+    assert attempts == 1
+    assert retry_at == pytest.approx(time.time() + interval, abs=5)
+
+    # Not retried until its retry time
+    assert utils._pending_posters() == []
+
+    for attempt in range(2, 11):
+        utils._record_poster_failure(url, "PosterError()")
+        attempts, retry_at = failure(database, url)
+        assert attempts == attempt
+        assert retry_at == pytest.approx(
+            time.time() + min(interval * 2 ** (attempt - 1), 86400), abs=5
+        )
+
+    # A later success clears the failure
+    monkeypatch.setitem(POSTERS, url, png("green"))
+    with database.write() as conn:
+        conn.execute("UPDATE poster_failures SET retry_at = 0")
+    asyncio.run(utils.download_posters())
+    assert failure(database, url) is None
+    assert cached_posters(database)["4"] is not None
@@ -0,0 +1,51 @@
+import sqlite3
+import time
+
+from conftest import load
+
+config = load("config")
+profiling = load("collection.profiling")
+
+
+def slow_connection(threshold=0.01):
+    conn = sqlite3.connect(
+        ":memory:", isolation_level=None, factory=profiling.SlowQueryConnection
+    )
+    conn.slow_query_seconds = threshold
+    conn.create_function("pause", 1, lambda seconds: time.sleep(seconds) or seconds)
+    conn.execute("CREATE TABLE t (value)")
+    profiling.slow_queries.clear()
+    return conn
+
+
+def logged():
+    return [(entry["sql"], entry["rows"]) for entry in profiling.slow_queries]
+
+
+def test_connection_shortcuts_are_timed():
+    conn = slow_connection()
+    conn.execute("SELECT pause(?)", (0,))
+    assert logged() == []
+
+    conn.execute("SELECT pause(?)", (0.02,))
+    conn.executemany("INSERT INTO t VALUES (pause(?))", [(0.01,), (0.01,)])
+    conn.executescript("SELECT pause(0.02);")
+    assert logged() == [
+        ("SELECT pause(?)", None),
+        ("INSERT INTO t VALUES (pause(?))", 2),
+        ("SELECT pause(0.02);", None),
+    ]
+    assert profiling.slow_queries[0]["parameters"] == [0.02]
+
+
+def test_zero_threshold_logs_every_statement(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SLOW_QUERY_MS", "0")
+    config.get_settings.cache_clear()
+    try:
+        conn = config.get_db_connection()
+    finally:
+        config.get_settings.cache_clear()
+    profiling.slow_queries.clear()
+    conn.execute("SELECT 1")
+    assert logged() == [("SELECT 1", None)]
@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import types
+
+import pytest
+
+from conftest import load
+
+ratelimit = load("collection.ratelimit")
+utils = load("collection.utils")
+
+
+class Clock:
+    """Stands in for `time` and `asyncio.sleep` in the rate limiter, so
+    waits are counted instead of slept."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    monkeypatch.setattr(
+        ratelimit,
+        "asyncio",
+        types.SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep),
+    )
+    return clock
+
+
+def acquire(bucket, times):
+    async def main():
+        return [await bucket.acquire() for _ in range(times)]
+
+    return asyncio.run(main())
+
+
+def test_burst_is_served_at_once_then_tokens_refill_at_rate(clock):
+    bucket = ratelimit.TokenBucket(rate=4, burst=3)
+    assert acquire(bucket, 3) == [0, 0, 0]
+    assert acquire(bucket, 2) == [0.25, 0.25]
+
+    # Idle time refills the bucket, but never past the burst
+    clock.now += 0.5
+    assert acquire(bucket, 2) == [0, 0]
+    assert acquire(bucket, 1) == [0.25]
+    clock.now += 60
+    assert acquire(bucket, 4) == [0, 0, 0, 0.25]
+
+
+def test_throttling_pauses_and_slows_the_bucket(clock):
+    bucket = ratelimit.TokenBucket(rate=4, burst=3, min_rate=1)
+    bucket.throttled(retry_after=5)
+    assert bucket.rate == 2
+    # Paused for the Retry-After, then refilling at half the rate
+    assert acquire(bucket, 1) == [5]
+    assert acquire(bucket, 3) == [0, 0, 0.5]
+
+    for _ in range(5):
+        bucket.throttled()
+    assert bucket.rate == 1
+    bucket.succeeded()
+    assert bucket.rate == 1.04
+
+
+class Response:
+    def __init__(self, status, headers=None, data=None):
+        self.status = status
+        self.headers = headers or {}
+        self.data = data
+
+    async def json(self):
+        return self.data
+
+
+class Session:
+    """Answers each GET with the next of `responses`."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    @contextlib.asynccontextmanager
+    async def get(self, url, headers=None):
+        self.requests += 1
+        yield self.responses.pop(0)
+
+
+@pytest.fixture
+def limiter(clock, monkeypatch):
+    limiter = ratelimit.RateLimiter({"default": (10, 10)}, {})
+    monkeypatch.setattr(utils, "get_rate_limiter", lambda: limiter)
+    monkeypatch.setattr(utils.asyncio, "sleep", clock.sleep)
+    return limiter
+
+
+def test_fetch_json_waits_out_retry_after(database, clock, limiter):
+    session = Session(
+        [
+            Response(429, {"Retry-After": "7"}),
+            Response(200, data={"id": 1}),
+        ]
+    )
+    started = clock.now
+    data = asyncio.run(utils.fetch_json(session, "http://provider.test/movie/1"))
+
+    assert data == {"id": 1}
+    assert session.requests == 2
+    # The pause is the bucket's, with no backoff on top of it
+    assert clock.now - started == pytest.approx(7)
+    assert limiter.counters["default"]["throttled"] == 1
+    assert limiter.counters["default"]["retries"] == 1
+
+
+def test_fetch_json_backs_off_without_retry_after(database, clock, limiter):
+    session = Session([Response(503), Response(503), Response(200, data={"id": 1})])
+    data = asyncio.run(utils.fetch_json(session, "http://provider.test/movie/1"))
+
+    assert data == {"id": 1}
+    assert clock.sleeps == [1, 2]
+    assert limiter.counters["default"]["errors"] == 2
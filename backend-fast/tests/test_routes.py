@@ -0,0 +1,104 @@
+import orjson
+import pytest
+
+from conftest import load
+
+routes = load("collection.routes")
+utils = load("collection.utils")
+
+
+@pytest.fixture
+def library(database):
+    movies = {
+        str(n): {"title": f"Movie {n}", "categories": ["Cat A"], "type": "movie"}
+        for n in range(1, 24)
+    }
+    shows = {
+        str(n): {"title": f"Show {n}", "categories": ["Cat A"], "type": "show"}
+        for n in range(100, 111)
+    }
+    utils.save_to_sqlite(movies, shows)
+    with database.write() as conn:
+        # Ratings with ties, and some missing, to exercise the cursor's tie break
+        conn.executemany(
+            "UPDATE movies SET details = json_object('vote_average', ?) WHERE id = ?",
+            [(n % 4 if n % 5 else None, str(n)) for n in range(1, 24)],
+        )
+    return database
+
+
+def walk(list_page, page_size):
+    """Every page of a listing, following the cursors."""
+    ids, cursor = [], None
+    while True:
+        page = list_page(page=1, page_size=page_size, cursor=cursor)
+        ids += [_id(media) for media in page["data"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return ids, page["total"]
+
+
+def numbered(list_page, page_size, total):
+    ids = []
+    for number in range(1, total // page_size + 2):
+        ids += [
+            _id(media) for media in list_page(page=number, page_size=page_size)["data"]
+        ]
+    return ids
+
+
+def _id(media):
+    media = orjson.loads(orjson.dumps(media))
+    return media["type"], media["id"]
+
+
+@pytest.mark.parametrize("sort", [None, "title", "rating"])
+@pytest.mark.parametrize("order", [None, "asc"])
+def test_cursor_pages_match_numbered_pages(library, sort, order):
+    def list_page(page, page_size, cursor=None):
+        return routes.list_media_by_category(
+            "Cat A", page, page_size, cursor, sort=sort, order=order
+        )
+
+    ids, total = walk(list_page, 4)
+    assert total == 34
+    assert len(set(ids)) == 34
+    assert ids == numbered(list_page, 4, total)
+
+
+def test_sorted_movie_cursor(library):
+    def list_page(page, page_size, cursor=None):
+        return routes.paginated_movies(page, page_size, "", cursor, sort="rating")
+
+    ids, total = walk(list_page, 5)
+    assert len(set(ids)) == total == 23
+    assert ids == numbered(list_page, 5, total)
+
+
+def test_genre_listings_follow_details_changes(library):
+    def drama(sort, in_category=False):
+        filters = routes.MediaFilters(genre="Drama")
+        if in_category:
+            page = routes.list_media_by_category(
+                "Cat A", 1, 50, filters=filters, sort=sort
+            )
+        else:
+            page = routes.paginated_movies(1, 50, "", filters=filters, sort=sort)
+        return [orjson.loads(orjson.dumps(media)) for media in page["data"]]
+
+    with library.write() as conn:
+        conn.executemany(
+            "UPDATE movies SET details = json_object('vote_average', ?,"
+            " 'genres', json_array(json_object('name', ?))) WHERE id = ?",
+            [(n % 7, "Drama" if n % 2 else "Comedy", str(n)) for n in range(1, 24)],
+        )
+    expected = sorted(((n % 7, str(n)) for n in range(1, 24, 2)), reverse=True)
+    assert [(m["rating"], m["id"]) for m in drama("rating")] == expected
+
+    with library.write() as conn:
+        conn.execute(
+            "UPDATE movies SET title = 'A first', details = json_set(details,"
+            " '$.vote_average', 9.5) WHERE id = '23'"
+        )
+    assert drama("rating")[0]["id"] == "23"
+    assert drama("title", in_category=True)[0]["title"] == "A first"
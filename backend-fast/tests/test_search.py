@@ -0,0 +1,80 @@
+import json
+
+import orjson
+import pytest
+
+from conftest import load
+
+routes = load("collection.routes")
+utils = load("collection.utils")
+
+
+@pytest.fixture
+def library(database):
+    utils.save_to_sqlite(
+        {
+            "1": {"title": "Amélie", "categories": ["Cat A"]},
+            "2": {"title": "Spirited Away", "categories": ["Cat A"]},
+            "3": {"title": "The Wind Rises", "categories": ["Cat A"]},
+            "4": {"title": "Porco Rosso", "categories": ["Cat A"]},
+        },
+        {"100": {"title": "Cowboy Bebop", "categories": ["Cat B"]}},
+    )
+    with database.write() as conn:
+        conn.execute(
+            "UPDATE movies SET details = ? WHERE id = '2'",
+            (
+                json.dumps(
+                    {
+                        "original_title": "Sen to Chihiro no Kamikakushi",
+                        "alternative_titles": {"titles": [{"title": "Chihiro"}]},
+                    }
+                ),
+            ),
+        )
+        conn.execute(
+            "UPDATE movies SET details = ? WHERE id = '4'",
+            (json.dumps({"overview": "A pilot cursed to live as a pig; spirited."}),),
+        )
+        conn.execute(
+            "UPDATE shows SET details = ? WHERE id = '100'",
+            (json.dumps({"data": {"aliases": [{"name": "Kaubōi Bibappu"}]}}),),
+        )
+    return database
+
+
+def search(query, **kwargs):
+    results = orjson.loads(orjson.dumps(routes.search_media(query, 1, 10, **kwargs)))
+    return [(media["type"], media["id"]) for media in results["data"]]
+
+
+def test_words_match_as_prefixes(library):
+    assert search("spir aw") == [("movie", "2")]
+    assert search("wind ri") == [("movie", "3")]
+
+
+def test_diacritics_are_folded(library):
+    assert search("amelie") == [("movie", "1")]
+    assert search("AMÉLIE") == [("movie", "1")]
+    assert search("kauboi") == [("show", "100")]
+
+
+def test_original_titles_and_aliases_match(library):
+    assert search("chihiro") == [("movie", "2")]
+    assert search("kamikakushi") == [("movie", "2")]
+
+
+def test_title_matches_rank_above_overview_matches(library):
+    assert search("spirited") == [("movie", "2"), ("movie", "4")]
+
+
+@pytest.mark.parametrize("query", ['"', "*", '"*', ' " * " ', "-", "^"])
+def test_queries_without_words_match_nothing(library, query):
+    assert search(query) == []
+    assert routes.search_media(query, 1, 10)["total"] == 0
+    assert routes.paginated_movies(1, 10, query)["total"] == 0
+
+
+def test_blank_queries_list_everything(library):
+    assert routes.search_media(" ", 1, 10)["total"] == 5
+    assert routes.paginated_movies(1, 10, "")["total"] == 4
@@ -0,0 +1,54 @@
+import orjson
+import time
+
+from conftest import load
+
+suggest = load("collection.suggest")
+utils = load("collection.utils")
+
+
+def titles(index, query):
+    return [card["title"] for card in orjson.loads(orjson.dumps(index.suggest(query)))]
+
+
+def test_title_generation_ignores_other_changes(database):
+    utils.save_to_sqlite({"1": {"title": "Alien", "categories": ["A"]}}, {})
+    generation = suggest._title_generation()
+
+    with database.write() as conn:
+        conn.execute("UPDATE movies SET categories = '[\"B\"]'")
+        conn.execute("UPDATE movies SET details = json_object('overview', 'Space')")
+    assert suggest._title_generation() == generation
+
+    with database.write() as conn:
+        conn.execute("UPDATE movies SET details = json_object('popularity', 9.5)")
+    assert suggest._title_generation() == generation + 1
+
+
+def test_refresh_checks_and_rebuilds_at_most_once_per_interval(database, monkeypatch):
+    utils.save_to_sqlite({"1": {"title": "Alien", "categories": ["A"]}}, {})
+    checks = []
+    title_generation = suggest._title_generation
+    monkeypatch.setattr(
+        suggest,
+        "_title_generation",
+        lambda: checks.append(1) or title_generation(),
+    )
+    index = suggest.SuggestIndex()
+    index.refresh()
+    assert titles(index, "al") == ["Alien"]
+
+    with database.write() as conn:
+        conn.execute("UPDATE movies SET title = 'Aliens'")
+    for _ in range(5):
+        index.refresh()
+    assert len(checks) == 1
+    assert titles(index, "al") == ["Alien"]
+
+    monkeypatch.setattr(suggest, "CHECK_INTERVAL", 0)
+    monkeypatch.setattr(suggest, "REBUILD_INTERVAL", 0)
+    index.refresh()
+    deadline = time.monotonic() + 5
+    while index.stats()["building"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert titles(index, "al") == ["Aliens"]
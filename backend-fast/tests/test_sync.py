@@ -0,0 +1,105 @@
+import json
+import os
+
+from conftest import load
+
+utils = load("collection.utils")
+
+
+def write_report(path, categories):
+    """Write a report listing `{category: {movie_id: title}}`."""
+    with open(path, "w") as f:
+        for category, movies in categories.items():
+            f.write(f"{json.dumps(category)}:\n")
+            f.write('  "Movies Missing (TMDb IDs)":\n')
+            for movie_id, title in movies.items():
+                f.write(f"    {movie_id}: {json.dumps(title)}\n")
+
+
+def movies(database):
+    with database.read() as conn:
+        return {
+            id: (title, json.loads(categories), details)
+            for id, title, categories, details in conn.execute(
+                "SELECT id, title, categories, details FROM movies"
+            )
+        }
+
+
+def touch(path, seconds):
+    """Move the file's mtime, as a rewrite a moment later would."""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+
+def test_sync_applies_changed_and_removed_files(database, tmp_path):
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    write_report(reports / "a.yml", {"Cat A": {1: "One", 2: "Two"}})
+    write_report(reports / "b.yml", {"Cat B": {2: "Two", 3: "Three"}})
+
+    utils.sync_yaml_directory(str(reports))
+    assert movies(database) == {
+        "1": ("One", ["Cat A"], None),
+        "2": ("Two", ["Cat A", "Cat B"], None),
+        "3": ("Three", ["Cat B"], None),
+    }
+
+    stats = utils.sync_yaml_directory(str(reports))
+    assert stats["files"]["read"] == 0
+
+    write_report(reports / "a.yml", {"Cat A": {1: "One"}})
+    touch(reports / "a.yml", 1)
+    (reports / "b.yml").unlink()
+    utils.sync_yaml_directory(str(reports))
+    assert movies(database) == {"1": ("One", ["Cat A"], None)}
+
+
+def test_unparsable_report_keeps_its_media(database, tmp_path):
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    report = reports / "a.yml"
+    write_report(report, {"Cat A": {1: "One", 2: "Two"}})
+    utils.sync_yaml_directory(str(reports))
+    with database.write() as conn:
+        conn.execute("UPDATE movies SET details = '{\"id\": 1}' WHERE id = '1'")
+    before = movies(database)
+
+    # Kometa caught mid-rewrite: a broken file, then an empty one
+    report.write_text("Cat A: [unclosed")
+    touch(report, 1)
+    stats = utils.sync_yaml_directory(str(reports))
+    assert stats["files"] == {"read": 0, "failed": 1, "changed": 0, "removed": 0}
+    assert movies(database) == before
+
+    report.write_text("")
+    touch(report, 2)
+    utils.sync_yaml_directory(str(reports))
+    assert movies(database) == before
+
+    # Once the rewrite is complete the file is read again
+    write_report(report, {"Cat A": {1: "One"}})
+    touch(report, 3)
+    utils.sync_yaml_directory(str(reports))
+    assert movies(database) == {"1": ("One", ["Cat A"], '{"id": 1}')}
+
+
+def test_first_sync_drops_media_saved_before_the_manifest(database, tmp_path):
+    # Saved straight from parsed reports, as before `yaml_entries` existed
+    utils.save_to_sqlite(
+        {
+            "1": {"title": "One", "categories": ["Cat A"]},
+            "2": {"title": "Gone", "categories": ["Cat Old"]},
+        },
+        {"3": {"title": "Gone Show", "categories": ["Cat Old"]}},
+    )
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    write_report(reports / "a.yml", {"Cat A": {1: "One"}})
+
+    stats = utils.sync_yaml_directory(str(reports))
+    assert movies(database) == {"1": ("One", ["Cat A"], None)}
+    assert stats["shows"]["removed"] == 1
+    with database.read() as conn:
+        categories = [row[0] for row in conn.execute("SELECT name FROM categories")]
+    assert categories == ["Cat A"]
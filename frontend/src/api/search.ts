@@ -1,6 +1,10 @@
 import http from "./http";
-import { IPaginatedResponse, IMedia } from "./types";
+import { IPaginatedResponse, IMedia, ISuggestion } from "./types";
 
 export function search(query: string): Promise<IPaginatedResponse<IMedia>> {
   return http.get(`/search?q=${query}`);
 }
+
+export function suggest(query: string, limit = 10): Promise<ISuggestion[]> {
+  return http.get("/suggest", { params: { query, limit } });
+}
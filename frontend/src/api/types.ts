@@ -27,3 +27,11 @@ export enum PAGE_SIZE {
   FIFTY = "50",
   HUNDRED = "100",
 }
+
+export interface ISuggestion {
+  id: string;
+  title: string;
+  type: "movie" | "show";
+  year: number | null;
+  poster: string | null;
+}
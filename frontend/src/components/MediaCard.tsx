@@ -22,7 +22,7 @@ export function MediaCard({ media }: Props) {
         <Image
           alt={`${media.title} poster`}
           className="rounded-xl"
-          src={API_URL + media.details?.cached_poster}
+          src={media.poster ? API_URL + media.poster : undefined}
           width="100%"
           height="100%"
           isBlurred
@@ -8,8 +8,14 @@ export interface IMedia {
   id: number;
   title: string;
   categories: string[];
-  details: object;
   type: "movie" | "show";
+  poster?: string | null;
+  year?: number | null;
+  rating?: number | null;
+  runtime?: number | null;
+  status?: string | null;
+  overview?: string | null;
+  details?: object | null;
 }
 
 export interface IMovie extends IMedia {